@@ -1,11 +1,26 @@
+import contextlib
+import contextvars
 import functools
+import logging
 import streamlit as st
-from streamlit import logger
-import anthropic
 from anthropic import APIError, APIConnectionError, APITimeoutError, RateLimitError, APIStatusError
-from utils import gs
+from utils import gs, llm, log
+from utils.config_refresher import get_config_refresher
+from utils.context import DEFAULT_KEEP_TURNS, ConversationWindow
+from utils.engine import get_engine
+from utils.metrics import TurnTimer, get_latency_stats
+from utils.response_cache import ReplayStream, get_response_cache
+from utils.retry import DEFAULT_POLICY, STREAM_ERRORS
+from utils.scheduler import QueueTimeoutError, estimate_tokens, get_scheduler
+from utils.session_store import get_session_store
+from utils.sheet_writer import get_sheet_writer, mask_personal_info
+from utils.stream_buffer import StreamBuffer
+from utils.transcript import EXPORT_FORMATS, TranscriptStore, format_elapsed
+from utils.turn_log import KST, TurnLog, get_session_memory_stats
+from utils.warmup import get_cache_warmer
 import time
-from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
 if "processing" not in st.session_state:
     st.session_state.processing = False
@@ -14,99 +29,17 @@ def disable_input(value):
     st.session_state.processing = value
 
 def now_kst():
-    kst = timezone(timedelta(hours=9))
-    return datetime.now(kst)
+    return datetime.now(KST)
 
-def format_elapsed(seconds):
-    if seconds is None:
-        return "-"
-
-    seconds = max(0, int(round(seconds)))
-    minutes, seconds = divmod(seconds, 60)
-    hours, minutes = divmod(minutes, 60)
-    if hours:
-        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-    return f"{minutes:02d}:{seconds:02d}"
-
-def format_message_meta(role, meta):
-    meta = meta or {}
-
-    timestamp = meta.get("timestamp")
+def format_message_meta(turn):
+    timestamp = turn.timestamp
     timestamp_text = timestamp.strftime("%H:%M:%S") if timestamp else "--:--:--"
-    elapsed_text = format_elapsed(meta.get("elapsed_seconds"))
-    if role == "user":
+    elapsed_text = format_elapsed(turn.elapsed_seconds)
+    if turn.role == "user":
         return f"입력 시각 {timestamp_text} · 생각 소요 {elapsed_text}"
-    if role == "assistant":
+    if turn.role == "assistant":
         return f"응답 시각 {timestamp_text} · 생성 소요 {elapsed_text}"
     return ""
-
-def clean_text_for_txt(text):
-    replacements = {
-        "1️⃣": "1.",
-        "2️⃣": "2.",
-        "3️⃣": "3.",
-        "🟦": "[찬성]",
-        "🟥": "[반대]",
-    }
-    cleaned = str(text)
-    for old, new in replacements.items():
-        cleaned = cleaned.replace(old, new)
-
-    return "".join(
-        char
-        for char in cleaned
-        if char == "\n" or char == "\t" or not (
-            0x1F000 <= ord(char) <= 0x1FAFF
-            or 0x2600 <= ord(char) <= 0x27BF
-            or ord(char) in (0x200D, 0x20E3)
-            or 0xFE00 <= ord(char) <= 0xFE0F
-        )
-    )
-
-def build_conversation_txt(messages, message_meta=None, user_name=None):
-    created_at = now_kst().strftime("%Y-%m-%d %H:%M:%S KST")
-    display_name = clean_text_for_txt(user_name or "unknown")
-    role_labels = {
-        "user": "[학생]",
-        "assistant": "[챗봇]",
-    }
-    lines = [
-        "=" * 60,
-        f"대화명: {display_name}",
-        f"생성 시각: {created_at}",
-    ]
-
-    message_meta = message_meta or {}
-
-    for idx, message in enumerate(messages):
-        role = message.get("role")
-        if role not in role_labels:
-            continue
-
-        content = clean_text_for_txt(message.get("content", "")).strip()
-        meta = message_meta.get(idx) or {}
-        timestamp = meta.get("timestamp")
-        timestamp_text = timestamp.strftime("%H:%M:%S") if timestamp else "--:--:--"
-        elapsed_text = format_elapsed(meta.get("elapsed_seconds"))
-        lines.extend([
-            "=" * 60,
-            role_labels[role],
-        ])
-        if role == "user":
-            lines.append(f"입력 시각: {timestamp_text}")
-            lines.append(f"생각 소요: {elapsed_text}")
-        else:
-            lines.append(f"응답 시각: {timestamp_text}")
-            lines.append(f"생성 소요: {elapsed_text}")
-        lines.extend([
-            "------------",
-            "",
-            "내용:",
-        ])
-        lines.append(content)
-        lines.append("")
-
-    return "\n".join(lines).rstrip() + "\n"
 
 def initialize(api_key, nick_name):
     """
@@ -117,31 +50,190 @@ def initialize(api_key, nick_name):
     nick_name (str): 사용자의 닉네임
 
     이 함수는 다음과 같은 작업을 수행합니다:
-    1. Anthropic API 클라이언트를 초기화합니다.
+    1. 프로세스 공용 Anthropic API 클라이언트를 가져옵니다.
     2. Google Sheets 연결을 설정합니다.
     3. 사용자별 워크시트를 가져오거나 생성합니다.
+    4. 현재 시스템 프롬프트의 프롬프트 캐시를 백그라운드에서 미리 데웁니다. (프로세스에서 한 번)
+    5. 로컬 세션 저장소에서 세션을 열고, 이어하기 토큰이 맞으면 저장된 대화를 되살립니다. (restore_session)
 
-    이 함수는 이미 초기화가 완료된 경우 아무 작업도 수행하지 않습니다.
+    같은 (시트 URL, 대화명)으로 이미 초기화한 세션에서는 아무 작업도 수행하지 않습니다.
+    main()은 실행마다 대화명을 한 번만 정해 한 번만 호출하므로, 두 입력칸의 값이 달라도 번갈아 초기화하지 않습니다.
+    워크시트 연결은 백그라운드에서 진행되므로, 연결이 끝나기 전에도 대화를 시작할 수 있습니다.
     """
-    if "bot" and "sheet" in st.session_state:
+    sheet_url = st.session_state["setupInfo"]["url"]
+    init_key = (sheet_url, nick_name)
+    if st.session_state.get("init_key") == init_key:
         return
     
-    log_p("초기화 시작")
+    log_p("초기화 시작", user_name = nick_name)
     # Anthropic
     st.session_state["api_key"] = api_key
-    st.session_state["bot"] = anthropic.Anthropic(api_key = api_key)
+    st.session_state["bot"] = llm.get_client(api_key)
     st.session_state["user_name_1"] = nick_name
 
-    # Google Spread Sheet
-    gc = gs.get_authorize()
-    sheet_url = st.session_state["setupInfo"]["url"]
-    st.session_state["doc"] = gc.open_by_url(sheet_url)
-    st.session_state["sheet"] = gs.get_worksheet(st.session_state["doc"], nick_name)
+    # Google Spread Sheet (스프레드시트 열기까지 백그라운드에서 하므로 첫 연결도 화면을 막지 않습니다.)
+    st.session_state.pop("sheet", None)
+    st.session_state["sheet_future"] = gs.connect_worksheet(sheet_url, nick_name)
+    restore_session(nick_name)
+    st.session_state["init_key"] = init_key
+    get_cache_warmer().warm(api_key, st.session_state["setupInfo"])
     log_p("초기화 완료")
 
+RESUME_PARAM = "resume"
+
+def restore_session(nick_name):
+    """
+    로컬 세션 저장소(utils/session_store.py)에서 이 대화명의 세션을 엽니다.
+
+    Parameters:
+    nick_name (str): 사용자의 닉네임
+
+    - 아직 대화가 없고 주소창의 ?resume= 토큰이 이 대화명의 세션이면, 저장된 대화를 그대로 되살립니다.
+      모바일 브라우저 연결이 끊기거나 앱이 다시 시작되어도 학생이 지난 질문을 다시 보내지 않아도 됩니다.
+    - 그 밖에는 새 세션과 토큰을 만들어 주소창에 남깁니다. 이미 대화 중이면(대화명 변경) 지금까지의 대화를 새 세션에 옮겨 적습니다.
+    - 로컬 저장도 "정보" 시트의 save_transcript(B17)를 따릅니다. off이면 세션을 열지 않고 이어하기도 쓰지 않으며,
+      private이면 개인정보를 가린 대화만 저장하므로 되살린 대화도 가려진 채로 보입니다. (save_session_turns)
+    - 되살린 대화는 Google Sheet에 다시 저장하지 않습니다. 시트 저장도 B17을 따르므로, 저장했다면 이미 시트에 있습니다.
+    """
+    if st.session_state["setupInfo"].get("save_transcript", "off") == "off":
+        st.session_state.pop("resume_token", None)
+        st.query_params.pop(RESUME_PARAM, None)
+        return
+
+    store = get_session_store()
+    classroom = llm.key_fingerprint(st.session_state["setupInfo"]["url"])
+    messages = st.session_state.get("messages", [])
+    token = st.query_params.get(RESUME_PARAM) if len(messages) <= 1 else None
+
+    token, turns = store.open_session(classroom, nick_name, token)
+    st.session_state["resume_token"] = token
+    st.query_params[RESUME_PARAM] = token
+
+    if turns:
+        st.session_state.messages = TurnLog(st.session_state["setupInfo"]['system'])
+        for role, content, timestamp, elapsed_seconds in (turn[1:] for turn in turns):
+            st.session_state.messages.add(role, content, timestamp, elapsed_seconds)
+            if role == "assistant" and timestamp:
+                st.session_state.last_assistant_done_at = timestamp
+        log_p("세션 되살림", turns = len(turns))
+    elif len(messages) > 1:
+        save_session_turns(messages, range(1, len(messages)))
+
+def save_session_turns(messages, indices):
+    """
+    끝난 턴을 로컬 세션 저장소의 저장 큐에 넣습니다.
+
+    Parameters:
+    messages (TurnLog): 현재 세션의 대화 기록
+    indices (iterable): 저장할 메시지 인덱스
+
+    Google Sheet 저장(gs.add_Content)과 같이 save_transcript(B17)가 off이거나 열린 세션(이어하기 토큰)이 없으면
+    저장하지 않고, private이면 이메일/전화번호/주민등록번호를 가리고 저장합니다.
+    """
+    mode = st.session_state["setupInfo"].get("save_transcript", "off")
+    token = st.session_state.get("resume_token")
+    if mode == "off" or not token:
+        return
+
+    mask = mask_personal_info if mode == "private" else (lambda text: text)
+    get_session_store().append(token, [
+        (idx, messages[idx].role, mask(messages[idx].content), messages[idx].timestamp, messages[idx].elapsed_seconds)
+        for idx in indices
+    ])
+
 def set_class_info():
-    log_p("클래스 정보 설정")
-    st.session_state['setupInfo'] = gs.getSetupInfo()
+    """
+    백그라운드에서 새로고침되는 최신 설정을 세션에 반영합니다.
+    설정 번호(version)가 세션에 저장된 것과 같으면 아무 작업도 하지 않습니다.
+    """
+    config = get_config_refresher().current()
+    if st.session_state.get("config_version") == config.version:
+        return
+
+    log_p("클래스 정보 설정", version = config.version)
+    st.session_state['setupInfo'] = config.values
+    st.session_state['config_version'] = config.version
+
+def render_config_status():
+    """
+    사이드바에 현재 설정 번호와 읽은 시각을 보여 줍니다.
+    저장된 스냅샷으로 시작해 아직 시트와 맞춰 보지 않았거나, 설정 시트를 한동안 읽지 못했으면 알려 줍니다.
+    """
+    status = get_config_refresher().status()
+    loaded_at = datetime.fromtimestamp(status["loaded_at"], now_kst().tzinfo).strftime("%H:%M:%S")
+    source = " · 저장된 설정" if status["source"] == "snapshot" else ""
+    st.caption(f"설정 v{status['version']} · {loaded_at}{source}")
+    if status["stale"]:
+        st.warning(f"설정 시트를 확인하지 못해 {status['age_seconds'] // 60}분 전 설정으로 동작 중입니다.")
+
+def is_operator():
+    """
+    운영자 화면을 볼 수 있는지 확인합니다.
+    Secrets의 ops_token과 URL의 ?ops= 값이 같을 때만 True입니다.
+    """
+    token = st.secrets.get("ops_token", "")
+    return bool(token) and st.query_params.get("ops") == token
+
+def render_ops_panel():
+    """
+    운영자용 상태 정보(연결 풀 등)를 사이드바에 출력합니다.
+    """
+    with st.expander("운영 정보"):
+        st.caption("Anthropic 연결 풀")
+        st.json(llm.get_registry().stats())
+        st.caption("스트리밍 엔진")
+        st.json(get_engine().stats())
+        st.caption("AI 요청 대기열")
+        st.json(get_scheduler().stats())
+        st.caption("프롬프트 캐시 미리 데우기 / 첫 턴 TTFT")
+        st.json(get_cache_warmer().stats())
+        st.caption("응답 속도 (모델별 최근 턴 p50/p95/p99)")
+        st.json(get_latency_stats().stats())
+        st.caption("응답 캐시 (B18, 같은 요청의 답변 재사용)")
+        st.json(get_response_cache().stats())
+        st.caption("수업별 토큰 사용량 / 프롬프트 캐시 적중률")
+        st.json(llm.get_usage_stats().stats())
+        st.caption("세션 저장소 (로컬 SQLite)")
+        st.json(get_session_store().stats())
+        st.caption("세션 대화 기록 메모리 (열린 세션, 세션당 바이트)")
+        messages = st.session_state.get("messages")
+        st.json(dict(get_session_memory_stats().stats(), this_session_bytes = messages.memory_bytes() if messages else None))
+        st.caption("대화 기록 시트 저장 큐")
+        st.json(get_sheet_writer().stats())
+        st.caption("워크시트 목록 캐시")
+        st.json(gs.get_worksheet_index().stats())
+        st.caption("학생 시트 생성")
+        st.json(gs.get_provisioner().stats())
+        st.caption("설정 새로고침")
+        st.json(get_config_refresher().status())
+        if st.button("설정 지금 다시 읽기", key="ops_config_refresh"):
+            refresh_config()
+
+    with st.expander("학생 시트 미리 만들기"):
+        roster = st.text_area("학생 대화명 (한 줄에 한 명)", key="ops_roster")
+        if st.button("시트 만들기", key="ops_provision", disabled=not roster.strip()):
+            provision_roster(roster.splitlines())
+
+def refresh_config():
+    """
+    새로고침 주기를 기다리지 않고 설정 시트를 바로 다시 읽습니다.
+    """
+    try:
+        changed = get_config_refresher().refresh()
+    except Exception as e:
+        st.error(f"설정을 읽지 못했습니다. 이전 설정을 계속 사용합니다. ({e})")
+        return
+    set_class_info()
+    st.success("새 설정을 반영했습니다." if changed else "바뀐 설정이 없습니다.")
+
+def provision_roster(names):
+    """
+    수업 전에 학생 명단의 워크시트와 "수업요약" 링크를 batch_update 한 번으로 만듭니다.
+    """
+    doc = gs.get_spreadsheet(st.session_state["setupInfo"]["url"])
+    with st.spinner("학생 시트를 만드는 중..."):
+        result = gs.get_provisioner().provision_roster(doc, names)
+    st.success(f"새로 만든 시트 {len(result['created'])}개, 이미 있던 시트 {len(result['existing'])}개")
 
 def process_data(function_name):
     with st.spinner('마무리 하는 중~'):
@@ -199,11 +291,13 @@ def hide_streamlit_chrome():
 def main():
     hide_streamlit_chrome()
 
-    if "setupInfo" not in st.session_state:
-        set_class_info()
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = log.new_session_id()
+    log.bind_session(st.session_state["session_id"])
 
-    if "message_meta" not in st.session_state:
-        st.session_state.message_meta = {}
+    set_class_info()
+    # 설정 변경 알림 등록은 서비스가 꺼져 있어도 해 둡니다. (B2를 켜는 순간 프롬프트 캐시를 데우도록)
+    get_cache_warmer()
 
     if "last_assistant_done_at" not in st.session_state:
         st.session_state.last_assistant_done_at = now_kst()
@@ -215,125 +309,226 @@ def main():
         st.title("❤🥰지금은 휴식중입니다.🥰❤")
         return
 
-    # 사이드바 
-    # user_name = ''
+    # 답변 중에는 fragment만 실행되므로, 전체 실행이 processing=True로 시작했다면 사이드바/대화명 위젯을 눌러
+    # 진행 중인 턴이 중간에 멈춘 것입니다. 답을 받지 못한 학생 메시지를 지우고 입력창을 다시 켭니다.
+    if st.session_state.processing and "messages" in st.session_state:
+        log_p("턴 중단", logging.WARNING)
+        delete_message()
+        disable_input(False)
+    st.session_state.pop("pending_prompt", None)
+
+    # 대화명은 실행마다 한 번만 정합니다. 입력칸 값은 위젯을 그리기 전에도 session_state에 있으므로
+    # 위쪽 입력칸 -> 사이드바 입력칸 -> 지난 대화명 순서로 고릅니다.
+    user_name = (
+        st.session_state.get("main_user_name", "").strip()
+        or st.session_state.get("sidebar_user_name", "").strip()
+        or st.session_state.get("user_name", "").strip()
+    )
+    if user_name:
+        st.session_state["user_name"] = user_name
 
+    # 사이드바 
     with st.sidebar:
         # 페이지 제목 설정
         st.title("교육용 챗봇")
 
         api_key = st.session_state["setupInfo"]["key"]
-        sidebar_name = st.text_input(
+        st.text_input(
             "대화명을 입력하세요:",
             key="sidebar_user_name",
         )
-        user_name = sidebar_name.strip() or st.session_state.get("user_name", "").strip()
 
         if api_key and user_name:
             initialize(api_key, user_name)
 
+        sheet_future = st.session_state.get("sheet_future")
+        if sheet_future is not None and sheet_future.done() and sheet_future.exception() is not None:
+            st.warning("Google Sheet 연결에 실패했습니다. 대화는 계속할 수 있습니다.")
+
         if "messages" in st.session_state and len(st.session_state.messages) > 1:
-            conversation_user_name = st.session_state.get("user_name_1", user_name)
-            current_time = now_kst()
-            safe_user_name = "".join(
-                char if char.isalnum() or char in ("-", "_") else "_"
-                for char in str(conversation_user_name or "unknown")
-            )
-            file_name = f"idebate_conversation_{safe_user_name}_{current_time.strftime('%Y%m%d_%H%M%S')}.txt"
-            st.download_button(
-                "대화 TXT 다운로드",
-                data=build_conversation_txt(
-                    st.session_state.messages,
-                    st.session_state.message_meta,
-                    conversation_user_name,
-                ).encode("utf-8-sig"),
-                file_name=file_name,
-                mime="text/plain",
-                disabled=st.session_state.processing,
-            )
+            export_format = st.selectbox("내보내기 형식", list(EXPORT_FORMATS), key="export_format")
+            render_download_button(f"대화 {export_format} 다운로드", export_format, "sidebar_download")
+
+            # 같은 대화로 평가를 두 번 만들지 않도록, 평가 뒤에 새 대화가 없으면 버튼을 끕니다.
+            evaluated = st.session_state.get("evaluated_upto") == len(st.session_state.messages)
+            if st.button("대화 마치고 평가 받기", key="end_conversation", disabled=evaluated):
+                end_conversation()
+
+        render_config_status()
+
+        if is_operator():
+            render_ops_panel()
 
 
     # 시스템 메시지 초기화
     if "messages" not in st.session_state:
-        st.session_state.messages = [{"role": "system", "content": st.session_state["setupInfo"]['system']}]
+        st.session_state.messages = TurnLog(st.session_state["setupInfo"]['system'])
 
     top_col_name, top_col_download = st.columns([2, 1])
     with top_col_name:
-        main_name = st.text_input(
+        st.text_input(
             "대화명",
             key="main_user_name",
             label_visibility="collapsed",
             placeholder="대화명",
-            disabled=st.session_state.processing,
         )
 
-    user_name = (
-        main_name.strip()
-        or sidebar_name.strip()
-        or st.session_state.get("user_name", "").strip()
-    )
-    if user_name:
-        st.session_state["user_name"] = user_name
-        if api_key:
-            initialize(api_key, user_name)
-
     with top_col_download:
         if len(st.session_state.messages) > 1:
-            conversation_user_name = st.session_state.get("user_name_1", user_name)
-            current_time = now_kst()
-            safe_user_name = "".join(
-                char if char.isalnum() or char in ("-", "_") else "_"
-                for char in str(conversation_user_name or "unknown")
-            )
-            file_name = f"idebate_conversation_{safe_user_name}_{current_time.strftime('%Y%m%d_%H%M%S')}.txt"
-            st.download_button(
-                "TXT",
-                data=build_conversation_txt(
-                    st.session_state.messages,
-                    st.session_state.message_meta,
-                    conversation_user_name,
-                ).encode("utf-8-sig"),
-                file_name=file_name,
-                mime="text/plain",
-                disabled=st.session_state.processing,
-            )
+            render_download_button("TXT", "TXT", "top_download")
 
     # 챗 메시지 출력
-    for idx, message in enumerate(st.session_state.messages):
-        if idx > 0:
-            with st.chat_message(message["role"]):
-                st.markdown(message["content"])
-                if message["role"] == "user":
-                    meta_text = format_message_meta(
-                        message["role"],
-                        st.session_state.message_meta.get(idx),
-                    )
-                    if meta_text:
-                        st.caption(meta_text)
-
-    if prompt := st.chat_input("대화 내용을 입력해 주세요.", on_submit=disable_input, args=(True,), disabled=st.session_state.processing):
+    # 지난 대화는 전체 실행 때만 그립니다. 그 뒤의 턴은 턴마다 fragment 하나(chat_turn)가 맡고, 끝난 턴의 fragment는
+    # 다시 실행되지 않으므로 대화가 길어져도 한 턴에 다시 그리는 메시지 수가 늘지 않습니다.
+    rendered_upto = len(st.session_state.messages)
+    st.session_state["rendered_upto"] = rendered_upto
+    for idx in range(1, rendered_upto):
+        render_message(st.session_state.messages[idx])
+
+    chat_turn(rendered_upto)
+
+    # 입력창은 fragment 밖에 두어야 화면 아래에 고정됩니다. 제출하면 submit_prompt()가 마지막 턴의 fragment만 다시 실행합니다.
+    st.chat_input("대화 내용을 입력해 주세요.", key="chat_prompt", on_submit=submit_prompt)
+
+def render_download_button(label, export_format, key):
+    """
+    대화 기록 다운로드 버튼을 출력합니다.
+
+    Parameters:
+    label (str): 버튼 문구
+    export_format (str): "TXT", "JSON", "CSV" 중 하나
+    key (str): 버튼 위젯 key
+
+    파일 내용은 버튼을 누를 때만 만들어지며, 세션의 TranscriptStore에
+    새로 추가된 턴만 덧붙여 사용합니다.
+    """
+    if "transcript_store" not in st.session_state:
+        st.session_state["transcript_store"] = TranscriptStore()
+
+    # 다운로드 콜백은 스크립트 실행 스레드 밖에서 호출되므로 st.session_state 대신 객체를 직접 잡아 둡니다.
+    store = st.session_state["transcript_store"]
+    messages = st.session_state.messages
+    conversation_user_name = st.session_state.get("user_name_1", st.session_state.get("user_name"))
+
+    def build_export():
+        store.sync(messages)
+        return store.export(
+            export_format,
+            conversation_user_name,
+            now_kst().strftime("%Y-%m-%d %H:%M:%S KST"),
+        )
+
+    extension, mime = EXPORT_FORMATS[export_format]
+    safe_user_name = "".join(
+        char if char.isalnum() or char in ("-", "_") else "_"
+        for char in str(conversation_user_name or "unknown")
+    )
+    file_name = f"idebate_conversation_{safe_user_name}_{now_kst().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    st.download_button(
+        label,
+        data=build_export,
+        file_name=file_name,
+        mime=mime,
+        key=key,
+        on_click="ignore",
+    )
+
+def render_message(turn):
+    """
+    대화 기록의 메시지(Turn) 하나를 화면에 출력합니다.
+    """
+    with st.chat_message(turn.role):
+        st.markdown(turn.content)
+        if turn.role == "user":
+            st.caption(format_message_meta(turn))
+
+def rerun_chat():
+    """
+    진행 중인 턴의 fragment(chat_turn)만 다시 실행합니다.
+    다시 실행된 fragment는 끝난 턴을 그리고, 그 안에 다음 턴의 fragment를 둡니다.
+
+    첫 대화가 끝난 직후에는 다운로드 버튼 등이 나타나도록 앱 전체를 다시 실행합니다.
+    """
+    if st.session_state.get("rendered_upto", 1) <= 1 and len(st.session_state.messages) > 1:
+        st.rerun()
+    st.rerun(scope="fragment")
+
+def chat_turn_key(idx):
+    return f"chat_turn_{idx}"
+
+def chat_turn(idx):
+    """
+    messages[idx]부터 시작하는 턴 하나를 맡는 fragment(run_turn)를 실행합니다.
+
+    fragment마다 key가 달라서 submit_prompt()는 마지막 턴의 fragment만 다시 실행합니다.
+    끝난 턴의 fragment는 다시 실행되지 않으므로, 한 번 그린 메시지는 전체 실행 전까지 다시 그리지 않습니다.
+    """
+    st.fragment(run_turn, key = chat_turn_key(idx))(idx)
+
+def submit_prompt():
+    """
+    입력창(chat_input)의 제출 콜백입니다. 질문을 session_state에 넘기고 마지막 턴의 fragment만 다시 실행합니다.
+
+    입력창은 fragment 밖에 있어 답변 중에도 꺼지지 않습니다. 답변 중에 새 질문을 보내면 진행 중인 턴이 멈추므로,
+    답을 받지 못한 학생 메시지를 지우고 새 질문으로 턴을 시작합니다.
+    """
+    log.bind_session(st.session_state.get("session_id"))
+    if st.session_state.processing:
+        log_p("턴 중단", logging.WARNING)
+        delete_message()
+
+    st.session_state["pending_prompt"] = st.session_state.get("chat_prompt")
+    disable_input(True)
+    st.rerun(chat_turn_key(len(st.session_state.messages)))
+
+def run_turn(idx):
+    """
+    턴 하나(학생 질문과 챗봇 답변)를 그리거나 진행하는 chat_turn() fragment의 본문입니다.
+
+    - 턴이 끝났으면 두 메시지를 그리고, 다음 턴의 fragment를 이 fragment 안에 둡니다.
+    - 아직이면 submit_prompt()가 넘긴 질문으로 답변을 받아 스트리밍하고, 끝나면 이 fragment만 다시 실행합니다.
+    fragment 밖의 위젯(대화명, 다운로드, 평가 버튼)은 답변 중에도 다시 그려지지 않으므로 processing으로 끄지 않습니다.
+    답변 중에 이 위젯을 누르면 전체 rerun이 턴을 멈추고, main()이 멈춘 턴을 정리합니다.
+    """
+    log.bind_session(st.session_state.get("session_id"))
+
+    messages = st.session_state.messages
+    if len(messages) >= idx + 2:
+        render_message(messages[idx])
+        render_message(messages[idx + 1])
+        chat_turn(idx + 2)
+        return
+
+    if prompt := st.session_state.pop("pending_prompt", None):
         user_name = st.session_state.get("user_name", "").strip()
         if not user_name:
             st.warning('대화명을 입력해 주세요!', icon='⚠️')
 
             time.sleep(3)
             disable_input(False)
-            st.rerun()
+            rerun_chat()
 
             return
 
-        user_message_idx = len(st.session_state.messages)
+        # fragment 실행은 main()을 거치지 않으므로, 턴을 시작하기 전에 최신 설정을 반영합니다.
+        set_class_info()
+        if st.session_state["setupInfo"]["serviceOnOff"] == "off":
+            disable_input(False)
+            st.rerun()
+
+        messages = st.session_state.messages
         user_timestamp = now_kst()
         last_assistant_done_at = st.session_state.get("last_assistant_done_at")
-        add_message(st.session_state.messages, "user", prompt)
-        st.session_state.message_meta[user_message_idx] = {
-            "timestamp": user_timestamp,
-            "elapsed_seconds": (user_timestamp - last_assistant_done_at).total_seconds() if last_assistant_done_at else None,
-        }
+        user_message_idx = messages.add(
+            "user",
+            prompt,
+            user_timestamp,
+            (user_timestamp - last_assistant_done_at).total_seconds() if last_assistant_done_at else None,
+        )
 
         with st.chat_message("user"):
             st.markdown(prompt)
-            st.caption(format_message_meta("user", st.session_state.message_meta[user_message_idx]))
+            st.caption(format_message_meta(messages[user_message_idx]))
 
         # OpenAI 모델 호출
         if "api_key" in st.session_state:
@@ -342,91 +537,308 @@ def main():
 
             with st.chat_message("assistant"):
                 message_placeholder = st.empty()
-                message_placeholder.write("......")
                 assistant_started_at = time.perf_counter()
-                stream = execute_prompt(st.session_state.messages[1:])
+                timer = TurnTimer()
+                # 응답 캐시(B18 response_cache, temperature 0)는 전체 대화 기록을 키로 씁니다.
+                # 같은 요청의 답변이 있으면 API를 부르지 않으므로 대기열 차례도 기다리지 않습니다.
+                # 없으면 차례를 기다리는 동안 다른 학생이 같은 답변을 받았을 수 있으므로, 차례를 받은 뒤 한 번 더 확인합니다.
+                history = messages.api_view()[:]
+                cached_response = get_response_cache().get(st.session_state['setupInfo'], history, count_miss=False)
+                if cached_response is not None:
+                    admission = contextlib.nullcontext()
+                else:
+                    # 오래된 대화를 요약으로 접는 요청은 그 자체로 대기열 차례를 받으므로, 이 턴의 차례를 받기 전에 만듭니다.
+                    request_messages = build_request_messages(messages.api_view())
+                    admission = admit_request(user_name, request_messages, message_placeholder)
+                try:
+                    with admission as ticket:
+                        timer.mark("admitted")
+                        # 턴 마감 시간은 차례를 받은 뒤부터 잽니다. 대기열에서 기다린 시간은 재시도 시간을 줄이지 않습니다.
+                        retry_state = DEFAULT_POLICY.start()
+                        message_placeholder.write("......")
+                        if cached_response is None and ticket is not None:
+                            cached_response = get_response_cache().get(st.session_state['setupInfo'], history)
+                        if cached_response is not None:
+                            log_p("응답 캐시 적중", output_chars = len(cached_response))
+                            request_messages = history
+                            timer.mark("dispatched")
+                            stream = ReplayStream(cached_response)
+                        else:
+                            timer.mark("dispatched")
+                            stream = execute_prompt(request_messages, retry_state)
+
+                        if stream == None:
+                            delete_message()
+
+                            disable_input(False)
+                            time.sleep(3)
+                            rerun_chat()
+
+                            return
 
-                if stream == None:
+                        full_response = message_processing(
+                            stream,
+                            message_placeholder,
+                            request_messages,
+                            retry_state,
+                            timer,
+                            history,
+                        )
+                        usage = st.session_state.get("last_usage", {})
+                        if ticket is not None:
+                            get_scheduler().record_usage(
+                                ticket,
+                                usage.get("input_tokens", 0) + usage.get("cache_creation_input_tokens", 0) + usage.get("output_tokens", 0),
+                            )
+
+                        if not full_response:
+                            delete_message()
+
+                            disable_input(False)
+                            time.sleep(3)
+                            rerun_chat()
+
+                            return
+                except QueueTimeoutError as e:
+                    log_p("대기열 시간 초과", logging.ERROR, error_type = type(e).__name__, error = str(e))
+                    st.error("지금 질문이 많이 몰려 있습니다. 잠시 후 다시 보내 주세요.")
                     delete_message()
 
                     disable_input(False)
                     time.sleep(3)
-                    st.rerun()
+                    rerun_chat()
 
                     return
-
-                full_response = message_processing(stream, message_placeholder)
-                message_placeholder.write(full_response)
 
-            assistant_message_idx = len(st.session_state.messages)
             assistant_timestamp = now_kst()
             assistant_elapsed = time.perf_counter() - assistant_started_at
-            add_message(st.session_state.messages, "assistant", full_response)
-            st.session_state.message_meta[assistant_message_idx] = {
-                "timestamp": assistant_timestamp,
-                "elapsed_seconds": assistant_elapsed,
-            }
+            assistant_message_idx = messages.add("assistant", full_response, assistant_timestamp, assistant_elapsed)
             st.session_state.last_assistant_done_at = assistant_timestamp
+            # 턴이 끝난 뒤에 학생/챗봇 메시지를 함께 저장 큐에 넣으므로, 실패한 턴은 시트에서 지울 필요가 없습니다.
+            gs.add_Content("user", prompt, user_timestamp.strftime("%H:%M"))
+            gs.add_Content("assistant", full_response, assistant_timestamp.strftime("%H:%M"))
+            save_session_turns(messages, (user_message_idx, assistant_message_idx))
+            session_bytes = get_session_memory_stats().record(st.session_state.get("session_id"), messages)
+            timer.mark("done")
+            timings = timer.summary(usage.get("output_tokens", 0))
+            # 응답 캐시로 다시 보여 준 답변은 API 응답 속도가 아니므로 모델별 수치에 넣지 않습니다.
+            cached = getattr(stream, "cached", False)
+            if not cached:
+                get_latency_stats().record(st.session_state['setupInfo']['model'], timings)
+                if assistant_message_idx == 2:
+                    get_cache_warmer().record_first_turn(timings["ttft_ms"], usage.get("cache_read_input_tokens", 0))
+            log_p(
+                "턴 완료",
+                turn = assistant_message_idx // 2,
+                model = st.session_state['setupInfo']['model'],
+                latency_ms = round(assistant_elapsed * 1000),
+                response_cache_hit = cached,
+                session_bytes = session_bytes,
+                **timings,
+                **usage,
+            )
             disable_input(False)
-            st.rerun()
+            rerun_chat()
 
-@st.cache_data 
-def log_p(message):
+def admit_request(user_name, messages, placeholder):
     """
-    콘솔에 메세지 출력하기
+    프로세스 공용 대기열에서 AI 요청 차례를 받는 컨텍스트 매니저를 반환합니다.
+
+    Parameters:
+    user_name (str): 공평한 순서를 정할 대화명
+    messages (list): 전송할 대화 기록 (토큰 수 추정용)
+    placeholder (streamlit.delta_generator.DeltaGenerator): 대기 순번을 보여줄 출력 객체
+
+    동시 요청 수와 분당 토큰 상한은 "정보" 시트의 max_inflight, tokens_per_minute 값을 사용합니다.
+    """
+    setupInfo = st.session_state['setupInfo']
+    scheduler = get_scheduler()
+    scheduler.configure(setupInfo.get('max_inflight', 8), setupInfo.get('tokens_per_minute', 0))
+    tokens = estimate_tokens(setupInfo['system']) + sum(estimate_tokens(m["content"]) for m in messages)
+
+    def show_position(position):
+        if position:
+            placeholder.write(f"⏳ 답변을 기다리는 중입니다. 앞에 {position}명이 있어요.")
+        else:
+            placeholder.write("⏳ 곧 답변을 시작합니다.")
+
+    return scheduler.admit(user_name, tokens, on_wait=show_position)
+
+def log_p(message, level = logging.INFO, **fields):
+    """
+    콘솔에 구조화 로그(JSON 한 줄) 출력하기
+
+    Parameters:
+    message (str): 고정된 이벤트 이름. 오류 내용처럼 바뀌는 값은 fields로 넘깁니다.
+    level (int): logging 레벨. 기본값은 INFO입니다.
+    **fields: 함께 남길 필드 (turn, model, latency_ms, error_type, error 등)
+
+    로그는 큐에 넣기만 하므로 화면 렌더링을 막지 않습니다.
+    같은 종류의 경고/오류가 반복되면 일정 시간에 한 번만 출력하고 생략한 건수를 함께 남깁니다.
     """
-    logger.get_logger(__name__).info(message)
+    log.event(message, level, st.session_state.get("session_id"), **fields)
+
+SUMMARY_SYSTEM = (
+    "당신은 토론 수업 기록을 정리하는 도우미입니다. "
+    "주어진 이전 요약과 대화를 합쳐, 토론 주제, 학생의 입장과 주요 논거, 챗봇이 제시한 반론과 질문, "
+    "아직 답하지 않은 질문을 빠짐없이 담은 한국어 요약을 작성하세요. 요약만 출력하세요."
+)
+SUMMARY_MAX_TOKENS = 800
+
+def get_context_window():
+    """
+    현재 세션의 ConversationWindow를 반환합니다. 없으면 새로 만듭니다.
+    그대로 남길 최근 턴 수는 "정보" 시트의 keep_turns(B19)를 따르며, 설정이 바뀌면 다음 요약부터 적용됩니다.
+    """
+    keep_turns = st.session_state['setupInfo'].get('keep_turns', DEFAULT_KEEP_TURNS)
+    if "context_window" not in st.session_state:
+        st.session_state["context_window"] = ConversationWindow(keep_turns)
+    window = st.session_state["context_window"]
+    window.keep_turns = keep_turns
+    return window
+
+def build_request_messages(messages):
+    """
+    "정보" 시트의 context_tokens 예산에 맞춰 AI에 보낼 대화 기록을 만듭니다.
+
+    Parameters:
+    messages (list): 시스템 메시지를 뺀 전체 대화 기록
+
+    Returns:
+    list: 최근 대화는 그대로, 오래된 대화는 누적 요약으로 접은 메시지 리스트.
+          context_tokens가 0(기본값)이면 전체 대화 기록을 그대로 반환합니다.
+    """
+    budget = st.session_state['setupInfo'].get('context_tokens', 0)
+    return get_context_window().build(messages, budget, summarize_history)
+
+def summarize_history(previous_summary, messages):
+    """
+    이전 요약과 새로 접을 대화를 합쳐 누적 요약을 만듭니다.
+
+    Parameters:
+    previous_summary (str): 지금까지의 누적 요약 (없으면 빈 문자열)
+    messages (list): 요약에 새로 접을 메시지 리스트
+
+    Returns:
+    str: 새 누적 요약. 요청에 실패하면 None
+
+    요약 요청도 채팅 턴과 같이 공용 대기열에서 차례를 받고, 재시도는 같은 RetryPolicy를 따릅니다. (llm.complete)
+    사용한 토큰은 대기열의 분당 토큰 집계와 운영자 화면의 토큰 사용량에 함께 넣습니다.
+    """
+    setupInfo = st.session_state['setupInfo']
+    role_labels = {"user": "학생", "assistant": "챗봇"}
+    transcript = "\n\n".join(f"{role_labels.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"[이전 요약]\n{previous_summary}\n\n[새 대화]\n{transcript}"
+    summary_setup = dict(setupInfo, system = SUMMARY_SYSTEM, temperature = 0)
+    request_messages = [{"role": "user", "content": transcript}]
+
+    scheduler = get_scheduler()
+    scheduler.configure(setupInfo.get('max_inflight', 8), setupInfo.get('tokens_per_minute', 0))
+    tokens = estimate_tokens(SUMMARY_SYSTEM) + estimate_tokens(transcript) + SUMMARY_MAX_TOKENS
+
+    try:
+        with scheduler.admit(st.session_state["user_name_1"], tokens) as ticket, llm.lease_client(setupInfo['key']) as client:
+            summary, usage, stop_reason = llm.complete(
+                client,
+                summary_setup,
+                request_messages,
+                max_tokens = SUMMARY_MAX_TOKENS,
+                cache_messages = False,
+            )
+            scheduler.record_usage(ticket, usage["input_tokens"] + usage["cache_creation_input_tokens"] + usage["output_tokens"])
+    except Exception as e:
+        log_p("대화 요약 실패", logging.ERROR, error_type = type(e).__name__, error = str(e))
+        return None
+
+    llm.get_usage_stats().record(llm.key_fingerprint(setupInfo.get('url', '')), usage)
+    log_p("대화 요약 갱신", folded_messages = len(messages), stop_reason = stop_reason)
+    return summary or None
 
-def execute_prompt(messages):
+def execute_prompt(messages, retry_state = None, report_errors = True):
     """
     AI 모델에 프롬프트를 전송하고 응답 스트림을 받아오는 함수입니다.
 
     Parameters:
     messages (list): 대화 기록을 담고 있는 메시지 리스트. 각 메시지는 'role'과 'content' 키를 가진 딕셔너리 형태입니다.
+    retry_state (utils.retry.RetryState, optional): 한 턴 동안 공유하는 재시도 상태. 없으면 새로 만듭니다.
+    report_errors (bool): False이면 재시도해도 실패했을 때 오류를 로그에만 남기고 화면에는 출력하지 않습니다.
 
     Returns:
-    stream: AI 모델의 응답 스트림
+    stream: AI 모델의 응답 스트림. 재시도해도 실패하면 None
 
-    이 함수는 세션 상태에서 설정 정보와 AI 클라이언트를 가져와 사용합니다.
-    설정된 파라미터에 따라 AI 모델에 요청을 보내고, 응답 스트림을 반환합니다.
+    스트리밍 모드(B12 stream)이면 요청을 프로세스 공용 스트리밍 엔진(utils/engine.py)에 맡기고,
+    응답이 시작되면 이벤트를 꺼낼 수 있는 StreamHandle을 반환합니다. 소켓 읽기는 엔진의 이벤트 루프 스레드가 합니다.
+    스트리밍이 아니면 설정된 API 키의 공용 동기 클라이언트로 요청하고, 받은 응답을 llm.MessageStream으로 감싸
+    스트리밍 응답과 같은 이벤트로 돌려줍니다.
+    "정보" 시트의 API 키가 바뀌면 다음 호출부터 새 클라이언트가 사용됩니다.
+    시스템 프롬프트와 대화 기록의 앞부분에는 프롬프트 캐시 중단점을 표시합니다 (llm.build_cached_request).
+    타임아웃, 사용량 제한(429), 서버 오류(5xx)는 retry-after 헤더와 지터가 있는 지수 백오프로
+    턴 마감 시간 안에서 다시 시도합니다.
     """
     setupInfo = st.session_state['setupInfo']
-    client = st.session_state["bot"]
-    
-    try:
-        stream = client.messages.create(
-                        model = setupInfo['model'],
-                        max_tokens = setupInfo['max_tokens'],
-                        temperature = setupInfo['temperature'],
-                        cache_control = {"type": "ephemeral"},
-                        system = setupInfo['system'],
-                        messages = messages,
-                        stream = setupInfo['stream']
-        )
-
-        return stream
-    except APITimeoutError as e:
-        log_p(f"ERROR: API 타임아웃 오류 발생: {str(e)}")
+    retry_state = retry_state or DEFAULT_POLICY.start()
+    system, request_messages = llm.build_cached_request(setupInfo['system'], messages)
+    params = {
+        "model": setupInfo['model'],
+        "max_tokens": setupInfo['max_tokens'],
+        "temperature": setupInfo['temperature'],
+        "system": system,
+        "messages": request_messages,
+    }
+
+    while True:
+        try:
+            if setupInfo['stream']:
+                stream = get_engine().stream(setupInfo['key'], **params)
+                stream.wait_started()
+            else:
+                with llm.lease_client(setupInfo['key']) as client:
+                    stream = llm.MessageStream(client.messages.create(stream = False, **params))
+
+            return stream
+        except Exception as e:
+            delay = retry_state.next_delay(e)
+            if delay is None:
+                if report_errors:
+                    report_api_error(e)
+                else:
+                    log_p("API 재시도 중단", logging.ERROR, error_type = type(e).__name__, error = str(e))
+                return None
+
+            log_p(
+                "API 재시도",
+                logging.WARNING,
+                attempt = retry_state.attempt,
+                delay_s = round(delay, 2),
+                error_type = type(e).__name__,
+                error = str(e),
+            )
+            time.sleep(delay)
+
+def report_api_error(e):
+    """
+    AI 요청 오류를 로그에 남기고, 종류에 맞는 안내 문구를 화면에 출력합니다.
+    """
+    fields = {"error_type": type(e).__name__, "error": str(e)}
+    if isinstance(e, APITimeoutError):
+        log_p("API 타임아웃 오류 발생", logging.ERROR, **fields)
         st.error("AI 서비스의 응답이 너무 오래 걸립니다. 잠시 후 다시 시도해 주세요.")
-    except APIConnectionError as e:
-        log_p(f"ERROR: API 연결 오류 발생: {str(e)}")
+    elif isinstance(e, APIConnectionError):
+        log_p("API 연결 오류 발생", logging.ERROR, **fields)
         st.error("AI 서비스와의 연결에 실패했습니다. 인터넷 연결을 확인해 주세요.")
-    except RateLimitError as e:
-        log_p(f"ERROR: API 사용량 제한 오류 발생: {str(e)}")
+    elif isinstance(e, RateLimitError):
+        log_p("API 사용량 제한 오류 발생", logging.ERROR, **fields)
         st.error("AI 서비스 사용량이 한도를 초과했습니다. 잠시 후 다시 시도해 주세요.")
-    except APIStatusError as e:
-        log_p(f"API 상태 오류가 발생했습니다. 상태 코드: {e.status_code}, 오류 메시지: {e.message}")
+    elif isinstance(e, APIStatusError):
+        log_p("API 상태 오류 발생", logging.ERROR, status_code = e.status_code, **fields)
         st.error(f"API 상태 오류가 발생했습니다. 상태 코드: {e.status_code}, 오류 메시지: {e.message}")
-    except APIError as e:
-        log_p(f"ERROR: API 오류 발생: {str(e)}")
+    elif isinstance(e, APIError):
+        log_p("API 오류 발생", logging.ERROR, **fields)
         st.error("AI 서비스와 통신 중 오류가 발생했습니다. 잠시 후 다시 시도해 주세요.")
-    except Exception as e:
-        log_p(f"ERROR:예상치 못한 오류 발생: {str(e)}")
+    else:
+        log_p("예상치 못한 오류 발생", logging.ERROR, **fields)
         st.error("예상치 못한 오류가 발생했습니다. 관리자에게 문의해 주세요.")
-    finally:
-        pass
-
-    return None
 
 def wiget_on_off(func):
     @functools.wraps(func)
@@ -439,111 +851,244 @@ def wiget_on_off(func):
         return result    
     return wrapper
 
-def message_processing(stream, output = None):
+PARTIAL_RESPONSE_WARNING = "답변이 중간에 끊겨 받은 부분까지만 보여 드립니다."
+
+def message_processing(stream, output = None, messages = None, retry_state = None, timer = None, cache_messages = None):
     """
     스트리밍 응답을 처리하고 전체 응답을 구성하는 함수입니다.
 
     Parameters:
     stream (iterable): 응답 청크를 포함하는 스트림 객체
     output (streamlit.delta_generator.DeltaGenerator, optional): Streamlit 출력 객체. 기본값은 None입니다.
+    messages (list, optional): 스트림을 요청할 때 보낸 대화 기록. 주어지면 끊긴 스트림을 이어받습니다.
+    retry_state (utils.retry.RetryState, optional): execute_prompt와 공유하는 재시도 상태
+    timer (utils.metrics.TurnTimer, optional): 첫 이벤트/첫 토큰/마지막 토큰 시각과 화면 출력 시간을 기록할 타이머
+    cache_messages (list, optional): 응답 캐시 키로 쓸 전체 대화 기록. 없으면 응답 캐시에 넣지 않습니다.
 
     Returns:
-    str: 완성된 전체 응답 문자열
+    str: 완성된 전체 응답 문자열. 중간에 끊겨 이어받지 못하면 받은 부분까지의 문자열
 
     이 함수는 스트림에서 청크를 반복적으로 읽어 전체 응답을 구성합니다.
-    또한 Streamlit 출력 객체가 제공된 경우, 실시간으로 응답을 업데이트합니다.
+    또한 Streamlit 출력 객체가 제공된 경우, 설정 시트의 flush_ms 간격(또는 200자)마다 모아서 응답을 업데이트합니다.
+    스트리밍 도중 재시도 가능한 오류가 나면 받은 부분을 assistant 메시지로 붙여 다시 요청하고,
+    이어지는 응답을 같은 버퍼에 계속 받습니다.
+    message_start/message_delta 이벤트의 usage(입력, 출력, 캐시 읽기/쓰기 토큰)는 수업별로 집계하고,
+    이번 턴의 합계를 st.session_state["last_usage"]에 남깁니다. 응답 캐시로 다시 보여 준 답변(ReplayStream)은 요청 수에 넣지 않습니다.
+    끝까지 받은 답변(stop_reason end_turn)은 응답 캐시에 넣습니다. (B18 response_cache가 꺼져 있으면 무시)
     """
     log_p("메시지 스트리밍 중")
-    full_response = ""
-
-    for chunk in stream:
-        if chunk.type == "content_block_delta":
-            full_response += chunk.delta.text
-        elif chunk.type == "message_start":
-            # 메시지 시작 이벤트 처리 (필요한 경우)
-            pass
-        elif chunk.type == "message_delta":
-            # 메시지 델타 이벤트 처리 (필요한 경우)
-            pass
-        elif chunk.type == "message_stop":
-            # 메시지 종료 이벤트 처리 (필요한 경우)
+    setupInfo = st.session_state.get('setupInfo', {})
+    buffer = StreamBuffer(output, flush_ms = setupInfo.get('flush_ms', 50))
+    classroom = llm.key_fingerprint(setupInfo.get('url', ''))
+    turn_usage = dict.fromkeys(llm.UsageStats.FIELDS, 0)
+    timer = timer or TurnTimer()
+    stop_reason = None
+
+    while stream is not None:
+        usage = {}
+        try:
+            for chunk in stream:
+                if chunk.type == "content_block_delta":
+                    timer.token()
+                    buffer.append(chunk.delta.text)
+                elif chunk.type == "message_start":
+                    timer.mark("message_start")
+                    # 입력 토큰과 프롬프트 캐시 읽기/쓰기 토큰
+                    usage.update(llm.usage_to_dict(chunk.message.usage))
+                elif chunk.type == "message_delta":
+                    # 누적 출력 토큰
+                    usage["output_tokens"] = chunk.usage.output_tokens
+                    stop_reason = chunk.delta.stop_reason
+                elif chunk.type == "message_stop":
+                    # 메시지 종료 이벤트 처리 (필요한 경우)
+                    break
             break
-        if output != None:
-            output.write(full_response + "▌")
-    log_p("메시지 스트리밍 완료")
+        except STREAM_ERRORS as e:
+            delay = retry_state.next_delay(e) if messages is not None and retry_state is not None else None
+            if delay is None:
+                log_p(
+                    "스트리밍 중 오류 발생",
+                    logging.ERROR,
+                    received_chars = len(buffer.text),
+                    error_type = type(e).__name__,
+                    error = str(e),
+                )
+                if buffer.text:
+                    st.warning(PARTIAL_RESPONSE_WARNING)
+                else:
+                    report_api_error(e)
+                break
+
+            log_p(
+                "스트리밍 이어받기",
+                logging.WARNING,
+                attempt = retry_state.attempt,
+                delay_s = round(delay, 2),
+                received_chars = len(buffer.text),
+                error_type = type(e).__name__,
+                error = str(e),
+            )
+            time.sleep(delay)
+            buffer.rstrip()
+            # 받은 부분이 있으면 이어받기에 실패해도 오류 대신 끊겼다는 안내만 보여 줍니다.
+            stream = execute_prompt(continuation_messages(messages, buffer.text), retry_state, report_errors = not buffer.text)
+            if stream is None and buffer.text:
+                st.warning(PARTIAL_RESPONSE_WARNING)
+        finally:
+            if usage and not getattr(stream, "cached", False):
+                llm.get_usage_stats().record(classroom, usage)
+                for field, value in usage.items():
+                    turn_usage[field] += value
+
+    st.session_state["last_usage"] = turn_usage
+    full_response = buffer.close()
+    timer.render_seconds = buffer.render_seconds
+    timer.flushes = buffer.flush_count
+    if stop_reason == "end_turn" and cache_messages is not None and not getattr(stream, "cached", False):
+        get_response_cache().put(setupInfo, cache_messages, full_response)
+    log_p("메시지 스트리밍 완료", model = setupInfo.get('model'), output_chars = len(full_response), flushes = buffer.flush_count)
 
     return full_response
 
+def continuation_messages(messages, partial_response):
+    """
+    끊긴 스트림을 이어받기 위한 메시지 리스트를 만듭니다.
+    이미 받은 부분을 마지막 assistant 메시지로 붙이면 모델이 그 뒤부터 이어서 답합니다.
+    (assistant 메시지는 끝 공백을 허용하지 않으므로 호출 전에 잘라 둡니다.)
+    """
+    if not partial_response:
+        return messages
+    return messages + [{"role": "assistant", "content": partial_response}]
+
+EVALUATION_STAGES = (
+    ("a_p", "종합 평가"),
+    ("e_p", "평어"),
+)
+
 def end_conversation():
     """
     대화를 종료하고 종합 평가 및 평어를 생성하여 Google Sheets에 저장하는 함수입니다.
 
     이 함수는 다음과 같은 작업을 수행합니다:
-    1. 종합 평가 프롬프트를 사용하여 AI로부터 종합 평가를 생성합니다.
-    2. 생성된 종합 평가를 Google Sheets에 저장합니다.
-    3. 평어 프롬프트를 사용하여 AI로부터 평어를 생성합니다.
-    4. 생성된 평어를 Google Sheets에 저장합니다.
+    1. 채팅 턴과 같은 방식(build_request_messages)으로 대화 기록을 만듭니다.
+       앞부분이 채팅 요청과 같으므로 프롬프트 캐시를 그대로 읽습니다.
+    2. 종합 평가(a_p)와 평어(e_p) 프롬프트를 각각 대화 기록 뒤에 붙여 두 요청을 동시에 보냅니다.
+    3. "수업요약" 시트의 학생 행(캐시된 이름 -> 행 번호 표)에 두 결과를 한 번에 저장합니다.
 
+    단계별 진행 상황은 st.status 안에 표시합니다.
     이 함수는 세션 상태에 저장된 설정 정보와 메시지 기록을 사용합니다.
     """
-    st.success("1/2 작업중......")
-    time.sleep(2)
-    st.success("1/2 완료")
-    time.sleep(2)
-    st.success("2/2 작업중......")
-    time.sleep(2)
-    st.success("2/2 완료")
-    time.sleep(2)
-    
-    return 
-
     log_p("평가 시작")
+    started_at = time.perf_counter()
 
-    # TODO 종합평가, 평어를 시트에 저장
-    sheet = gs.get_summary_sheet(st.session_state["doc"])
     setupInfo = st.session_state['setupInfo']
-    a_p = setupInfo["a_p"]
-    e_p = setupInfo["e_p"]
-    messages = st.session_state.messages[1:]
-    full_response = ""
-
-    # 종합평가
-    st.success("1/2 작업중......")
-    add_message(messages, "user", a_p)
-    stream = execute_prompt(messages)
-    full_response = message_processing(stream)
-    add_message(messages, "assistant", full_response)
-    
-    cell = sheet.find(st.session_state["user_name_1"], in_column = 1)
-    sheet.update_cell(cell.row, cell.col + 1, full_response)
-    st.success("1/2 완료")
-    
-    # 평어
-    st.success("2/2 작업중......")
-    full_response = ""
-    add_message(messages, "user", e_p)
-    stream = execute_prompt(messages)
-    full_response = message_processing(stream)
-    add_message(messages, "assistant", full_response)
+    user_name = st.session_state["user_name_1"]
+    history = build_request_messages(st.session_state.messages.api_view())
+    # 작업 스레드에서는 st.session_state, 캐시 함수를 쓰지 않도록 여기서 모두 꺼내 둡니다.
+    # 두 요청이 끝날 때까지 공용 클라이언트를 빌려 두어, 그 사이 다른 키 때문에 닫히지 않게 합니다.
+    client_lease = llm.lease_client(setupInfo['key'])
+    scheduler = get_scheduler()
+    usage_stats = llm.get_usage_stats()
+    response_cache = get_response_cache()
+    classroom = llm.key_fingerprint(setupInfo.get('url', ''))
+    session_id = st.session_state.get("session_id")
+
+    with st.status("평가를 만드는 중입니다...", expanded = True) as status:
+        slots = {}
+        futures = {}
+        with client_lease as client, ThreadPoolExecutor(max_workers = len(EVALUATION_STAGES)) as executor:
+            for key, label in EVALUATION_STAGES:
+                slots[key] = st.empty()
+                slots[key].write(f"{label} 작성 중...")
+                request_messages = history + [{"role": "user", "content": setupInfo[key]}]
+                future = executor.submit(
+                    contextvars.copy_context().run,
+                    generate_evaluation,
+                    client, scheduler, usage_stats, response_cache, setupInfo, request_messages, user_name, classroom, session_id,
+                )
+                futures[future] = key
+
+            results = {}
+            labels = dict(EVALUATION_STAGES)
+            for future in as_completed(futures):
+                key = futures[future]
+                results[key] = future.result()
+                if results[key]:
+                    slots[key].write(f"{labels[key]} 완료 ({time.perf_counter() - started_at:.1f}초)")
+                else:
+                    slots[key].write(f"{labels[key]}을(를) 만들지 못했습니다.")
+
+        if not all(results.values()):
+            status.update(label = "평가를 만들지 못했습니다. 잠시 후 다시 시도해 주세요.", state = "error")
+            log_p("평가 실패", logging.ERROR, failed = [key for key, value in results.items() if not value])
+            return
+
+        save_slot = st.empty()
+        save_slot.write("수업요약 시트에 저장 중...")
+        row = gs.write_evaluation(gs.get_spreadsheet(setupInfo['url']), user_name, results["a_p"], results["e_p"])
+        if row is None:
+            save_slot.write(f"수업요약 시트에서 '{user_name}'을(를) 찾지 못했습니다.")
+            status.update(label = "평가를 저장하지 못했습니다.", state = "error")
+            log_p("평가 저장 실패", logging.ERROR, user_name = user_name)
+            return
 
-    sheet.update_cell(cell.row, cell.col + 2, full_response)
-    st.success("2/2 완료")
-    log_p("평가 완료")
+        save_slot.write("수업요약 시트에 저장 완료")
+        status.update(label = "평가 완료", state = "complete", expanded = False)
 
-def add_message(all_messages, role, message):
+    st.session_state["evaluated_upto"] = len(st.session_state.messages)
+    log_p("평가 완료", row = row, latency_ms = round((time.perf_counter() - started_at) * 1000))
+
+def generate_evaluation(client, scheduler, usage_stats, response_cache, setupInfo, messages, user_name, classroom, session_id):
     """
-    메시지를 현재 브라우저 세션의 대화 기록에만 추가합니다.
-    Google Sheet 자동저장은 개인정보보호/속도 문제로 테스트 브랜치에서 비활성화했습니다.
+    평가 요청 하나를 보내고 결과 문자열을 반환합니다. (작업 스레드에서 실행)
+
+    Parameters:
+    client (anthropic.Anthropic): 공용 AI 클라이언트
+    scheduler (utils.scheduler.AdmissionController): 공용 AI 요청 대기열
+    usage_stats (utils.llm.UsageStats): 수업별 토큰 사용량 집계
+    response_cache (utils.response_cache.ResponseCache): 같은 요청의 평가를 재사용할 응답 캐시
+    setupInfo (dict): 설정 정보
+    messages (list): 대화 기록 + 평가 프롬프트
+    user_name (str): 대기열 순서를 정할 대화명
+    classroom (str): 사용량을 모을 수업 지문
+    session_id (str): 로그에 남길 세션 ID
+
+    Returns:
+    str: 평가 결과. 재시도해도 실패하면 None
+
+    화면과 st.session_state는 쓰지 않습니다. 재시도는 채팅 턴과 같은 RetryPolicy를 따릅니다. (llm.complete)
     """
-    all_messages.append({"role": role, "content": message})
+    cached_text = response_cache.get(setupInfo, messages)
+    if cached_text is not None:
+        log.event("평가 생성", session_id = session_id, response_cache = "hit")
+        return cached_text
+
+    tokens = estimate_tokens(setupInfo['system']) + sum(estimate_tokens(m["content"]) for m in messages)
+
+    try:
+        with scheduler.admit(user_name, tokens) as ticket:
+            text, usage, stop_reason = llm.complete(client, setupInfo, messages)
+            usage_stats.record(classroom, usage)
+            scheduler.record_usage(ticket, usage["input_tokens"] + usage["cache_creation_input_tokens"] + usage["output_tokens"])
+    except QueueTimeoutError as e:
+        log.event("평가 대기열 시간 초과", logging.ERROR, session_id, error_type = type(e).__name__, error = str(e))
+        return None
+    except Exception as e:
+        log.event("평가 요청 실패", logging.ERROR, session_id, error_type = type(e).__name__, error = str(e))
+        return None
+
+    log.event("평가 생성", session_id = session_id, stop_reason = stop_reason, **usage)
+    # max_tokens로 잘린 평가는 다른 학생에게 다시 보여 주지 않습니다. (채팅 턴과 같은 기준)
+    if stop_reason == "end_turn":
+        response_cache.put(setupInfo, messages, text)
+    return text or None
 
 def delete_message():
-    message = st.session_state.messages
-
-    while message[-1]["role"] == "user":
-        removed_idx = len(message) - 1
-        message.pop()
-        st.session_state.message_meta.pop(removed_idx, None)
+    """
+    답을 받지 못한 마지막 학생 메시지를 현재 세션의 대화 기록(TurnLog)에서 지웁니다.
+    Google Sheet와 세션 저장소에는 턴이 끝난 뒤에만 저장하므로 따로 지울 것이 없습니다.
+    """
+    st.session_state.messages.pop_unanswered()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+"""
+clean_text_for_txt 처리량 벤치마크
+예전 구현(str.replace 반복 + 글자별 ord 검사)과 현재 구현(정규식 + str.translate 표)을 비교합니다.
+
+실행:
+    python benchmarks/bench_clean_text.py [--turns 40] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.transcript import _clean_text, clean_text_for_txt  # noqa: E402
+
+
+def legacy_clean_text_for_txt(text):
+    replacements = {
+        "1️⃣": "1.",
+        "2️⃣": "2.",
+        "3️⃣": "3.",
+        "🟦": "[찬성]",
+        "🟥": "[반대]",
+    }
+    cleaned = str(text)
+    for old, new in replacements.items():
+        cleaned = cleaned.replace(old, new)
+
+    return "".join(
+        char
+        for char in cleaned
+        if char == "\n" or char == "\t" or not (
+            0x1F000 <= ord(char) <= 0x1FAFF
+            or 0x2600 <= ord(char) <= 0x27BF
+            or ord(char) in (0x200D, 0x20E3)
+            or 0xFE00 <= ord(char) <= 0xFE0F
+        )
+    )
+
+
+SENTENCES = [
+    "저는 학교에서 휴대전화 사용을 금지해야 한다고 생각합니다.",
+    "왜냐하면 수업 시간에 집중력이 떨어지기 때문입니다.",
+    "🟦 찬성 측 근거를 정리해 볼까요? 😀",
+    "🟥 반대 측에서는 학습 도구로 활용할 수 있다고 봅니다.",
+    "1️⃣ 첫째, 근거가 통계 자료로 뒷받침되나요?\n2️⃣ 둘째, 반론을 예상해 보세요.\n3️⃣ 셋째, 결론을 다시 써 봅시다.",
+    "좋은 질문이에요! ✅ 다음 단계로 넘어가 봅시다 👍",
+    "\t들여쓰기와 줄바꿈은 그대로 둡니다.\n",
+]
+
+
+def make_transcript(turns, seed=0):
+    """
+    긴 한국어 토론 대화를 흉내 낸 메시지 리스트를 만듭니다. (턴마다 학생 1개 + 챗봇 1개)
+    """
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(turns):
+        messages.append(" ".join(rng.choices(SENTENCES, k=3)))
+        messages.append("\n".join(rng.choices(SENTENCES, k=25)))
+    return messages
+
+
+def measure(func, messages, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            func(message)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = make_transcript(args.turns)
+    total_chars = sum(len(message) for message in messages)
+
+    mismatches = sum(1 for message in messages if legacy_clean_text_for_txt(message) != clean_text_for_txt(message))
+    if mismatches:
+        raise SystemExit(f"결과 불일치: {mismatches}개 메시지")
+
+    results = [
+        ("legacy (replace + ord)", measure(legacy_clean_text_for_txt, messages, args.repeat)),
+        ("translate (no cache)", measure(_clean_text.__wrapped__, messages, args.repeat)),
+        ("translate (cached)", measure(clean_text_for_txt, messages, args.repeat)),
+    ]
+
+    print(f"{len(messages)} messages, {total_chars:,} chars, best of {args.repeat}")
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(
+            f"{name:<24} {seconds * 1000:9.2f} ms  "
+            f"{total_chars / seconds / 1e6:8.2f} Mchar/s  x{baseline / seconds:6.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+앱 인스턴스 하나의 동시 접속 부하 테스트
+가짜 Anthropic 서버(fake_anthropic.py)와 가짜 스프레드시트(fake_gspread.py)를 띄우고,
+학생 N명의 세션이 각자 스레드에서 app.main()의 턴 흐름을 동시에 실행합니다.
+
+실행:
+    python benchmarks/bench_load.py --sessions 30 --turns 5
+    python benchmarks/bench_load.py --sessions 60 --tokens-per-second 80 --error-rate 0.02 --disconnect-rate 0.02
+    python benchmarks/bench_load.py --sessions 30 --sheet-latency-ms 300 --sheet-error-rate 0.05
+    python benchmarks/bench_load.py --sessions 30 --ttft-ms 1200 --cached-ttft-ms 300
+    python benchmarks/bench_load.py --sessions 30 --response-cache
+    python benchmarks/bench_load.py --sessions 30 --turns 5 --reconnect-rate 0.2
+
+- 한 Streamlit 서버 안의 여러 세션처럼, @st.cache_resource 객체(연결 풀, 대기열, 저장 큐, 설정)는 모든 세션이 함께 씁니다.
+- 화면 출력은 하지 않으므로(SimulatedStreamlit) render_ms는 실제 브라우저 환경보다 작게 나옵니다.
+- streamlit.testing의 AppTest는 런타임과 st.secrets를 프로세스 전역으로 바꿔 끼우므로 세션을 동시에 실행할 수 없어 쓰지 않습니다.
+- 결과: 처리량(턴/초, 출력 토큰/초), 턴 단계별 p50/p95/p99(utils/metrics.py), 세션당 session_state 크기, 프로세스 최대 메모리
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import streamlit.logger
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_anthropic import FakeAnthropicServer  # noqa: E402
+from fake_gspread import FakeSpreadsheet  # noqa: E402
+
+QUESTIONS = (
+    "학교에서 휴대전화 사용을 금지해야 할까요?",
+    "제 주장의 근거가 충분한지 봐 주세요.",
+    "반대 측은 어떤 반론을 할까요?",
+    "통계 자료를 어떻게 찾으면 좋을까요?",
+    "결론을 한 문장으로 정리해 주세요.",
+)
+
+
+class Rerun(Exception):
+    """
+    st.rerun()이 호출되었음을 드라이버에 알립니다. (턴 끝) args[0]은 scope입니다.
+    """
+
+
+class Element:
+    """
+    아무것도 그리지 않는 Streamlit 요소입니다. with 문, 메서드 호출, placeholder.write()를 모두 받습니다.
+    """
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return self
+
+
+class SessionState(dict):
+    """
+    st.session_state처럼 속성으로도 읽고 쓸 수 있는 dict입니다.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class SimulatedStreamlit:
+    """
+    세션별 session_state를 스레드마다 따로 두는 streamlit 모듈 대역입니다.
+    app.py와 utils/gs.py의 st를 이 객체로 바꾸면, 여러 스레드가 각자 다른 학생 세션으로 main()을 실행합니다.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.secrets = {}
+        self.sidebar = Element()
+
+    def start_session(self, name, reconnect=False):
+        """
+        새 브라우저 세션을 시작합니다. reconnect이면 같은 주소(?resume= 토큰)로 다시 접속한 것처럼 query_params를 남깁니다.
+        """
+        # 학생이 사이드바 입력칸에 대화명을 넣은 상태로 시작합니다. (위젯 값은 key로 session_state에 있습니다)
+        self._local.state = SessionState(processing=False, sidebar_user_name=name)
+        self._local.prompt = None
+        self._local.fragments = {}
+        if not reconnect:
+            self._local.query_params = {}
+
+    def submit(self, prompt):
+        self._local.prompt = prompt
+
+    @property
+    def session_state(self):
+        return self._local.state
+
+    @property
+    def query_params(self):
+        return self._local.query_params
+
+    def text_input(self, label, key=None, **kwargs):
+        return self._local.state.setdefault(key, "") if key else ""
+
+    def chat_input(self, placeholder=None, key=None, on_submit=None, args=(), **kwargs):
+        prompt, self._local.prompt = self._local.prompt, None
+        if prompt and key:
+            self._local.state[key] = prompt
+        if prompt and on_submit:
+            try:
+                on_submit(*args)
+            except Rerun as rerun:
+                # 콜백의 st.rerun("<key>")은 앱 전체 대신 그 key의 fragment만 다시 실행합니다.
+                if rerun.args[0] not in self._local.fragments:
+                    raise
+                self._local.fragments[rerun.args[0]]()
+        return prompt
+
+    def fragment(self, func=None, key=None, **kwargs):
+        """
+        st.fragment 대역: 함수를 바로 실행하고, key가 있으면 st.rerun("<key>")으로 다시 실행할 수 있게 기억해 둡니다.
+        """
+        if func is None:
+            return lambda f: self.fragment(f, key=key, **kwargs)
+
+        def run(*args, **kw):
+            if key is not None:
+                self._local.fragments[key] = lambda: func(*args, **kw)
+            return func(*args, **kw)
+
+        return run
+
+    def selectbox(self, label, options, **kwargs):
+        return list(options)[0]
+
+    def button(self, *args, **kwargs):
+        return False
+
+    def text_area(self, *args, **kwargs):
+        return ""
+
+    def columns(self, spec, **kwargs):
+        return [Element() for _ in range(spec if isinstance(spec, int) else len(spec))]
+
+    def rerun(self, scope="app"):
+        raise Rerun(scope)
+
+    def __getattr__(self, name):
+        return Element()
+
+
+def setup_values(args):
+    """
+    "정보" 시트 B열 값 (B1~B18)
+    """
+    return [
+        "https://docs.google.com/spreadsheets/d/fake-class",
+        "on",
+        "claude",
+        "sk-ant-fake-key",
+        args.model,
+        str(args.max_tokens),
+        "0" if args.response_cache else "0.7",
+        "",
+        "너는 학생의 토론 준비를 돕는 코치야. 학생의 주장과 근거를 질문으로 다듬어 줘." * 20,
+        "지금까지의 대화를 종합 평가해 줘.",
+        "학생에게 줄 평어를 써 줘.",
+        "TRUE",
+        str(args.flush_ms),
+        str(args.max_inflight),
+        "0",
+        "0",
+        args.save_transcript,
+        "on" if args.response_cache else "off",
+    ]
+
+
+def deep_size(value, seen=None):
+    """
+    객체와 그 안에 든 dict/list/__slots__ 속성/문자열의 크기 합(바이트)을 대략 계산합니다.
+    """
+    seen = seen if seen is not None else set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(deep_size(item, seen) for item in value)
+    for name in getattr(type(value), "__slots__", ()):
+        size += deep_size(getattr(value, name, None), seen)
+    return size
+
+
+def run_session(app, sim, index, args, results):
+    """
+    학생 한 명의 세션: 첫 화면 -> 대화명 입력 -> turns번 질문
+    """
+    rng = random.Random(index)
+    name = f"학생{index:03d}"
+    sim.start_session(name)
+    state = sim.session_state
+    completed = failed = reconnects = lost = 0
+
+    try:
+        app.main()
+        for turn in range(args.turns):
+            if args.think_seconds:
+                time.sleep(rng.uniform(0, 2 * args.think_seconds))
+            before = len(state.get("messages", []))
+            sim.submit(QUESTIONS[(index + turn) % len(QUESTIONS)])
+            try:
+                app.main()
+            except Rerun:
+                pass
+            if len(state.get("messages", [])) == before + 2:
+                completed += 1
+            else:
+                failed += 1
+
+            if rng.random() < args.reconnect_rate:
+                # 연결이 끊겨 새 세션으로 다시 접속: 저장 스레드가 턴을 쓴 뒤 같은 주소와 대화명으로 들어옵니다.
+                expected = len(state.get("messages", []))
+                time.sleep(0.5)
+                sim.start_session(name, reconnect=True)
+                state = sim.session_state
+                app.main()
+                reconnects += 1
+                if len(state.get("messages", [])) != expected:
+                    lost += 1
+    except Exception as e:
+        failed += 1
+        logging.getLogger(__name__).exception("세션 %s 실패: %s", index, e)
+
+    results[index] = {
+        "completed": completed,
+        "failed": failed,
+        "reconnects": reconnects,
+        "lost": lost,
+        "session_state_bytes": deep_size({k: v for k, v in state.items() if k not in ("bot", "sheet", "sheet_future")}),
+    }
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return None
+    pick = lambda p: values[max(0, -(-p * len(values) // 100) - 1)]
+    return {"p50": pick(50), "p95": pick(95), "max": values[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="동시 접속 부하 테스트")
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="턴 사이 평균 대기 시간")
+    parser.add_argument("--model", default="claude-fake")
+    parser.add_argument("--max-tokens", type=int, default=512)
+    parser.add_argument("--max-inflight", type=int, default=8, help='"정보" 시트 B14')
+    parser.add_argument("--flush-ms", type=int, default=50, help='"정보" 시트 B13')
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--cached-ttft-ms", type=float, default=None, help="프롬프트 캐시를 읽은 요청의 TTFT")
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="가짜 API의 429/529 비율")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="가짜 API의 스트리밍 중 끊김 비율")
+    parser.add_argument("--sheet-latency-ms", type=float, default=80)
+    parser.add_argument("--sheet-error-rate", type=float, default=0.0, help="가짜 스프레드시트의 429 비율")
+    parser.add_argument("--response-cache", action="store_true", help='B18 response_cache를 켜고 temperature를 0으로')
+    parser.add_argument("--save-transcript", choices=("off", "on", "private"), default="on", help='"정보" 시트 B17')
+    parser.add_argument("--reconnect-rate", type=float, default=0.0, help="턴마다 다시 접속할 비율 (세션 되살리기 확인)")
+    parser.add_argument("--verbose", action="store_true", help="앱 로그(JSON)를 그대로 출력")
+    args = parser.parse_args()
+
+    server = FakeAnthropicServer(
+        tokens_per_second=args.tokens_per_second,
+        ttft_ms=args.ttft_ms,
+        cached_ttft_ms=args.cached_ttft_ms,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        disconnect_rate=args.disconnect_rate,
+        seed=0,
+    ).start()
+    os.environ["ANTHROPIC_BASE_URL"] = server.base_url
+    # 스크립트 실행 밖에서 st를 쓸 때마다 나오는 "missing ScriptRunContext" 경고를 끕니다.
+    streamlit.logger.set_log_level("error")
+
+    import app
+    from utils import gs, llm, log, warmup
+    from utils.config_refresher import ConfigRefresher
+    from utils.engine import get_engine
+    from utils.metrics import get_latency_stats
+    from utils import response_cache, session_store
+    from utils.sheet_writer import get_sheet_writer
+
+    log.setup()
+    if not args.verbose:
+        logging.getLogger(log.LOGGER_NAME).setLevel(logging.WARNING)
+
+    doc = FakeSpreadsheet(setup_values(args), latency_ms=args.sheet_latency_ms, quota_error_rate=args.sheet_error_rate, seed=0)
+    refresher = ConfigRefresher(lambda: gs.read_setup_column(doc), gs.parse_setup_info)
+    sim = SimulatedStreamlit()
+    app.st = gs.st = response_cache.st = session_store.st = sim
+    store_dir = tempfile.mkdtemp(prefix="bench-sessions-")
+    sim.secrets["session_store_path"] = os.path.join(store_dir, "sessions.sqlite3")
+    app.get_config_refresher = warmup.get_config_refresher = lambda: refresher
+    gs.get_spreadsheet = lambda url: doc
+
+    results = {}
+    threads = [
+        threading.Thread(target=run_session, args=(app, sim, i, args, results), name=f"session-{i}")
+        for i in range(args.sessions)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    writer = get_sheet_writer()
+    writer.stop(timeout=30)
+    refresher.stop()
+
+    completed = sum(r["completed"] for r in results.values())
+    latency = get_latency_stats().stats()["models"].get(args.model, {})
+    usage = llm.get_usage_stats().stats()
+    report = {
+        "sessions": args.sessions,
+        "turns_completed": completed,
+        "turns_failed": sum(r["failed"] for r in results.values()),
+        "reconnects": sum(r["reconnects"] for r in results.values()),
+        "reconnects_lost": sum(r["lost"] for r in results.values()),
+        "elapsed_seconds": round(elapsed, 2),
+        "turns_per_second": round(completed / elapsed, 2),
+        "output_tokens_per_second": round(sum(u["output_tokens"] for u in usage.values()) / elapsed, 1),
+        "latency": latency,
+        "session_state_bytes": percentiles([r["session_state_bytes"] for r in results.values()]),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "fake_anthropic": server.stats(),
+        "fake_sheet_calls": doc.calls(),
+        "sheet_writer": writer.stats(),
+        "engine": get_engine().stats(),
+        "cache_warmer": warmup.get_cache_warmer().stats(),
+        "response_cache": response_cache.get_response_cache().stats(),
+        "session_store": session_store.get_session_store().stats(),
+    }
+    server.stop()
+    session_store.get_session_store().stop()
+    shutil.rmtree(store_dir, ignore_errors=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+부하 테스트용 가짜 Anthropic Messages API 서버
+실제 SDK(anthropic.Anthropic)가 그대로 붙을 수 있도록 /v1/messages를 HTTP/SSE로 흉내 냅니다.
+
+단독 실행:
+    python benchmarks/fake_anthropic.py --port 8765 --tokens-per-second 60 --error-rate 0.05
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+- 스트리밍 요청에는 message_start -> content_block_delta(토큰 단위) -> message_delta -> message_stop 이벤트를 보냅니다.
+- 같은 시스템 프롬프트가 다시 오면 cache_read_input_tokens로, 처음이면 cache_creation_input_tokens로 셉니다.
+  캐시를 읽은 요청은 cached_ttft_ms만큼만 기다려, 프롬프트 처리가 줄어드는 효과를 흉내 냅니다.
+- error_rate 비율로 429/529 오류를 돌려주고, disconnect_rate 비율로 스트리밍 도중 overloaded_error 이벤트를 보냅니다.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("토론", "근거", "주장", "반론", "자료", "질문", "생각", "정리", "예시", "결론")
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 오류 이벤트 뒤 클라이언트가 연결을 먼저 끊는 것은 정상 동작이므로 출력하지 않습니다.
+        pass
+
+
+class FakeAnthropicServer:
+    """
+    백그라운드 스레드에서 도는 가짜 Messages API 서버입니다.
+
+    Parameters:
+    port (int): 들을 포트. 0이면 빈 포트를 고릅니다.
+    tokens_per_second (float): 스트리밍 출력 속도 (0이면 기다리지 않음)
+    ttft_ms (float): 요청을 받은 뒤 첫 토큰까지 기다릴 시간(ms)
+    cached_ttft_ms (float, optional): 프롬프트 캐시를 읽은 요청의 첫 토큰 시간(ms). 없으면 ttft_ms와 같습니다.
+    output_tokens (int): 응답 하나의 출력 토큰 수 (max_tokens보다 크면 max_tokens)
+    error_rate (float): 요청을 429/529 오류로 돌려줄 비율 (0~1)
+    disconnect_rate (float): 스트리밍 도중 오류 이벤트를 보내고 끊을 비율 (0~1)
+    seed (int, optional): 오류 주입 난수 시드
+    """
+
+    def __init__(self, port=0, tokens_per_second=50, ttft_ms=300, output_tokens=120,
+                 error_rate=0.0, disconnect_rate=0.0, seed=None, cached_ttft_ms=None):
+        self.tokens_per_second = tokens_per_second
+        self.ttft_ms = ttft_ms
+        self.cached_ttft_ms = ttft_ms if cached_ttft_ms is None else cached_ttft_ms
+        self.output_tokens = output_tokens
+        self.error_rate = error_rate
+        self.disconnect_rate = disconnect_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cached_prefixes = set()
+        self._stats = dict.fromkeys(("requests", "streams", "errors", "disconnects", "cache_reads"), 0)
+
+        server = self
+
+        class Handler(MessagesHandler):
+            fake = server
+
+        self._httpd = QuietHTTPServer(("127.0.0.1", port), Handler)
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-anthropic", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def roll(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def pick(self, n):
+        with self._lock:
+            return self._random.randrange(n)
+
+    def usage_for(self, body):
+        """
+        요청 본문으로 입력 토큰 수와 프롬프트 캐시 읽기/쓰기 토큰 수를 흉내 냅니다. (글자 수 / 2)
+        """
+        system = json.dumps(body.get("system", ""), ensure_ascii=False)
+        messages = json.dumps(body.get("messages", []), ensure_ascii=False)
+        prefix = hashlib.sha256((body.get("model", "") + system).encode("utf-8")).hexdigest()
+        system_tokens = len(system) // 2 + 1
+        with self._lock:
+            hit = prefix in self._cached_prefixes
+            self._cached_prefixes.add(prefix)
+            if hit:
+                self._stats["cache_reads"] += 1
+        return {
+            "input_tokens": len(messages) // 2 + 1,
+            "cache_read_input_tokens": system_tokens if hit else 0,
+            "cache_creation_input_tokens": 0 if hit else system_tokens,
+            "output_tokens": 1,
+        }
+
+
+class MessagesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.fake
+        body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+        fake.count("requests")
+        if not self.path.startswith("/v1/messages"):
+            return self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+        if fake.roll(fake.error_rate):
+            fake.count("errors")
+            if fake.roll(0.5):
+                return self._send_json(
+                    429,
+                    {"type": "error", "error": {"type": "rate_limit_error", "message": "fake rate limit"}},
+                    {"retry-after": "1"},
+                )
+            return self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "fake overload"}})
+
+        usage = fake.usage_for(body)
+        ttft_ms = fake.cached_ttft_ms if usage["cache_read_input_tokens"] else fake.ttft_ms
+        output_tokens = max(1, min(fake.output_tokens, int(body.get("max_tokens", fake.output_tokens))))
+        tokens = [WORDS[i % len(WORDS)] + " " for i in range(output_tokens)]
+        message = {
+            "id": f"msg_fake_{time.monotonic_ns()}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": [],
+            "stop_reason": None,
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+        if not body.get("stream"):
+            time.sleep(ttft_ms / 1000 + (output_tokens / fake.tokens_per_second if fake.tokens_per_second else 0))
+            message.update(
+                content=[{"type": "text", "text": "".join(tokens)}],
+                stop_reason="end_turn",
+                usage=dict(usage, output_tokens=output_tokens),
+            )
+            return self._send_json(200, message)
+
+        fake.count("streams")
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        try:
+            self._send_event("message_start", {"type": "message_start", "message": message})
+            self._send_event("content_block_start", {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+            time.sleep(ttft_ms / 1000)
+
+            disconnect_at = fake.pick(output_tokens) if fake.roll(fake.disconnect_rate) else None
+            for i, token in enumerate(tokens):
+                if i == disconnect_at:
+                    fake.count("disconnects")
+                    self._send_event("error", {"type": "error", "error": {"type": "overloaded_error", "message": "fake disconnect"}})
+                    break
+                self._send_event("content_block_delta", {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}})
+                if fake.tokens_per_second:
+                    time.sleep(1 / fake.tokens_per_second)
+            else:
+                self._send_event("content_block_stop", {"type": "content_block_stop", "index": 0})
+                self._send_event("message_delta", {
+                    "type": "message_delta",
+                    "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                    "usage": {"output_tokens": output_tokens},
+                })
+                self._send_event("message_stop", {"type": "message_stop"})
+            self._write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # 클라이언트가 먼저 끊은 경우
+            self.close_connection = True
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, event, data):
+        self._write_chunk(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="가짜 Anthropic Messages API 서버")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--cached-ttft-ms", type=float, default=None)
+    parser.add_argument("--output-tokens", type=int, default=120)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeAnthropicServer(
+        port=args.port,
+        tokens_per_second=args.tokens_per_second,
+        ttft_ms=args.ttft_ms,
+        cached_ttft_ms=args.cached_ttft_ms,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        disconnect_rate=args.disconnect_rate,
+    ).start()
+    print(f"가짜 Anthropic 서버: {server.base_url} (Ctrl+C로 종료)")
+    try:
+        while True:
+            time.sleep(10)
+            print(server.stats())
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
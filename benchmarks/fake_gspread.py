@@ -0,0 +1,249 @@
+"""
+부하 테스트용 메모리 안의 가짜 gspread 스프레드시트
+utils/gs.py, utils/sheet_writer.py, jobs/evaluate_class.py가 쓰는 메서드만 흉내 냅니다.
+
+- 모든 API 호출은 latency_ms만큼 기다리고, quota_error_rate 비율로 429 APIError를 냅니다.
+- calls()로 메서드별 호출 수를 확인할 수 있어, 요청 수를 줄이는 변경의 효과를 셀 수 있습니다.
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+import gspread
+import requests
+
+from utils.gs import SETUP_SHEET, SUMMARY_SHEET, TEMPLATE_SHEET
+
+A1_CELL = re.compile(r"^([A-Z]+)(\d+)?$")
+HYPERLINK = re.compile(r'^=HYPERLINK\("[^"]*", "(.*)"\)$')
+
+
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index
+
+
+def parse_range(range_name):
+    """
+    "'시트'!A2:C" 같은 범위를 (시트 이름, 첫 행, 첫 열, 끝 행, 끝 열)로 바꿉니다. 행/열은 1부터, 끝이 없으면 None입니다.
+    """
+    sheet, _, cells = range_name.rpartition("!")
+    sheet = sheet.strip("'").replace("''", "'") or None
+    start, _, end = cells.partition(":")
+    start_match, end_match = A1_CELL.match(start), A1_CELL.match(end or start)
+    return (
+        sheet,
+        int(start_match.group(2) or 1),
+        column_index(start_match.group(1)),
+        int(end_match.group(2)) if end_match.group(2) else None,
+        column_index(end_match.group(1)),
+    )
+
+
+def quota_error(status=429):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(
+        {"error": {"code": status, "message": "fake quota exceeded", "status": "RESOURCE_EXHAUSTED"}}
+    ).encode("utf-8")
+    return gspread.exceptions.APIError(response)
+
+
+class FakeWorksheet:
+    def __init__(self, doc, sheet_id, title, rows=None):
+        self.doc = doc
+        self.spreadsheet = doc
+        self.id = sheet_id
+        self.title = title
+        self.rows = [list(row) for row in rows or []]
+
+    def col_values(self, col):
+        self.doc._call("col_values")
+        with self.doc._lock:
+            values = [displayed(row[col - 1]) if len(row) >= col else "" for row in self.rows]
+        while values and values[-1] == "":
+            values.pop()
+        return values
+
+    def update(self, range_name, values=None):
+        # gspread 5는 update(범위, 값), 6은 update(값, 범위) 순서이므로 둘 다 받습니다.
+        if not isinstance(range_name, str):
+            range_name, values = values, range_name
+        self.doc._call("update")
+        self._write(range_name, values)
+
+    def update_acell(self, label, value):
+        self.doc._call("update_acell")
+        self._write(label, [[value]])
+
+    def batch_update(self, data, **kwargs):
+        self.doc._call("worksheet_batch_update")
+        for item in data:
+            self._write(item["range"], item["values"])
+
+    def _write(self, range_name, values):
+        _, first_row, first_col, _, _ = parse_range(range_name)
+        with self.doc._lock:
+            for row_offset, row_values in enumerate(values):
+                row_index = first_row - 1 + row_offset
+                while len(self.rows) <= row_index:
+                    self.rows.append([])
+                row = self.rows[row_index]
+                for col_offset, value in enumerate(row_values):
+                    col_index = first_col - 1 + col_offset
+                    row.extend([""] * (col_index + 1 - len(row)))
+                    row[col_index] = value if isinstance(value, str) else str(value)
+
+
+class FakeSpreadsheet:
+    """
+    "정보", "템플릿", "수업요약" 시트가 있는 수업 스프레드시트입니다.
+
+    Parameters:
+    setup_values (list): "정보" 시트 B열 값
+    latency_ms (float): API 호출 한 번마다 기다릴 시간(ms)
+    quota_error_rate (float): 429 오류를 낼 비율 (0~1)
+    seed (int, optional): 오류 주입 난수 시드
+    """
+
+    def __init__(self, setup_values, latency_ms=80, quota_error_rate=0.0, seed=None, doc_id="fake-class"):
+        self.id = doc_id
+        self.title = "가짜 수업"
+        self.latency_ms = latency_ms
+        self.quota_error_rate = quota_error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._calls = Counter()
+        self._next_id = 100
+        self._sheets = {}
+        self._add(SETUP_SHEET, [["", value] for value in setup_values])
+        self._add(TEMPLATE_SHEET, [["시각", "역할", "내용"]])
+        self._add(SUMMARY_SHEET, [["확인", "이름", "종합 평가", "평어"]])
+
+    def calls(self):
+        with self._lock:
+            return dict(self._calls)
+
+    def worksheets(self):
+        self._call("worksheets")
+        with self._lock:
+            return list(self._sheets.values())
+
+    def worksheet(self, title):
+        self._call("worksheet")
+        with self._lock:
+            if title not in self._sheets:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self._sheets[title]
+
+    def values_get(self, range_name, params=None):
+        self._call("values_get")
+        return {"range": range_name, "values": self._read(range_name, (params or {}).get("majorDimension"))}
+
+    def values_batch_get(self, ranges, params=None):
+        self._call("values_batch_get")
+        major = (params or {}).get("majorDimension")
+        return {"valueRanges": [{"range": r, "values": self._read(r, major)} for r in ranges]}
+
+    def duplicate_sheet(self, source_sheet_id, insert_sheet_index=None, new_sheet_id=None, new_sheet_name=None):
+        self._call("duplicate_sheet")
+        return self._duplicate(source_sheet_id, new_sheet_id, new_sheet_name)
+
+    def batch_update(self, body):
+        self._call("batch_update")
+        replies = []
+        for request in body.get("requests", []):
+            (kind, spec), = request.items()
+            if kind == "appendCells":
+                sheet = self._by_id(spec["sheetId"])
+                with self._lock:
+                    sheet.rows.extend([cell_value(cell) for cell in row.get("values", [])] for row in spec["rows"])
+                replies.append({})
+            elif kind == "duplicateSheet":
+                sheet = self._duplicate(spec["sourceSheetId"], spec.get("newSheetId"), spec.get("newSheetName"))
+                replies.append({"duplicateSheet": {"properties": {"sheetId": sheet.id, "title": sheet.title}}})
+            elif kind == "updateCells":
+                sheet = self._by_id(spec["start"]["sheetId"])
+                first_row, first_col = spec["start"].get("rowIndex", 0), spec["start"].get("columnIndex", 0)
+                for offset, row in enumerate(spec["rows"]):
+                    values = [cell_value(cell) for cell in row.get("values", [])]
+                    sheet._write(f"{column_letter(first_col + 1)}{first_row + offset + 1}", [values])
+                replies.append({})
+            else:
+                raise NotImplementedError(f"가짜 스프레드시트가 지원하지 않는 요청: {kind}")
+        return {"spreadsheetId": self.id, "replies": replies}
+
+    def _call(self, name):
+        with self._lock:
+            self._calls[name] += 1
+            fail = self.quota_error_rate > 0 and self._random.random() < self.quota_error_rate
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if fail:
+            raise quota_error()
+
+    def _add(self, title, rows):
+        with self._lock:
+            sheet = self._sheets[title] = FakeWorksheet(self, self._next_id, title, rows)
+            self._next_id += 1
+            return sheet
+
+    def _by_id(self, sheet_id):
+        with self._lock:
+            for sheet in self._sheets.values():
+                if sheet.id == sheet_id:
+                    return sheet
+        raise KeyError(sheet_id)
+
+    def _duplicate(self, source_sheet_id, new_sheet_id, new_sheet_name):
+        with self._lock:
+            if new_sheet_name in self._sheets:
+                raise quota_error(400)
+            source = self._by_id(source_sheet_id)
+            sheet = self._add(new_sheet_name, source.rows)
+            if new_sheet_id is not None:
+                sheet.id = new_sheet_id
+            return sheet
+
+    def _read(self, range_name, major_dimension=None):
+        title, first_row, first_col, last_row, last_col = parse_range(range_name)
+        with self._lock:
+            rows = self._sheets[title].rows[first_row - 1:last_row]
+            values = [[displayed(value) for value in row[first_col - 1:last_col]] for row in rows]
+        if major_dimension == "COLUMNS":
+            width = max((len(row) for row in values), default=0)
+            values = [[row[col] if col < len(row) else "" for row in values] for col in range(width)]
+            for column in values:
+                while column and column[-1] == "":
+                    column.pop()
+        return values
+
+
+def displayed(value):
+    """
+    셀에 보이는 값을 반환합니다. HYPERLINK 수식은 표시 텍스트로 바꿉니다.
+    """
+    match = HYPERLINK.match(value)
+    return match.group(1) if match else value
+
+
+def cell_value(cell):
+    value = cell.get("userEnteredValue", {})
+    if "formulaValue" in value:
+        return value["formulaValue"]
+    if "boolValue" in value:
+        return str(value["boolValue"]).upper()
+    return str(value.get("stringValue", value.get("numberValue", "")))
+
+
+def column_letter(index):
+    letters = ""
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
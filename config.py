@@ -1,6 +1,7 @@
 import promptlayer
 import streamlit as st
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
+from anthropic import HUMAN_PROMPT, AI_PROMPT
+from utils import llm
 
 
 # # openai
@@ -12,4 +13,4 @@ from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
 
 # anthropic
 anthropic_api_key = st.secrets.get("ANTHROPIC_API_KEY", "")
-anthropic = Anthropic(api_key=anthropic_api_key)
\ No newline at end of file
+anthropic = llm.get_client(anthropic_api_key)
\ No newline at end of file
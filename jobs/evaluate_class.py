@@ -0,0 +1,328 @@
+"""
+수업 전체 평가 일괄 실행 (브라우저 없이 실행하는 작업)
+학생별 시트의 대화 기록을 모두 읽어 종합 평가(a_p)와 평어(e_p)를 만들고, "수업요약" 시트 C/D열에 묶어서 저장합니다.
+
+실행 방법 (저장소 최상위 폴더에서, .streamlit/secrets.toml이 있는 환경):
+    python -m jobs.evaluate_class                  # 작업 스레드 4개로 바로 실행
+    python -m jobs.evaluate_class --workers 8
+    python -m jobs.evaluate_class --mode batches   # Message Batches API (비용 절반, 완료까지 수 분~수 시간)
+    python -m jobs.evaluate_class --dry-run        # 평가할 학생 수만 확인
+    python -m jobs.evaluate_class --student 김철수 --student 이영희 --force
+
+- 학생 시트에는 "정보" 시트 B17 save_transcript가 on/private일 때만 대화가 저장됩니다. (기본값 off)
+  off이면 평가할 대화가 없어 오류로 끝나고, private이면 개인정보를 가린 대화로 평가합니다.
+- 진행 상황은 체크포인트 파일(.cache/evaluate_<스프레드시트 ID>.json)에 저장합니다.
+  중간에 멈춰도 다시 실행하면 끝난 학생은 건너뛰고 이어서 진행합니다.
+- 체크포인트 이후 대화가 더 진행된 학생은 다시 평가합니다. (대화 기록 체크섬으로 확인)
+- --mode batches로 만든 배치가 끝나기 전에 멈춘 경우, 다시 실행하면 같은 배치를 이어서 기다립니다.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import streamlit as st
+
+from utils import gs, llm, log
+
+CHECKPOINT_DIR = Path(__file__).resolve().parent.parent / ".cache"
+READ_CHUNK = 40
+WRITE_CHUNK = 100
+BATCH_POLL_SECONDS = 30
+ROLES = {"USER": "user", "ASSISTANT": "assistant"}
+PROMPTS = ("a_p", "e_p")
+
+
+def transcript_to_messages(rows):
+    """
+    학생 시트의 행([시각, "USER"/"ASSISTANT", 내용])을 API 메시지 리스트로 바꿉니다.
+
+    - 제목 행 등 역할이 없는 행은 건너뜁니다.
+    - 같은 역할이 이어지면 하나로 합치고, 챗봇 메시지로 시작하면 그 메시지는 버립니다.
+    """
+    messages = []
+    for row in rows:
+        if len(row) < 3 or row[1] not in ROLES or not row[2].strip():
+            continue
+        role = ROLES[row[1]]
+        if messages and messages[-1]["role"] == role:
+            messages[-1]["content"] += "\n\n" + row[2]
+        elif messages or role == "user":
+            messages.append({"role": role, "content": row[2]})
+    return messages
+
+
+def read_transcripts(doc, names):
+    """
+    학생들의 시트를 READ_CHUNK개씩 values_batch_get 한 번으로 읽습니다.
+
+    Returns:
+    dict: 대화명 -> 메시지 리스트 (대화가 없는 학생은 빠집니다)
+    """
+    transcripts = {}
+    for start in range(0, len(names), READ_CHUNK):
+        chunk = names[start:start + READ_CHUNK]
+        ranges = ["'{}'!A:C".format(name.replace("'", "''")) for name in chunk]
+        response = doc.values_batch_get(ranges)
+        for name, value_range in zip(chunk, response.get("valueRanges", [])):
+            messages = transcript_to_messages(value_range.get("values", []))
+            if messages:
+                transcripts[name] = messages
+    return transcripts
+
+
+def transcript_checksum(messages):
+    return hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+class Checkpoint:
+    """
+    일괄 평가 진행 상황을 JSON 파일로 저장합니다.
+
+    data:
+    - results: 대화명 -> {"checksum", "a_p", "e_p", "written"}
+    - batch: 진행 중인 Message Batch {"id", "requests": custom_id -> [대화명, 프롬프트 키], "checksums"}
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+        self.data.setdefault("results", {})
+        self.data.setdefault("batch", None)
+
+    @property
+    def results(self):
+        return self.data["results"]
+
+    def is_done(self, name, checksum):
+        result = self.results.get(name)
+        return bool(result and result.get("checksum") == checksum and all(result.get(key) for key in PROMPTS))
+
+    def set_result(self, name, checksum, key, text):
+        result = self.results.get(name)
+        if not result or result.get("checksum") != checksum:
+            result = self.results[name] = {"checksum": checksum, "written": False}
+        result[key] = text
+        result["written"] = False
+
+    def save(self):
+        """
+        임시 파일에 쓴 뒤 바꿔 넣으므로, 저장 중에 멈춰도 이전 체크포인트가 남습니다.
+        """
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".evaluate.", dir=self.path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def evaluate_pool(client, setupInfo, pending, checkpoint, workers):
+    """
+    작업 스레드 workers개로 평가합니다.
+    한 학생 안에서는 종합 평가 -> 평어 순서로 보내므로, 평어 요청은 종합 평가 요청이 써 둔 프롬프트 캐시를 읽습니다.
+    """
+    def evaluate_student(name, messages):
+        texts = {}
+        for key in PROMPTS:
+            texts[key], usage, stop_reason = llm.complete(client, setupInfo, messages + [{"role": "user", "content": setupInfo[key]}])
+            log.event("학생 평가 생성", student = name, prompt = key, stop_reason = stop_reason, **usage)
+        return texts
+
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(evaluate_student, name, messages): name for name, messages in pending.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            name = futures[future]
+            try:
+                texts = future.result()
+            except Exception as e:
+                failed += 1
+                log.event("학생 평가 실패", logging.ERROR, student = name, error_type = type(e).__name__, error = str(e))
+                continue
+
+            checksum = transcript_checksum(pending[name])
+            for key in PROMPTS:
+                checkpoint.set_result(name, checksum, key, texts[key])
+            checkpoint.save()
+            print(f"[{done}/{len(pending)}] {name} 평가 완료")
+    return failed
+
+
+def evaluate_batches(client, setupInfo, pending, checkpoint, poll_seconds=BATCH_POLL_SECONDS):
+    """
+    Message Batches API로 모든 요청을 한 번에 보내고, 끝날 때까지 기다려 결과를 모읍니다.
+    체크포인트에 진행 중인 배치가 있으면 새로 만들지 않고 그 배치를 기다립니다.
+    """
+    batch = checkpoint.data["batch"]
+    if batch is None:
+        requests = []
+        mapping = {}
+        for idx, (name, messages) in enumerate(pending.items()):
+            for key in PROMPTS:
+                # custom_id는 영문/숫자/_/-만 쓸 수 있으므로 대화명 대신 번호를 씁니다.
+                custom_id = f"s{idx}-{key.replace('_', '')}"
+                system, request_messages = llm.build_cached_request(
+                    setupInfo["system"],
+                    messages + [{"role": "user", "content": setupInfo[key]}],
+                )
+                requests.append({
+                    "custom_id": custom_id,
+                    "params": {
+                        "model": setupInfo["model"],
+                        "max_tokens": setupInfo["max_tokens"],
+                        "temperature": setupInfo["temperature"],
+                        "system": system,
+                        "messages": request_messages,
+                    },
+                })
+                mapping[custom_id] = [name, key]
+
+        created = client.messages.batches.create(requests=requests)
+        batch = checkpoint.data["batch"] = {
+            "id": created.id,
+            "requests": mapping,
+            "checksums": {name: transcript_checksum(messages) for name, messages in pending.items()},
+        }
+        checkpoint.save()
+        log.event("평가 배치 생성", batch_id = created.id, requests = len(requests))
+        print(f"배치 {created.id} 생성 ({len(requests)}개 요청)")
+
+    while True:
+        status = client.messages.batches.retrieve(batch["id"])
+        if status.processing_status == "ended":
+            break
+        counts = status.request_counts
+        print(f"배치 처리 중... 완료 {counts.succeeded + counts.errored}/{len(batch['requests'])}")
+        time.sleep(poll_seconds)
+
+    failed = 0
+    for entry in client.messages.batches.results(batch["id"]):
+        name, key = batch["requests"][entry.custom_id]
+        if entry.result.type != "succeeded":
+            failed += 1
+            log.event("학생 평가 실패", logging.ERROR, student = name, prompt = key, result_type = entry.result.type)
+            continue
+        message = entry.result.message
+        text = "".join(block.text for block in message.content if block.type == "text").strip()
+        checkpoint.set_result(name, batch["checksums"][name], key, text)
+
+    checkpoint.data["batch"] = None
+    checkpoint.save()
+    return failed
+
+
+def write_results(doc, checkpoint, chunk=WRITE_CHUNK):
+    """
+    아직 저장하지 않은 결과를 "수업요약" C/D열에 chunk행씩 batch_update 한 번으로 저장합니다.
+
+    Returns:
+    int: 저장한 학생 수
+    """
+    index = gs.get_worksheet_index()
+    rows = index.summary_rows(doc, refresh=True)
+    summary = index.lookup(doc, gs.SUMMARY_SHEET)
+
+    ready = [
+        name for name, result in checkpoint.results.items()
+        if not result.get("written") and all(result.get(key) for key in PROMPTS) and name in rows
+    ]
+    for start in range(0, len(ready), chunk):
+        names = ready[start:start + chunk]
+        summary.batch_update([
+            {
+                "range": f"C{rows[name]}:D{rows[name]}",
+                "values": [[checkpoint.results[name]["a_p"], checkpoint.results[name]["e_p"]]],
+            }
+            for name in names
+        ])
+        for name in names:
+            checkpoint.results[name]["written"] = True
+        checkpoint.save()
+        print(f"수업요약 저장 {min(start + chunk, len(ready))}/{len(ready)}")
+    return len(ready)
+
+
+def load_setup_info():
+    """
+    설정 시트에서 설정을 읽습니다. (앱과 같은 검사 규칙 사용)
+    """
+    return gs.parse_setup_info(gs.read_setup_column(gs.get_spreadsheet(st.secrets["sheet_url"])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="수업 전체 학생의 종합 평가/평어를 만들어 수업요약 시트에 저장합니다.",
+        epilog='학생 시트의 대화 기록을 읽으므로 "정보" 시트 B17 save_transcript가 on(또는 private)이어야 합니다. '
+               "기본값 off이면 학생 시트에 대화가 없어 평가할 학생이 없습니다. private이면 개인정보를 가린 대화로 평가합니다.",
+    )
+    parser.add_argument("--mode", choices=("pool", "batches"), default="pool", help="pool: 작업 스레드로 바로 실행, batches: Message Batches API")
+    parser.add_argument("--workers", type=int, default=4, help="pool 모드의 동시 학생 수 (기본 4)")
+    parser.add_argument("--student", action="append", help="이 학생만 평가 (여러 번 지정 가능)")
+    parser.add_argument("--force", action="store_true", help="이미 평가한 학생도 다시 평가")
+    parser.add_argument("--checkpoint", help="체크포인트 파일 경로 (기본 .cache/evaluate_<스프레드시트 ID>.json)")
+    parser.add_argument("--dry-run", action="store_true", help="평가할 학생 수만 출력")
+    args = parser.parse_args(argv)
+
+    setupInfo = load_setup_info()
+    doc = gs.get_spreadsheet(setupInfo["url"])
+    checkpoint = Checkpoint(args.checkpoint or CHECKPOINT_DIR / f"evaluate_{doc.id}.json")
+
+    index = gs.get_worksheet_index()
+    names = [name for name in index.summary_rows(doc, refresh=True) if index.lookup(doc, name) is not None]
+    if args.student:
+        names = [name for name in names if name in args.student]
+
+    transcripts = read_transcripts(doc, names)
+    save_mode = setupInfo.get("save_transcript", "off")
+    if save_mode == "off":
+        print('경고: "정보" 시트 B17 save_transcript가 off입니다. 학생 시트에는 B17을 켜 둔 동안의 대화만 있습니다.', file=sys.stderr)
+    elif save_mode == "private":
+        print("안내: B17 save_transcript가 private이므로 개인정보를 가린 대화로 평가합니다.", file=sys.stderr)
+    pending = {
+        name: messages for name, messages in transcripts.items()
+        if args.force or not checkpoint.is_done(name, transcript_checksum(messages))
+    }
+    print(f"학생 {len(names)}명, 대화 있음 {len(transcripts)}명, 평가할 학생 {len(pending)}명")
+    if names and not transcripts:
+        log.event("평가할 대화 없음", logging.ERROR, students = len(names), save_transcript = save_mode)
+        print(
+            "오류: 학생 시트에 대화 기록이 하나도 없습니다. "
+            '"정보" 시트 B17 save_transcript를 on 또는 private으로 바꾼 뒤 진행한 수업만 평가할 수 있습니다.',
+            file=sys.stderr,
+        )
+        return 2
+    if args.dry_run:
+        return 0
+
+    failed = 0
+    if pending or checkpoint.data["batch"]:
+        with llm.lease_client(setupInfo["key"]) as client:
+            if args.mode == "batches" or checkpoint.data["batch"]:
+                failed = evaluate_batches(client, setupInfo, pending, checkpoint)
+            else:
+                failed = evaluate_pool(client, setupInfo, pending, checkpoint, args.workers)
+
+    written = write_results(doc, checkpoint)
+    log.event("수업 평가 완료", pending = len(pending), failed = failed, written = written)
+    print(f"완료: 평가 대상 {len(pending)}명, 실패 {failed}건, 수업요약 저장 {written}명")
+    if failed:
+        print("실패한 학생은 같은 명령을 다시 실행하면 이어서 평가합니다.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+"""
+설정 시트 백그라운드 새로고침
+"정보" 시트를 주기적으로 읽어, 값이 바뀌었고 검사를 통과한 경우에만 새 설정으로 바꿉니다.
+마지막 설정은 로컬 파일(스냅샷)에도 저장해, 앱을 다시 시작할 때 시트를 기다리지 않고 바로 씁니다.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import streamlit as st
+
+from utils import gs, log
+
+# 시트를 다시 읽는 기본 간격(초). Sheets API 읽기 할당량은 읽는 셀 수가 아니라 요청 수로 세므로
+# (서비스 계정당 분당 60회), 작은 셀만 먼저 확인해도 요청 수는 줄지 않습니다. 간격으로 요청 수를 정합니다.
+# 60초이면 앱 서버 하나가 분당 1회(할당량의 약 2%)를 씁니다.
+CONFIG_POLL_SECONDS = 60
+# 이 횟수만큼 연달아 시트와 맞춰 보지 못하면 설정이 오래되었다고(stale) 표시합니다.
+STALE_AFTER_POLLS = 4
+SNAPSHOT_PATH = Path(__file__).resolve().parent.parent / ".cache" / "setup_snapshot.json"
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+
+def config_checksum(data):
+    """
+    "정보" 시트 B열 값 리스트의 sha256을 반환합니다.
+    """
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ConfigSnapshot:
+    """
+    "정보" 시트 B열 값을 로컬 JSON 파일로 저장하고 읽습니다.
+
+    Parameters:
+    path (str or Path): 스냅샷 파일 경로
+    max_age (float): 이보다 오래된 스냅샷은 쓰지 않습니다(초). 0 이하이면 스냅샷을 쓰지 않습니다.
+
+    - API KEY가 들어 있으므로 파일 권한은 0600(소유자만 읽기/쓰기), 폴더 권한은 0700으로 만듭니다.
+    - 임시 파일에 다 쓴 뒤 os.replace()로 바꾸므로, 쓰는 도중에 앱이 멈춰도 반쯤 쓴 파일이 남지 않습니다.
+    - 저장하는 것은 검사 전의 B열 값입니다. 읽을 때 다시 검사하므로, 코드가 바뀌어 검사 규칙이 달라져도 안전합니다.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE):
+        self.path = Path(path)
+        self.max_age = max_age
+
+    def load(self):
+        """
+        저장된 (B열 값 리스트, 저장 시각)을 반환합니다. 없거나, 너무 오래되었거나, 읽을 수 없으면 None입니다.
+        """
+        if self.max_age <= 0:
+            return None
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            data, saved_at = list(snapshot["data"]), float(snapshot["saved_at"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log.event("설정 스냅샷 읽기 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+            return None
+
+        if time.time() - saved_at > self.max_age:
+            return None
+        return data, saved_at
+
+    def save(self, data):
+        """
+        B열 값 리스트를 저장합니다. 실패해도 앱 동작에는 영향이 없으므로 로그만 남깁니다.
+        """
+        if self.max_age <= 0:
+            return
+
+        try:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # mkstemp는 0600 권한으로 파일을 만듭니다.
+            fd, tmp_path = tempfile.mkstemp(prefix=".setup_snapshot.", dir=self.path.parent)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump({"saved_at": time.time(), "data": data}, f, ensure_ascii=False)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            log.event("설정 스냅샷 저장 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+
+
+class SetupConfig:
+    """
+    검사를 통과한 설정 한 벌입니다. 만든 뒤에는 바꾸지 않습니다.
+
+    Parameters:
+    values (dict): gs.parse_setup_info()가 만든 설정 딕셔너리
+    version (int): 프로세스 안에서 설정이 바뀔 때마다 1씩 늘어나는 번호
+    checksum (str): "정보" 시트 B열 값의 sha256
+    loaded_at (float): 이 설정을 읽은 시각 (time.time())
+    """
+
+    __slots__ = ("values", "version", "checksum", "loaded_at")
+
+    def __init__(self, values, version, checksum, loaded_at):
+        self.values = values
+        self.version = version
+        self.checksum = checksum
+        self.loaded_at = loaded_at
+
+
+class ConfigRefresher:
+    """
+    설정을 백그라운드 스레드에서 새로고침하는 프로세스 공용 객체입니다.
+
+    Parameters:
+    read (callable): "정보" 시트 B열 값 리스트를 읽는 함수 (요청 한 번)
+    parse (callable): B열 값 리스트를 설정 딕셔너리로 바꾸고, 잘못된 값이면 ValueError를 내는 함수
+    interval (float): 시트를 다시 읽는 간격(초)
+    snapshot (ConfigSnapshot, optional): 마지막 설정을 저장할 로컬 스냅샷
+
+    - 읽은 값의 체크섬이 지난번과 같으면 아무것도 하지 않습니다.
+    - 값이 바뀌었으면 검사(parse)를 통과한 경우에만 SetupConfig를 새로 만들어 한 번에 바꿉니다.
+      세션은 current()가 돌려준 객체 하나를 쓰므로, 일부만 바뀐 설정을 보는 일이 없습니다.
+    - 시트를 읽을 수 없거나 값이 잘못되었으면 마지막으로 검사를 통과한 설정을 계속 사용합니다.
+    - 학생 요청 스레드는 시트를 읽지 않습니다. (스냅샷이 없을 때 처음 한 번만 예외)
+    - 앱을 다시 시작하면 쓸 수 있는 스냅샷으로 바로 시작하고, 시트 확인은 백그라운드에서 곧바로 합니다.
+    """
+
+    def __init__(self, read, parse, interval=CONFIG_POLL_SECONDS, snapshot=None):
+        self.read = read
+        self.parse = parse
+        self.interval = interval
+        self.snapshot = snapshot
+        self._source = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._current = None
+        self._listeners = []
+        self._status = {
+            "checks": 0,
+            "failures": 0,
+            "last_ok_at": None,
+            "last_error": None,
+        }
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """
+        현재 설정(SetupConfig)을 반환합니다.
+        처음 호출할 때는 스냅샷을 먼저 쓰고, 없으면 시트를 직접 읽습니다(실패하면 예외가 그대로 발생).
+        그 뒤 새로고침 스레드를 시작합니다.
+        """
+        if self._current is None:
+            with self._load_lock:
+                if self._current is None:
+                    from_snapshot = self._load_snapshot()
+                    if not from_snapshot:
+                        self.refresh()
+                    self._thread = threading.Thread(
+                        target=self._run,
+                        args=(from_snapshot,),
+                        name="config-refresher",
+                        daemon=True,
+                    )
+                    self._thread.start()
+        return self._current
+
+    def refresh(self):
+        """
+        시트를 바로 한 번 읽습니다. 설정이 바뀌었으면 True를 반환합니다.
+        읽기나 검사에 실패하면 예외가 발생하고, 현재 설정은 그대로 남습니다.
+        """
+        try:
+            data = self.read()
+            checksum = config_checksum(data)
+            current = self._current
+            changed = current is None or checksum != current.checksum
+            if changed:
+                values = self.parse(data)
+        except Exception as e:
+            with self._lock:
+                self._status["checks"] += 1
+                self._status["failures"] += 1
+                self._status["last_error"] = f"{type(e).__name__}: {e}"
+            raise
+
+        with self._lock:
+            self._status["checks"] += 1
+            self._status["last_ok_at"] = time.time()
+            self._status["last_error"] = None
+            # 스냅샷으로 시작한 경우, 처음 시트를 확인하면 값이 같아도 스냅샷 저장 시각을 새로 고칩니다.
+            reconcile = self._source != "sheet"
+            self._source = "sheet"
+            if changed:
+                old = self._current
+                new = SetupConfig(values, (old.version if old else 0) + 1, checksum, time.time())
+                self._current = new
+                listeners = list(self._listeners)
+
+        if self.snapshot is not None and (changed or reconcile):
+            self.snapshot.save(data)
+        if not changed:
+            return False
+
+        if old is not None:
+            changed_keys = sorted(key for key in new.values if new.values[key] != old.values.get(key))
+            log.event("설정 변경", version = new.version, changed = changed_keys)
+        for listener in listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                log.event("설정 변경 알림 실패", logging.ERROR, error_type = type(e).__name__, error = str(e))
+        return True
+
+    def subscribe(self, listener):
+        """
+        설정이 바뀔 때 listener(이전 SetupConfig 또는 None, 새 SetupConfig)를 호출하도록 등록합니다.
+        listener는 새로고침 스레드에서 호출되므로 st.session_state를 쓰면 안 됩니다.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def status(self):
+        """
+        화면에 보여줄 설정 상태를 반환합니다.
+
+        Returns:
+        dict: version, source("sheet" 또는 "snapshot"), loaded_at, last_ok_at,
+            age_seconds(시트와 마지막으로 맞춰 본 뒤 지난 시간), stale(age_seconds가 interval * STALE_AFTER_POLLS 초과),
+            checks, failures, last_error
+        """
+        with self._lock:
+            status = dict(self._status)
+            status["source"] = self._source
+            current = self._current
+        status["version"] = current.version if current else None
+        status["loaded_at"] = current.loaded_at if current else None
+        confirmed_at = status["last_ok_at"] or status["loaded_at"]
+        status["age_seconds"] = round(time.time() - confirmed_at) if confirmed_at else None
+        status["stale"] = status["age_seconds"] is None or status["age_seconds"] > self.interval * STALE_AFTER_POLLS
+        return status
+
+    def stop(self):
+        """
+        새로고침 스레드를 멈춥니다.
+        """
+        self._stopped.set()
+
+    def _load_snapshot(self):
+        if self.snapshot is None:
+            return False
+
+        loaded = self.snapshot.load()
+        if loaded is None:
+            return False
+
+        data, saved_at = loaded
+        try:
+            values = self.parse(data)
+        except ValueError as e:
+            log.event("설정 스냅샷 검사 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+            return False
+
+        with self._lock:
+            self._current = SetupConfig(values, 1, config_checksum(data), saved_at)
+            self._source = "snapshot"
+        log.event("설정 스냅샷 사용", age_seconds = round(time.time() - saved_at))
+        return True
+
+    def _run(self, check_now=False):
+        # 스냅샷으로 시작했으면 기다리지 않고 바로 시트와 맞춰 봅니다.
+        if check_now:
+            try:
+                self.refresh()
+            except Exception as e:
+                log.event("설정 읽기 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                log.event("설정 읽기 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+
+
+@st.cache_resource
+def get_config_refresher():
+    """
+    프로세스 공용 ConfigRefresher를 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 설정 객체를 봅니다.
+    Secrets의 config_snapshot_max_age(초, 기본 86400)로 스냅샷을 쓸 최대 나이를 정하며, 0이면 스냅샷을 쓰지 않습니다.
+    Secrets의 config_poll_seconds(초, 기본 CONFIG_POLL_SECONDS)로 시트를 다시 읽는 간격을 바꿀 수 있습니다.
+    """
+    sheet_url = st.secrets["sheet_url"]
+    snapshot = ConfigSnapshot(max_age=float(st.secrets.get("config_snapshot_max_age", SNAPSHOT_MAX_AGE)))
+
+    # 시트 연결(인증, open_by_url)도 처음 읽을 때까지 미룹니다. 스냅샷이 있으면 첫 화면이 이를 기다리지 않습니다.
+    def read():
+        return gs.read_setup_column(gs.get_spreadsheet(sheet_url))
+
+    interval = float(st.secrets.get("config_poll_seconds", CONFIG_POLL_SECONDS))
+    return ConfigRefresher(read, gs.parse_setup_info, interval=interval, snapshot=snapshot)
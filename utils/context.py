@@ -0,0 +1,95 @@
+"""
+대화 기록 토큰 예산 관리
+최근 대화는 그대로 보내고, 오래된 대화는 누적 요약으로 접어서 보냅니다.
+"""
+from utils.scheduler import estimate_tokens
+
+DEFAULT_KEEP_TURNS = 6
+SUMMARY_HEADER = "[이전 대화 요약]"
+CONTINUE_HEADER = "[이어지는 대화]"
+
+
+class ConversationWindow:
+    """
+    세션 하나의 대화 기록 창(window)과 누적 요약을 관리합니다.
+
+    Parameters:
+    keep_turns (int): 요약으로 접을 때 그대로 남길 최근 대화 턴 수 (학생 + 챗봇 한 쌍이 한 턴)
+
+    - 메시지별 토큰 수는 새로 추가된 메시지만 계산해 캐시합니다.
+    - 예산을 넘으면 최근 keep_turns 턴만 남기고 나머지를 요약에 접습니다.
+    - 요약은 창이 움직일 때만 다시 만듭니다. 창은 예산을 다시 넘을 때까지 그대로 두므로
+      매 턴마다 요약을 새로 만들지 않습니다.
+    """
+
+    def __init__(self, keep_turns=DEFAULT_KEEP_TURNS):
+        self.keep_turns = keep_turns
+        self.summary = ""
+        self.summary_upto = 0
+        self.summary_updates = 0
+        self._counts = []
+
+    def estimate(self, messages):
+        """
+        요약을 새로 만들지 않고, 지금 상태로 보낼 때의 토큰 수를 추정합니다.
+        """
+        counts = self._update_counts(messages)
+        return estimate_tokens(self.summary) + sum(count for _, count in counts[self.summary_upto:])
+
+    def build(self, messages, budget, summarize):
+        """
+        API에 보낼 메시지 리스트를 만듭니다.
+
+        Parameters:
+        messages (list): 시스템 메시지를 뺀 전체 대화 기록
+        budget (int): 대화 기록에 쓸 토큰 예산. 0 이하이면 전체를 그대로 보냅니다.
+        summarize (callable): summarize(이전 요약, 접을 메시지 리스트) -> 새 요약 문자열.
+            실패하면 None을 반환하며, 이 경우 창을 움직이지 않습니다.
+
+        Returns:
+        list: 요약이 첫 학생 메시지 앞에 붙은 메시지 리스트 (원본 리스트는 바꾸지 않습니다)
+        """
+        if budget <= 0:
+            return messages
+
+        if self.summary_upto > len(messages):
+            self.summary_upto = 0
+            self.summary = ""
+
+        if self.estimate(messages) > budget:
+            boundary = self._boundary(messages)
+            if boundary > self.summary_upto:
+                summary = summarize(self.summary, messages[self.summary_upto:boundary])
+                if summary is not None:
+                    self.summary = summary
+                    self.summary_upto = boundary
+                    self.summary_updates += 1
+
+        if not self.summary:
+            return messages
+
+        first = messages[self.summary_upto]
+        head = {
+            "role": first["role"],
+            "content": f"{SUMMARY_HEADER}\n{self.summary}\n\n{CONTINUE_HEADER}\n{first['content']}",
+        }
+        return [head] + messages[self.summary_upto + 1:]
+
+    def _boundary(self, messages):
+        # 최근 keep_turns 턴을 남기되, 남기는 구간은 항상 학생(user) 메시지로 시작해야 합니다.
+        boundary = max(0, len(messages) - self.keep_turns * 2)
+        while boundary > 0 and messages[boundary]["role"] != "user":
+            boundary -= 1
+        return boundary
+
+    def _update_counts(self, messages):
+        # (내용, 토큰 수)를 보관하고, 같은 자리의 내용이 바뀐 경우(삭제 후 다시 입력)에만 다시 셉니다.
+        del self._counts[len(messages):]
+        for idx, message in enumerate(messages):
+            content = message["content"]
+            if idx < len(self._counts):
+                if self._counts[idx][0] is content:
+                    continue
+                del self._counts[idx:]
+            self._counts.append((content, estimate_tokens(content)))
+        return self._counts
@@ -0,0 +1,174 @@
+"""
+비동기 스트리밍 엔진
+프로세스 공용 이벤트 루프 스레드 하나에서 AsyncAnthropic으로 모든 세션의 스트리밍 응답을 받고,
+각 세션은 스레드 안전한 채널(queue.Queue)에서 이벤트를 꺼내 화면에 씁니다.
+"""
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+from utils.llm import MAX_CLIENTS, build_client, key_fingerprint
+
+_DONE = object()
+
+
+class StreamHandle:
+    """
+    엔진에 맡긴 스트리밍 응답 하나입니다. 동기 SDK의 Stream처럼 for 문으로 이벤트를 꺼냅니다.
+
+    - wait_started()는 응답이 시작될 때(HTTP 응답 헤더를 받을 때)까지 기다리고, 요청이 실패했으면 그 오류를 발생시킵니다.
+    - 스트리밍 도중 오류는 이벤트를 꺼내는 스레드에서 그대로 발생하므로, 호출하는 쪽의 재시도 코드를 그대로 씁니다.
+    - 끝까지 읽기 전에 반복을 멈추거나 close()를 호출하면 엔진 쪽 요청도 취소합니다.
+    """
+
+    def __init__(self):
+        self._channel = queue.Queue()
+        self._started = threading.Event()
+        self._error = None
+        self._future = None
+
+    def wait_started(self):
+        self._started.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self._future is not None and not self._future.done():
+            self._future.cancel()
+
+    def __iter__(self):
+        self.wait_started()
+        try:
+            while True:
+                item = self._channel.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def _start(self):
+        self._started.set()
+
+    def _fail(self, error):
+        self._error = error
+        self._started.set()
+
+
+class StreamEngine:
+    """
+    이벤트 루프 스레드 하나와 API 키별 AsyncAnthropic 클라이언트를 가진 프로세스 공용 스트리밍 엔진입니다.
+
+    - 소켓 읽기와 SSE 해석은 모두 루프 스레드에서 하므로, 동시에 스트리밍하는 학생 수만큼 스레드가 네트워크를 기다리지 않습니다.
+    - 클라이언트는 루프 스레드에서만 만들고 쓰므로 잠금이 필요 없습니다.
+    - 키가 MAX_CLIENTS개를 넘으면 가장 오래 쓰지 않은 클라이언트를 목록에서 빼고, 그 클라이언트의 스트림이 모두 끝난 뒤에 닫습니다.
+    - SDK 재시도는 끄고, 재시도는 호출하는 쪽(utils/retry.py 정책)이 합니다.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._clients = OrderedDict()
+        self._retiring = {}
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(("streams", "active", "failed", "cancelled"), 0)
+        self._thread = threading.Thread(target=self._run, name="stream-engine", daemon=True)
+        self._thread.start()
+
+    def stream(self, api_key, **params):
+        """
+        스트리밍 요청을 엔진에 맡기고 StreamHandle을 바로 반환합니다.
+
+        Parameters:
+        api_key (str): Anthropic API 키
+        params: messages.create()에 넘길 인자 (model, max_tokens, system, messages 등, stream 제외)
+        """
+        handle = StreamHandle()
+        handle._future = asyncio.run_coroutine_threadsafe(self._stream(handle, api_key, params), self._loop)
+        return handle
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 엔진 상태를 반환합니다. loop_lag_ms는 루프에 맡긴 작업이 실행되기까지 걸린 시간입니다.
+        """
+        started = time.perf_counter()
+        try:
+            asyncio.run_coroutine_threadsafe(asyncio.sleep(0), self._loop).result(timeout=1)
+            loop_lag_ms = round((time.perf_counter() - started) * 1000, 1)
+        except concurrent.futures.TimeoutError:
+            loop_lag_ms = None
+        with self._stats_lock:
+            return dict(self._stats, clients=len(self._clients), retiring_clients=len(self._retiring), loop_lag_ms=loop_lag_ms)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _acquire(self, api_key):
+        # 루프 스레드에서만 호출합니다. 반환한 항목은 스트림이 끝나면 _release()로 돌려줍니다.
+        fingerprint = key_fingerprint(api_key)
+        entry = self._clients.get(fingerprint) or self._retiring.pop(fingerprint, None)
+        if entry is None:
+            entry = {"fingerprint": fingerprint, "client": build_client(api_key, asynchronous=True), "active": 0}
+        self._clients[fingerprint] = entry
+        self._clients.move_to_end(fingerprint)
+        entry["active"] += 1
+
+        while len(self._clients) > MAX_CLIENTS:
+            _, evicted = self._clients.popitem(last=False)
+            if evicted["active"]:
+                self._retiring[evicted["fingerprint"]] = evicted
+            else:
+                self._loop.create_task(evicted["client"].close())
+        return entry
+
+    def _release(self, entry):
+        entry["active"] -= 1
+        if entry["active"] == 0 and self._retiring.get(entry["fingerprint"]) is entry:
+            del self._retiring[entry["fingerprint"]]
+            self._loop.create_task(entry["client"].close())
+
+    async def _stream(self, handle, api_key, params):
+        self._count("streams", 1)
+        self._count("active", 1)
+        entry = self._acquire(api_key)
+        try:
+            try:
+                stream = await entry["client"].messages.create(stream=True, **params)
+            except BaseException as e:
+                handle._fail(e)
+                raise
+
+            handle._start()
+            async with stream:
+                async for event in stream:
+                    handle._channel.put(event)
+        except asyncio.CancelledError:
+            self._count("cancelled", 1)
+            raise
+        except Exception as e:
+            self._count("failed", 1)
+            handle._channel.put(e)
+        finally:
+            handle._channel.put(_DONE)
+            self._release(entry)
+            self._count("active", -1)
+
+    def _count(self, name, value):
+        with self._stats_lock:
+            self._stats[name] += value
+
+
+@st.cache_resource
+def get_engine():
+    """
+    프로세스 공용 StreamEngine을 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 이벤트 루프를 사용합니다.
+    """
+    return StreamEngine()
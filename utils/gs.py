@@ -1,5 +1,14 @@
+import logging
 import streamlit as st
 import gspread
+import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from utils import log
+from utils.context import DEFAULT_KEEP_TURNS
+from utils.sheet_writer import get_sheet_writer, mask_personal_info
 from google.oauth2.service_account import Credentials
 from datetime import datetime
 from zoneinfo import ZoneInfo
@@ -45,7 +54,82 @@ def get_authorize():
     # gspread 클라이언트 생성
     return gspread.authorize(creds)
 
-@st.cache_data(ttl=300)
+# 워크시트 목록(제목 -> 워크시트) 캐시 유지 시간(초). 지나면 목록과 수업요약 다음 행을 다시 읽습니다.
+SHEET_INDEX_TTL = 300
+SUMMARY_SHEET = "수업요약"
+SETUP_SHEET = "정보"
+TEMPLATE_SHEET = "템플릿"
+
+# 대화 기록 시트 저장 방식: off(저장 안 함), on(그대로 저장), private(개인정보를 가리고 저장)
+TRANSCRIPT_MODES = ("off", "on", "private")
+
+@st.cache_resource
+def get_spreadsheet(url):
+    """
+    수업 스프레드시트 핸들을 URL별로 하나만 열어 모든 세션이 함께 사용합니다.
+
+    Parameters:
+        url (str): 수업할 시트의 URL ("정보" 시트 B1)
+
+    Returns:
+        gspread.Spreadsheet: 스프레드시트 객체
+
+    Note:
+    - open_by_url()은 메타데이터를 읽는 요청이므로, 학생마다 부르지 않고 @st.cache_resource로 캐싱합니다.
+    """
+    return get_authorize().open_by_url(url)
+
+@st.cache_resource
+def get_connect_executor():
+    """
+    학생 워크시트 연결(찾기/만들기)을 백그라운드에서 처리하는 프로세스 공용 스레드 풀입니다.
+    """
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="sheet-connect")
+
+def connect_worksheet(url, name):
+    """
+    수업 스프레드시트 열기와 학생 워크시트 연결을 백그라운드에서 시작합니다.
+
+    Parameters:
+        url (str): 수업할 시트의 URL ("정보" 시트 B1)
+        name (str): 학생 대화명
+
+    Returns:
+        concurrent.futures.Future: 결과가 gspread.Worksheet인 Future (스프레드시트는 worksheet.spreadsheet)
+    """
+    # 캐시 객체는 스크립트 스레드에서 미리 꺼내 두고, 작업 스레드에서는 API 요청만 합니다.
+    # 현재 컨텍스트를 복사해 넘기므로 작업 스레드의 로그에도 같은 세션 ID가 붙습니다.
+    provisioner = get_provisioner()
+    context = contextvars.copy_context()
+    return get_connect_executor().submit(context.run, open_worksheet, provisioner, url, name)
+
+def open_worksheet(provisioner, url, name):
+    """
+    수업 스프레드시트를 열고 학생 워크시트를 찾거나 만듭니다. (연결 스레드에서 실행)
+
+    open_by_url()도 메타데이터 요청이므로 스크립트 스레드를 막지 않도록 여기서 엽니다.
+    get_spreadsheet()가 URL별로 캐싱하므로 요청은 URL마다 한 번만 나갑니다.
+    """
+    return provisioner.get_or_create(get_spreadsheet(url), name)
+
+def get_session_sheet(timeout=None):
+    """
+    현재 세션의 학생 워크시트를 반환합니다. 백그라운드 연결이 아직 끝나지 않았으면 기다립니다.
+
+    Parameters:
+        timeout (float, optional): 기다릴 최대 시간(초). 없으면 끝날 때까지 기다립니다.
+
+    Returns:
+        gspread.Worksheet: 학생 워크시트
+
+    Note:
+    - 연결이 끝나면 st.session_state["sheet"]에 저장해 두고 다음부터는 바로 반환합니다.
+    - 연결 중 오류가 났으면 그 오류를 그대로 다시 발생시킵니다.
+    """
+    if "sheet" not in st.session_state:
+        st.session_state["sheet"] = st.session_state["sheet_future"].result(timeout)
+    return st.session_state["sheet"]
+
 def getSetupInfo():
     """
     Google Sheets에서 설정 정보를 가져오는 함수입니다.
@@ -64,12 +148,22 @@ def getSetupInfo():
             - a_p: 종합 평가 프롬프트
             - e_p: 평어 프롬프트
             - stream: 스트리밍 모드 사용 여부 (불리언)
+            - flush_ms: 스트리밍 응답 화면 갱신 간격 (밀리초, 정수)
+            - max_inflight: 프로세스 전체 동시 AI 요청 수 상한 (정수)
+            - tokens_per_minute: 프로세스 전체 분당 토큰 상한 (정수, 0이면 제한 없음)
+            - context_tokens: 한 번에 보낼 대화 기록 토큰 예산 (정수, 0이면 전체 전송)
+            - save_transcript: 대화 기록 시트 저장 방식 ("off", "on", "private")
+            - response_cache: 같은 요청의 답변 재사용 여부 ("off", "on", temperature가 0일 때만 사용)
+            - keep_turns: 대화 기록을 요약으로 접을 때 그대로 남길 최근 턴 수 (정수, 1 이상)
 
     Note:
     - 이 함수는 st.secrets["sheet_url"]에 저장된 URL의 Google Sheets에서 정보를 가져옵니다.
-    - "정보" 워크시트의 2번째 열에서 데이터를 읽어옵니다.
-    - 데이터는 0부터 11까지의 인덱스로 구성되며, 각 인덱스는 주석에 설명된 정보를 나타냅니다.
-    - @st.cache_data로 캐싱되어 5분(300초)마다 새로고침됩니다.
+    - "정보" 워크시트의 2번째 열에서 데이터를 읽어옵니다. (read_setup_column)
+    - 데이터는 0부터 18까지의 인덱스로 구성되며, 각 인덱스는 주석에 설명된 정보를 나타냅니다.
+    - 12번 이후의 행은 선택 항목으로, 비어 있으면 기본값을 사용합니다.
+    - 값이 잘못되어 있으면 ValueError가 발생합니다. (parse_setup_info)
+    - 이 함수는 캐싱하지 않습니다. 앱에서는 utils/config_refresher.py가 백그라운드에서
+      주기적으로 읽고, 바뀐 경우에만 새 설정으로 바꿉니다.
     0 수업할 시트
     1 서비스 여부
     2 생성형AI
@@ -82,48 +176,160 @@ def getSetupInfo():
     9 a_p
     10 e_p
     11 stream
+    12 flush_ms (선택, 기본값 50)
+    13 max_inflight (선택, 기본값 8)
+    14 tokens_per_minute (선택, 기본값 0)
+    15 context_tokens (선택, 기본값 0)
+    16 save_transcript (선택, 기본값 off)
+    17 response_cache (선택, 기본값 off)
+    18 keep_turns (선택, 기본값 6)
+    """
+
+    doc = get_spreadsheet(st.secrets["sheet_url"])
+    return parse_setup_info(read_setup_column(doc))
+
+def read_setup_column(doc):
+    """
+    "정보" 시트 B열 값을 요청 한 번으로 읽습니다.
+
+    Parameters:
+        doc (gspread.Spreadsheet): 설정 스프레드시트
+
+    Returns:
+        list: B열 값 리스트 (col_values(2)와 같이 뒤쪽 빈 셀은 빠집니다)
+
+    worksheet("정보")로 시트를 찾는 메타데이터 요청 없이 범위("'정보'!B:B")로 바로 읽습니다.
     """
+    response = doc.values_get(f"'{SETUP_SHEET}'!B:B", params={"majorDimension": "COLUMNS"})
+    values = response.get("values") or [[]]
+    return values[0]
+
+def parse_setup_info(data):
+    """
+    "정보" 시트 B열 값을 설정 딕셔너리로 바꾸고 검사합니다.
+
+    Parameters:
+        data (list): "정보" 시트 B열 값 리스트
 
-    gc = get_authorize()
-    ws = gc.open_by_url(st.secrets["sheet_url"]).worksheet("정보")
+    Returns:
+        dict: getSetupInfo()와 같은 설정 정보 딕셔너리
+
+    Raises:
+        ValueError: 필수 값이 비어 있거나 형식이 잘못된 경우 (문제 항목을 모두 메시지에 담습니다)
+    """
+    if len(data) < 12:
+        raise ValueError(f"정보 시트 B1~B12가 모두 있어야 합니다. (현재 {len(data)}행)")
+
+    errors = []
+
+    def required(index, name, cast=str):
+        value = str(data[index]).strip()
+        if value == "":
+            errors.append(f"B{index + 1} {name} 값이 비어 있습니다.")
+            return None
+        try:
+            return cast(value)
+        except ValueError:
+            errors.append(f"B{index + 1} {name} 값({value})을 읽을 수 없습니다.")
+            return None
 
-    # 정보 데이터 가져오기
-    data = ws.col_values(2)
     temp = {}
-    temp["url"] = data[0]
-    temp["serviceOnOff"] = data[1].lower()
+    temp["url"] = required(0, "url")
+    temp["serviceOnOff"] = required(1, "serviceOnOff", str.lower)
     temp["AI"] = data[2]
-    temp["key"] = data[3]
-    temp["model"] = data[4]
-    temp["max_tokens"] = int(data[5])
-    temp["temperature"] = float(data[6])
+    temp["key"] = required(3, "key")
+    temp["model"] = required(4, "model")
+    temp["max_tokens"] = required(5, "max_tokens", int)
+    temp["temperature"] = required(6, "temperature", float)
     temp["select"] = data[7]
-    temp["system"] = data[8]
+    temp["system"] = required(8, "system")
     temp["a_p"] = data[9]
     temp["e_p"] = data[10]
     temp["stream"] = True if data[11].lower() == 'true' else False
+    temp["flush_ms"] = get_optional_value(data, 12, int, 50)
+    temp["max_inflight"] = get_optional_value(data, 13, int, 8)
+    temp["tokens_per_minute"] = get_optional_value(data, 14, int, 0)
+    temp["context_tokens"] = get_optional_value(data, 15, int, 0)
+    temp["save_transcript"] = get_optional_value(data, 16, str.lower, "off")
+    if temp["save_transcript"] not in TRANSCRIPT_MODES:
+        temp["save_transcript"] = "off"
+    temp["response_cache"] = "on" if get_optional_value(data, 17, str.lower, "off") == "on" else "off"
+    temp["keep_turns"] = max(1, get_optional_value(data, 18, int, DEFAULT_KEEP_TURNS))
+
+    if temp["serviceOnOff"] not in (None, "on", "off"):
+        errors.append(f"B2 serviceOnOff 값은 on 또는 off여야 합니다. (현재 {temp['serviceOnOff']})")
+    if temp["max_tokens"] is not None and temp["max_tokens"] <= 0:
+        errors.append("B6 max_tokens 값은 1 이상이어야 합니다.")
+    if temp["temperature"] is not None and not 0 <= temp["temperature"] <= 1:
+        errors.append("B7 temperature 값은 0~1 사이여야 합니다.")
+    if errors:
+        raise ValueError(" ".join(errors))
 
     return temp
 
-def add_Content(role, content):
+def get_optional_value(data, index, cast, default):
     """
-    대화 내용을 Google Sheets에 추가하는 함수입니다.
+    "정보" 시트에서 선택 항목 값을 읽어 변환하는 함수입니다.
+
+    Parameters:
+        data (list): "정보" 시트 B열 값 리스트
+        index (int): 읽을 값의 인덱스
+        cast (callable): 값을 변환할 함수 (예: int, float)
+        default: 값이 없거나 변환할 수 없을 때 사용할 기본값
+
+    col_values()는 뒤쪽의 빈 셀을 돌려주지 않으므로, 새 행이 없는
+    기존 설정 시트에서도 동작하도록 기본값을 돌려줍니다.
+    """
+    if len(data) <= index or str(data[index]).strip() == "":
+        return default
+
+    try:
+        return cast(str(data[index]).strip())
+    except ValueError:
+        return default
+
+def add_Content(role, content, timestamp=None):
+    """
+    대화 내용을 Google Sheets 저장 큐에 추가하는 함수입니다.
 
     Parameters:
         role (str): 메시지 작성자의 역할. "user" 또는 "assistant" 중 하나여야 합니다.
         content (str): 추가할 메시지 내용
+        timestamp (str, optional): "HH:MM" 형식의 시각. 없으면 현재 시각을 사용합니다.
+
+    이 함수는 시각, 역할, 그리고 메시지 내용을 포함하는 새로운 행을
+    세션 상태에 저장된 Google Sheets 워크시트에 추가하도록 큐에 넣습니다.
 
-    이 함수는 현재 시간, 역할, 그리고 메시지 내용을 포함하는 새로운 행을
-    세션 상태에 저장된 Google Sheets 워크시트에 추가합니다.
+    Note:
+    - 실제 저장은 SheetWriter 스레드가 여러 세션의 행을 모아 batch_update로 처리하므로 채팅 턴을 막지 않습니다.
+    - 학생 시트 연결이 아직 끝나지 않았으면 기다리지 않고 연결 Future를 넘깁니다. 저장 스레드가 연결이 끝난 뒤 저장합니다.
+      (스프레드시트 열기도 연결 Future 안에서 하므로, 이때는 스프레드시트를 넘기지 않습니다.)
+    - "정보" 시트의 save_transcript가 "off"이면 저장하지 않고, "private"이면 이메일/전화번호/주민등록번호를 가리고 저장합니다.
     """
-    contents = [get_timestamp()]
+    mode = st.session_state["setupInfo"].get("save_transcript", "off")
+    if mode == "off":
+        return
+
+    if mode == "private":
+        content = mask_personal_info(content)
+
+    contents = [timestamp or get_timestamp()]
 
     if role == "user":
         contents += ["USER", content]
     elif role == "assistant":
         contents +=["ASSISTANT", content]
 
-    st.session_state["sheet"].append_row(contents)
+    sheet_future = st.session_state["sheet_future"]
+    if sheet_future.done():
+        try:
+            sheet = get_session_sheet()
+        except Exception as e:
+            log.event("시트 연결 실패", logging.ERROR, error_type = type(e).__name__, error = str(e))
+            return
+        get_sheet_writer().enqueue(sheet.spreadsheet, sheet.id, [contents])
+    else:
+        get_sheet_writer().enqueue(None, sheet_future, [contents])
 
 def get_timestamp():
     """
@@ -134,6 +340,387 @@ def get_timestamp():
     """
     return datetime.now(ZoneInfo("Asia/Seoul")).strftime("%H:%M")
 
+class _Flight:
+    """
+    진행 중인 작업(시트 생성, 워크시트 목록 읽기) 하나입니다. 같은 작업을 기다리는 세션들이 결과를 함께 받습니다.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class WorksheetIndex:
+    """
+    스프레드시트별 워크시트 목록과 "수업요약" 시트의 다음 빈 행 번호를 기억하는 캐시입니다.
+
+    Parameters:
+        ttl (int): 목록을 다시 읽기 전까지 유지할 시간(초)
+
+    - 목록은 스프레드시트 메타데이터를 한 번 읽어(doc.worksheets()) 제목 -> 워크시트 dict로 만듭니다.
+      학생이 로그인할 때마다 전체 탭을 다시 읽고 훑지 않습니다.
+    - 새 탭을 만들면 목록에 바로 추가하므로 다시 읽지 않아도 됩니다.
+    - 목록을 읽는 동안 같은 스프레드시트를 찾는 다른 세션은 새로 읽지 않고 그 결과를 기다립니다. (singleflight)
+    - "수업요약" 다음 행은 처음 한 번만 B열을 읽고, 그 뒤로는 하나씩 늘려 갑니다.
+    - 선생님이 시트를 직접 고친 경우에도 ttl이 지나면 목록과 다음 행을 다시 읽습니다.
+      다음 행은 max(기억해 둔 번호, B열 길이 + 1)로 이어 가므로, 이미 나눠 주었지만 아직 쓰지 않은 행을 다시 주지 않습니다.
+    """
+
+    def __init__(self, ttl=SHEET_INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._row_lock = threading.Lock()
+        self._entries = {}
+        self._loading = {}
+
+    def lookup(self, doc, title, refresh=False):
+        """
+        제목으로 워크시트를 찾습니다. 없으면 None을 반환합니다.
+
+        Parameters:
+            doc (gspread.Spreadsheet): 찾을 스프레드시트
+            title (str): 워크시트 제목
+            refresh (bool): True이면 ttl과 관계없이 목록을 다시 읽습니다.
+        """
+        entry = self._entry(doc, refresh)
+        return entry["sheets"].get(title)
+
+    def add(self, doc, worksheet):
+        """
+        새로 만든 워크시트를 목록에 추가합니다.
+        """
+        entry = self._entry(doc)
+        with self._lock:
+            entry["sheets"][worksheet.title] = worksheet
+
+    def sheet_ids(self, doc):
+        """
+        캐시된 워크시트 gid 집합을 반환합니다.
+        """
+        entry = self._entry(doc)
+        with self._lock:
+            return {sheet.id for sheet in entry["sheets"].values()}
+
+    def allocate_summary_rows(self, doc, names):
+        """
+        "수업요약" 시트에서 names를 적을 연속된 행을 받고, 기억해 둔 다음 행 번호를 그만큼 늘립니다.
+
+        Returns:
+            int: 받은 행 중 첫 번째 행 번호 (names[i]는 첫 번째 행 + i 행에 적습니다)
+
+        행 번호 할당은 _row_lock으로 한 번에 하나씩만 처리합니다.
+        처음 B열을 읽는 동안 다른 세션이 같은 행 번호를 받지 않도록, 읽기도 락 안에서 합니다.
+        받은 행은 이름 -> 행 번호 표에도 바로 기록합니다.
+        """
+        entry = self._entry(doc)
+        with self._row_lock:
+            if entry["next_row"] is None or entry["rows"] is None:
+                self._load_summary_rows(entry)
+
+            with self._lock:
+                row = entry["next_row"]
+                entry["next_row"] += len(names)
+                for offset, name in enumerate(names):
+                    entry["rows"][name] = row + offset
+                return row
+
+    def release_summary_rows(self, doc, first_row, names):
+        """
+        allocate_summary_rows()로 받았지만 쓰지 못한 행을 돌려줍니다. (시트 생성 요청이 실패한 경우)
+
+        그 뒤로 다른 세션이 행을 받지 않았을 때만 다음 행 번호를 되돌립니다. 이미 받았다면 빈 행으로 남깁니다.
+        """
+        entry = self._entry(doc)
+        with self._row_lock, self._lock:
+            for offset, name in enumerate(names):
+                if entry["rows"] is not None and entry["rows"].get(name) == first_row + offset:
+                    del entry["rows"][name]
+            if entry["next_row"] == first_row + len(names):
+                entry["next_row"] = first_row
+
+    def summary_row(self, doc, name):
+        """
+        "수업요약" 시트에서 name의 행 번호를 반환합니다. 없으면 None입니다.
+
+        이름 -> 행 번호 표는 B열을 한 번 읽어 만들고, 새로 받은 행은 allocate_summary_rows()가 기록합니다.
+        표에 없으면 선생님이 시트를 직접 고쳤을 수 있으므로 B열을 한 번 더 읽어 봅니다.
+        """
+        entry = self._entry(doc)
+        with self._row_lock:
+            if entry["rows"] is None:
+                self._load_summary_rows(entry)
+            row = entry["rows"].get(name)
+            if row is None:
+                self._load_summary_rows(entry)
+                row = entry["rows"].get(name)
+            return row
+
+    def summary_rows(self, doc, refresh=False):
+        """
+        "수업요약" 시트의 이름 -> 행 번호 표 복사본을 반환합니다.
+
+        Parameters:
+            refresh (bool): True이면 B열을 다시 읽습니다.
+        """
+        entry = self._entry(doc)
+        with self._row_lock:
+            if refresh or entry["rows"] is None:
+                self._load_summary_rows(entry)
+            with self._lock:
+                return dict(entry["rows"])
+
+    def _load_summary_rows(self, entry):
+        # _row_lock 안에서만 호출합니다. B열의 보이는 값(하이퍼링크 텍스트)이 학생 대화명입니다.
+        # 나눠 주었지만 아직 B열에 쓰이지 않은 행은 표에 남겨 둡니다.
+        names = entry["sheets"][SUMMARY_SHEET].col_values(2)
+        rows = {name: idx + 1 for idx, name in enumerate(names) if name}
+        with self._lock:
+            for name, row in (entry["rows"] or {}).items():
+                if row > len(names):
+                    rows.setdefault(name, row)
+            entry["rows"] = rows
+            entry["next_row"] = max(entry["next_row"] or 0, len(names) + 1)
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 스프레드시트별 탭 수와 캐시 경과 시간을 반환합니다.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                doc_id: {
+                    "sheets": len(entry["sheets"]),
+                    "age_seconds": round(now - entry["loaded_at"]),
+                    "next_summary_row": entry["next_row"],
+                }
+                for doc_id, entry in self._entries.items()
+            }
+
+    def _entry(self, doc, refresh=False):
+        with self._lock:
+            entry = self._entries.get(doc.id)
+            expired = entry is None or time.monotonic() - entry["loaded_at"] >= self.ttl
+            if not expired and not refresh:
+                return entry
+            flight = self._loading.get(doc.id)
+            lead = flight is None
+            if lead:
+                flight = self._loading[doc.id] = _Flight()
+
+        if not lead:
+            return flight.wait()
+
+        # 메타데이터 요청은 락 밖에서 합니다. (다른 스프레드시트 조회를 막지 않도록)
+        try:
+            sheets = {sheet.title: sheet for sheet in doc.worksheets()}
+            with self._lock:
+                entry = self._entries.get(doc.id)
+                if entry is None:
+                    entry = {"next_row": None, "rows": None}
+                    self._entries[doc.id] = entry
+                elif expired:
+                    # 이름 -> 행 번호 표는 다음에 쓸 때 B열을 다시 읽고, 다음 행 번호는 그대로 이어 갑니다.
+                    entry["rows"] = None
+                entry["sheets"] = sheets
+                entry["loaded_at"] = time.monotonic()
+            flight.result = entry
+            return entry
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(doc.id, None)
+            flight.done.set()
+
+@st.cache_resource
+def get_worksheet_index():
+    """
+    프로세스 공용 WorksheetIndex를 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 워크시트 목록을 사용합니다.
+    """
+    return WorksheetIndex()
+
+class SheetProvisioner:
+    """
+    학생 워크시트를 찾거나 만드는 프로세스 공용 서비스입니다.
+
+    Parameters:
+        index (WorksheetIndex): 워크시트 목록 캐시
+
+    - 같은 (스프레드시트, 이름)에 대한 동시 요청은 하나만 실제로 시트를 만들고, 나머지는 그 결과를 기다립니다. (singleflight)
+      수업 시작 때 30명이 동시에 로그인해도 같은 이름으로 duplicate_sheet를 두 번 부르지 않습니다.
+    - 이름이 다른 요청은 서로 기다리지 않고, "수업요약" 행 번호 할당만 WorksheetIndex에서 한 번에 하나씩 처리합니다.
+    - provision_roster()는 명단 전체의 시트 복사와 "수업요약" 링크를 batch_update 한 번으로 만듭니다.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = dict.fromkeys(("created", "joined", "roster_batches"), 0)
+
+    def get_or_create(self, doc, name):
+        """
+        이름에 해당하는 워크시트를 반환합니다. 없으면 '템플릿' 시트를 복사해 만듭니다.
+        """
+        sheet = self.index.lookup(doc, name)
+        if sheet is not None:
+            log.event("시트 찾음", sheet = name)
+            return sheet
+
+        lead, joined = self._join(doc, [name])
+        if lead:
+            self._run(lead, self._create_one, doc, name)
+        return (lead or joined)[name].wait()
+
+    def provision_roster(self, doc, names):
+        """
+        수업 전에 학생 명단의 워크시트를 한꺼번에 만듭니다.
+
+        Parameters:
+            doc (gspread.Spreadsheet): 수업 스프레드시트
+            names (list): 학생 대화명 리스트
+
+        Returns:
+            dict: created(새로 만든 이름 리스트), existing(이미 있던 이름 리스트)
+        """
+        names = list(dict.fromkeys(name.strip() for name in names if name.strip()))
+        self.index.lookup(doc, TEMPLATE_SHEET, refresh=True)
+        missing = [name for name in names if self.index.lookup(doc, name) is None]
+        existing = [name for name in names if name not in missing]
+
+        lead, joined = self._join(doc, missing)
+        if lead:
+            self._run(lead, self._create_many, doc, list(lead))
+        for flight in {**lead, **joined}.values():
+            flight.wait()
+
+        log.event("학생 시트 일괄 생성", created = len(lead), existing = len(existing))
+        return {"created": list(lead), "existing": existing}
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 시트 생성 상태를 반환합니다.
+        """
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
+
+    def _join(self, doc, names):
+        # 처음 요청한 이름은 직접 만들고(lead), 이미 만드는 중인 이름은 그 작업을 기다립니다(joined).
+        lead, joined = {}, {}
+        with self._lock:
+            for name in names:
+                key = (doc.id, name)
+                if key in self._flights:
+                    joined[name] = self._flights[key]
+                    self._stats["joined"] += 1
+                else:
+                    lead[name] = self._flights[key] = _Flight()
+        return lead, joined
+
+    def _run(self, flights, create, doc, *args):
+        try:
+            results = create(doc, *args)
+            for name, flight in flights.items():
+                flight.result = results[name]
+        except Exception as e:
+            for flight in flights.values():
+                flight.error = e
+            raise
+        finally:
+            with self._lock:
+                for name in flights:
+                    self._flights.pop((doc.id, name), None)
+            for flight in flights.values():
+                flight.done.set()
+
+    def _create_one(self, doc, name):
+        # 바로 앞의 작업이 막 만들었을 수 있으므로 캐시된 목록을 한 번 더 봅니다.
+        # 다른 앱 인스턴스가 만든 경우는 duplicate_sheet가 실패하므로 그때만 목록을 다시 읽습니다.
+        sheet = self.index.lookup(doc, name)
+        if sheet is not None:
+            log.event("시트 찾음", sheet = name)
+            return {name: sheet}
+
+        # 복사할 원본 시트 선택
+        source_worksheet = self.index.lookup(doc, TEMPLATE_SHEET)
+        # 새 시트 생성 (원본 시트 복사)
+        try:
+            new_worksheet = doc.duplicate_sheet(
+                source_worksheet.id, 
+                insert_sheet_index = 100, 
+                new_sheet_name = name
+            )
+        except gspread.exceptions.APIError:
+            # 같은 순간 다른 앱 인스턴스가 같은 이름으로 만든 경우
+            sheet = self.index.lookup(doc, name, refresh=True)
+            if sheet is None:
+                raise
+            return {name: sheet}
+        self.index.add(doc, new_worksheet)
+
+        add_Hyperlink(doc, new_worksheet.id, name)
+        log.event("시트 생성", sheet = name, sheet_id = new_worksheet.id)
+        self._count("created", 1)
+
+        return {name: new_worksheet}
+
+    def _create_many(self, doc, names):
+        template = self.index.lookup(doc, TEMPLATE_SHEET)
+        summary = self.index.lookup(doc, SUMMARY_SHEET)
+
+        used_ids = self.index.sheet_ids(doc)
+        sheet_ids = []
+        while len(sheet_ids) < len(names):
+            sheet_id = random.randint(1, 2**31 - 1)
+            if sheet_id not in used_ids:
+                used_ids.add(sheet_id)
+                sheet_ids.append(sheet_id)
+
+        first_row = self.index.allocate_summary_rows(doc, names)
+        requests = [
+            {
+                "duplicateSheet": {
+                    "sourceSheetId": template.id,
+                    "insertSheetIndex": 100,
+                    "newSheetId": sheet_id,
+                    "newSheetName": name,
+                }
+            }
+            for name, sheet_id in zip(names, sheet_ids)
+        ]
+        requests.append(summary_link_request(summary.id, first_row, zip(names, sheet_ids)))
+        try:
+            doc.batch_update({"requests": requests})
+        except Exception:
+            self.index.release_summary_rows(doc, first_row, names)
+            raise
+        self._count("created", len(names))
+        self._count("roster_batches", 1)
+
+        # 새 워크시트 객체는 목록을 한 번 다시 읽어서 받습니다.
+        self.index.lookup(doc, TEMPLATE_SHEET, refresh=True)
+        return {name: self.index.lookup(doc, name) for name in names}
+
+    def _count(self, name, value):
+        with self._lock:
+            self._stats[name] += value
+
+@st.cache_resource
+def get_provisioner():
+    """
+    프로세스 공용 SheetProvisioner를 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 진행 중 작업 목록을 봅니다.
+    """
+    return SheetProvisioner(get_worksheet_index())
+
 def get_worksheet(doc, name):
     """
     Google Sheets 문서에서 특정 이름의 워크시트를 찾거나 생성하는 함수입니다.
@@ -148,24 +735,12 @@ def get_worksheet(doc, name):
     이 함수는 먼저 주어진 이름의 워크시트를 찾습니다. 
     없으면 '템플릿' 시트를 복사하여 새 워크시트를 생성하고, 
     생성된 시트로의 하이퍼링크를 '수업요약' 시트에 추가합니다.
-    """
-    for sheet in doc.worksheets():
-        if sheet.title == name:
-            print("시트 찾음")
-            return sheet
-
-    # 복사할 원본 시트 선택
-    source_worksheet = doc.worksheet('템플릿')
-    # 새 시트 생성 (원본 시트 복사)
-    new_worksheet = doc.duplicate_sheet(
-        source_worksheet.id, 
-        insert_sheet_index = 100, 
-        new_sheet_name = name
-    )
-
-    add_Hyperlink(doc, new_worksheet.id, name)
 
-    return new_worksheet
+    Note:
+    - 워크시트 목록은 WorksheetIndex에 캐시되어 있으므로 로그인마다 전체 탭을 다시 읽지 않습니다.
+    - 시트 생성은 SheetProvisioner가 맡으므로, 같은 이름으로 동시에 로그인해도 시트는 하나만 만들어집니다.
+    """
+    return get_provisioner().get_or_create(doc, name)
 
 def add_Hyperlink(doc, id, nick_name):
     """
@@ -178,31 +753,74 @@ def add_Hyperlink(doc, id, nick_name):
 
     이 함수는 "수업요약" 시트의 A열 다음 빈 행에 하이퍼링크를 추가합니다.
     하이퍼링크는 같은 문서 내의 다른 시트로 연결됩니다.
+    다음 빈 행 번호는 WorksheetIndex가 기억하고 있으므로 B열 전체를 매번 읽지 않습니다.
+    체크박스(A열)와 링크(B열)는 batch_update 한 번으로 씁니다. 실패하면 받은 행 번호를 돌려줍니다.
     """
 
-    
-    sheet = doc.worksheet("수업요약")
-    next_row = len(sheet.col_values(2)) + 1
-    content = f'=HYPERLINK("#gid={id}", "{nick_name}")'
-    sheet.update("A" + str(next_row), [[False]])
-    sheet.update_acell("B" + str(next_row), content)
+    index = get_worksheet_index()
+    sheet = index.lookup(doc, SUMMARY_SHEET)
+    next_row = index.allocate_summary_rows(doc, [nick_name])
+    try:
+        doc.batch_update({"requests": [summary_link_request(sheet.id, next_row, [(nick_name, id)])]})
+    except Exception:
+        index.release_summary_rows(doc, next_row, [nick_name])
+        raise
 
-def delete_message():
+def summary_link_request(summary_id, first_row, links):
     """
-    대화 기록 중 마지막 대화를 삭제하는 함수입니다.
+    "수업요약" 시트의 first_row 행부터 체크박스(False)와 학생 시트 링크를 쓰는 updateCells 요청을 만듭니다.
 
-    이 함수는 다음과 같은 작업을 수행합니다:
-    1. 세션 상태에서 현재 활성화된 워크시트를 가져옵니다.
-    2. 워크시트의 첫 번째 열에서 데이터가 있는 마지막 행의 번호를 찾습니다.
-    3. 해당 행을 삭제합니다(마지막 대화 삭제).
+    Parameters:
+        summary_id (int): "수업요약" 시트의 gid
+        first_row (int): 첫 행 번호
+        links (iterable): (대화명, 학생 시트 gid) 목록
+
+    Returns:
+        dict: batch_update 요청 하나
     """
-    target = st.session_state["sheet"]
-    target_row = len(target.col_values(1))
-    target.delete_rows(target_row)
+    return {
+        "updateCells": {
+            "start": {"sheetId": summary_id, "rowIndex": first_row - 1, "columnIndex": 0},
+            "rows": [
+                {
+                    "values": [
+                        {"userEnteredValue": {"boolValue": False}},
+                        {"userEnteredValue": {"formulaValue": f'=HYPERLINK("#gid={sheet_id}", "{name}")'}},
+                    ]
+                }
+                for name, sheet_id in links
+            ],
+            "fields": "userEnteredValue",
+        }
+    }
+
+def write_evaluation(doc, nick_name, overall, comment):
+    """
+    "수업요약" 시트의 학생 행에 종합 평가(C열)와 평어(D열)를 한 번에 저장하는 함수입니다.
+
+    Parameters:
+        doc (gspread.Spreadsheet): 수업 스프레드시트
+        nick_name (str): 학생 대화명 ("수업요약" B열에 보이는 이름)
+        overall (str): 종합 평가
+        comment (str): 평어
+
+    Returns:
+        int: 저장한 행 번호. "수업요약"에서 학생을 찾지 못하면 None을 반환합니다.
+
+    행 번호는 WorksheetIndex의 이름 -> 행 번호 표에서 찾으므로 sheet.find()로 열 전체를 검색하지 않습니다.
+    """
+    index = get_worksheet_index()
+    row = index.summary_row(doc, nick_name)
+    if row is None:
+        return None
+
+    sheet = index.lookup(doc, SUMMARY_SHEET)
+    sheet.batch_update([{"range": f"C{row}:D{row}", "values": [[overall, comment]]}])
+    return row
 
 def get_summary_sheet(doc):
     """
     Returns:
         '수업요약' 시트를 리턴
     """
-    return doc.worksheet("수업요약")
\ No newline at end of file
+    return get_worksheet_index().lookup(doc, SUMMARY_SHEET)
\ No newline at end of file
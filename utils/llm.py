@@ -0,0 +1,355 @@
+"""
+Anthropic 클라이언트 공용 관리
+프로세스 전체에서 API 키별로 하나의 클라이언트(HTTP 연결 풀)를 공유합니다.
+"""
+import contextlib
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import anthropic
+import httpx
+import streamlit as st
+
+from utils.retry import DEFAULT_POLICY
+
+# 연결 풀 설정: 한 반(30명 안팎)이 동시에 스트리밍해도 새 TLS 연결을 만들지 않도록 여유 있게 둡니다.
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 32
+KEEPALIVE_EXPIRY = 120
+# 동시에 보관할 API 키별 클라이언트 수. 시트 키와 config.py의 Secrets 키처럼 여러 키가 번갈아 쓰여도
+# 자주 바꿔 만들지 않도록 넉넉히 두고, 넘치면 가장 오래 쓰지 않은 키의 클라이언트부터 요청이 끝나는 대로 닫습니다.
+MAX_CLIENTS = 4
+
+
+def key_fingerprint(api_key):
+    """
+    API 키를 로그/화면에 노출하지 않기 위한 짧은 지문을 반환합니다.
+    """
+    return hashlib.sha256(str(api_key).encode("utf-8")).hexdigest()[:12]
+
+
+def build_client(api_key, asynchronous=False):
+    """
+    연결 풀 설정(MAX_CONNECTIONS 등)을 적용한 Anthropic 클라이언트를 새로 만듭니다.
+
+    Parameters:
+    api_key (str): Anthropic API 키
+    asynchronous (bool): True이면 스트리밍 엔진(utils/engine.py)에서 쓸 AsyncAnthropic을 만듭니다.
+    """
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    # 재시도는 utils/retry.py 정책이 한 턴 마감 시간 안에서 직접 처리하므로 SDK 재시도는 끕니다.
+    if asynchronous:
+        return anthropic.AsyncAnthropic(
+            api_key=api_key, http_client=anthropic.DefaultAsyncHttpxClient(limits=limits), max_retries=0
+        )
+    return anthropic.Anthropic(api_key=api_key, http_client=anthropic.DefaultHttpxClient(limits=limits), max_retries=0)
+
+
+class ClientRegistry:
+    """
+    API 키별 Anthropic 클라이언트를 보관하는 프로세스 공용 저장소입니다.
+
+    Parameters:
+    max_clients (int): 보관할 클라이언트 수의 상한
+
+    - 키 지문별로 클라이언트를 하나씩 두므로, 두 키가 번갈아 쓰여도 서로의 클라이언트를 닫지 않습니다.
+    - 요청 하나 동안은 lease()로 클라이언트를 빌려 씁니다. 빌려 간 수(leases)는 요청이 끝나면 줄어듭니다.
+    - 상한을 넘으면 가장 오래 쓰지 않은 클라이언트를 목록에서 빼고, 빌려 간 요청이 모두 끝난 뒤에 닫습니다. (LRU)
+      그래서 다른 세션이 쓰는 중인 요청은 끊기지 않습니다.
+    """
+
+    def __init__(self, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._retiring = {}
+
+    def get(self, api_key):
+        """
+        주어진 API 키의 공용 클라이언트를 반환합니다. 없으면 새로 만듭니다.
+        빌려 간 수에 넣지 않으므로, 요청을 보낼 때는 lease()를 씁니다.
+        """
+        with self._lock:
+            return self._entry(api_key)["client"]
+
+    @contextlib.contextmanager
+    def lease(self, api_key):
+        """
+        요청 하나 동안 API 키의 공용 클라이언트를 빌려 주는 컨텍스트 매니저입니다.
+        빌려 간 동안에는 상한을 넘어 목록에서 빠지더라도 닫지 않습니다.
+        """
+        with self._lock:
+            entry = self._entry(api_key)
+            entry["leases"] += 1
+        try:
+            yield entry["client"]
+        finally:
+            with self._lock:
+                entry["leases"] -= 1
+                retired = entry["leases"] == 0 and self._retiring.pop(entry["fingerprint"], None) is entry
+            if retired:
+                entry["client"].close()
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 연결 풀 상태를 키별로, 가장 최근에 쓴 키부터 반환합니다.
+        목록에서 빠졌지만 요청이 끝나기를 기다리는 클라이언트는 retiring으로 표시합니다.
+        """
+        with self._lock:
+            entries = [(entry, False) for entry in reversed(self._entries.values())]
+            entries += [(entry, True) for entry in self._retiring.values()]
+            return [self._entry_stats(entry, retiring) for entry, retiring in entries]
+
+    def _entry(self, api_key):
+        # self._lock 안에서만 호출합니다.
+        fingerprint = key_fingerprint(api_key)
+        entry = self._entries.get(fingerprint) or self._retiring.pop(fingerprint, None)
+        if entry is None:
+            entry = {
+                "fingerprint": fingerprint,
+                "client": build_client(api_key),
+                "created_at": time.time(),
+                "lookups": 0,
+                "leases": 0,
+            }
+        self._entries[fingerprint] = entry
+        self._entries.move_to_end(fingerprint)
+        entry["lookups"] += 1
+
+        while len(self._entries) > self.max_clients:
+            _, evicted = self._entries.popitem(last=False)
+            if evicted["leases"]:
+                self._retiring[evicted["fingerprint"]] = evicted
+            else:
+                evicted["client"].close()
+        return entry
+
+    @staticmethod
+    def _entry_stats(entry, retiring):
+        stats = {
+            "key": entry["fingerprint"],
+            "age_seconds": round(time.time() - entry["created_at"]),
+            "lookups": entry["lookups"],
+            "leases": entry["leases"],
+            "retiring": retiring,
+            "max_connections": MAX_CONNECTIONS,
+            "max_keepalive_connections": MAX_KEEPALIVE_CONNECTIONS,
+        }
+
+        # httpx는 연결 풀 상태를 공개 API로 제공하지 않으므로, 내부 구조가 바뀌었으면 이 항목만 빼고 보여 줍니다.
+        try:
+            connections = entry["client"]._client._transport._pool.connections
+            stats["open_connections"] = len(connections)
+            stats["idle_connections"] = sum(1 for conn in connections if conn.is_idle())
+        except Exception:
+            pass
+
+        return stats
+
+
+def cache_breakpoint(message):
+    """
+    메시지 하나를 cache_control이 붙은 블록 형식으로 바꾼 복사본을 반환합니다.
+    원본(세션의 대화 기록)은 바꾸지 않습니다.
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [dict(block) for block in content]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return {"role": message["role"], "content": blocks}
+
+
+def build_cached_request(system, messages, mark_messages=True):
+    """
+    프롬프트 캐시 중단점(breakpoint)을 표시한 system, messages를 만듭니다.
+
+    Parameters:
+    system (str): 시스템 프롬프트 ("정보" 시트 B9)
+    messages (list): 보낼 대화 기록
+    mark_messages (bool): False이면 시스템 프롬프트에만 표시합니다. (다시 읽지 않을 메시지를 캐시에 쓰지 않도록)
+
+    Returns:
+    tuple: (system 블록 리스트, messages 리스트)
+
+    중단점은 최대 3개입니다.
+    1. 시스템 프롬프트: 모든 학생, 모든 턴이 공유하는 가장 긴 접두어입니다.
+    2. 마지막 메시지: 이번 요청까지의 대화를 캐시에 씁니다.
+    3. 직전 학생 메시지: 지난 턴에 써 둔 캐시를 이번 턴에 읽을 수 있게 합니다.
+    """
+    system_blocks = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+    if not messages or not mark_messages:
+        return system_blocks, messages
+
+    marked = [len(messages) - 1]
+    for idx in range(len(messages) - 2, -1, -1):
+        if messages[idx]["role"] == "user":
+            marked.append(idx)
+            break
+
+    request_messages = list(messages)
+    for idx in marked:
+        request_messages[idx] = cache_breakpoint(messages[idx])
+    return system_blocks, request_messages
+
+
+class UsageStats:
+    """
+    수업(설정 시트의 url)별 토큰 사용량과 프롬프트 캐시 적중 현황을 모읍니다.
+    """
+
+    FIELDS = ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens", "output_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classrooms = {}
+
+    def record(self, classroom, usage):
+        """
+        응답 한 건의 usage(dict)를 더합니다.
+        """
+        with self._lock:
+            totals = self._classrooms.setdefault(classroom, dict.fromkeys(self.FIELDS + ("requests",), 0))
+            totals["requests"] += 1
+            for field in self.FIELDS:
+                totals[field] += usage.get(field) or 0
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 수업별 집계와 캐시 적중률을 반환합니다.
+        """
+        with self._lock:
+            result = {}
+            for classroom, totals in self._classrooms.items():
+                prompt_tokens = (
+                    totals["input_tokens"]
+                    + totals["cache_read_input_tokens"]
+                    + totals["cache_creation_input_tokens"]
+                )
+                result[classroom] = dict(
+                    totals,
+                    cache_hit_rate=round(totals["cache_read_input_tokens"] / prompt_tokens, 3) if prompt_tokens else None,
+                )
+            return result
+
+
+def usage_to_dict(usage):
+    """
+    SDK의 Usage 객체에서 집계할 필드만 dict로 꺼냅니다.
+    """
+    return {field: getattr(usage, field, None) or 0 for field in UsageStats.FIELDS}
+
+
+def complete(client, setupInfo, messages, max_tokens=None, retry_state=None, cache_messages=True):
+    """
+    스트리밍 없이 응답 하나를 받아 (텍스트, usage dict, stop_reason)을 반환합니다.
+
+    Parameters:
+    client (anthropic.Anthropic): AI 클라이언트
+    setupInfo (dict): 설정 정보 (system, model, max_tokens, temperature 사용)
+    messages (list): 보낼 대화 기록
+    max_tokens (int, optional): 없으면 setupInfo["max_tokens"]를 사용합니다.
+    retry_state (utils.retry.RetryState, optional): 없으면 DEFAULT_POLICY로 새로 만듭니다.
+    cache_messages (bool): False이면 대화 기록에는 캐시 중단점을 표시하지 않습니다.
+
+    시스템 프롬프트와 대화 기록에는 프롬프트 캐시 중단점을 표시합니다.
+    재시도할 수 있는 오류는 retry_state에 따라 기다렸다가 다시 보내고, 더 시도할 수 없으면 마지막 오류를 그대로 발생시킵니다.
+    화면과 st.session_state를 쓰지 않으므로 작업 스레드나 배치 작업에서도 쓸 수 있습니다.
+    stop_reason이 "end_turn"이 아니면(예: max_tokens) 답변이 중간에 잘린 것이므로, 응답 캐시에 넣지 않습니다.
+    """
+    system, request_messages = build_cached_request(setupInfo["system"], messages, cache_messages)
+    retry_state = retry_state or DEFAULT_POLICY.start()
+
+    while True:
+        try:
+            response = client.messages.create(
+                model=setupInfo["model"],
+                max_tokens=max_tokens or setupInfo["max_tokens"],
+                temperature=setupInfo["temperature"],
+                system=system,
+                messages=request_messages,
+            )
+            break
+        except Exception as e:
+            delay = retry_state.next_delay(e)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+    text = "".join(block.text for block in response.content if block.type == "text").strip()
+    return text, usage_to_dict(response.usage), response.stop_reason
+
+
+class MessageStream:
+    """
+    스트리밍하지 않은 응답(Message)을 스트리밍 응답처럼 이벤트로 돌려주는 반복자입니다.
+    B12 stream이 false일 때도 message_processing()이 API 스트림과 똑같이 읽어 usage와 stop_reason을 집계합니다.
+    """
+
+    def __init__(self, message):
+        self.message = message
+
+    def __iter__(self):
+        yield SimpleNamespace(type="message_start", message=self.message)
+        for block in self.message.content:
+            if block.type == "text":
+                yield SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=block.text))
+        yield SimpleNamespace(
+            type="message_delta",
+            delta=SimpleNamespace(stop_reason=self.message.stop_reason, stop_sequence=self.message.stop_sequence),
+            usage=SimpleNamespace(output_tokens=self.message.usage.output_tokens),
+        )
+        yield SimpleNamespace(type="message_stop")
+
+    def close(self):
+        pass
+
+
+@st.cache_resource
+def get_usage_stats():
+    """
+    프로세스 공용 UsageStats를 반환합니다.
+    """
+    return UsageStats()
+
+
+@st.cache_resource
+def get_registry():
+    """
+    프로세스 공용 ClientRegistry를 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 객체를 사용합니다.
+    """
+    return ClientRegistry()
+
+
+def get_client(api_key):
+    """
+    API 키에 해당하는 공용 Anthropic 클라이언트를 반환합니다.
+
+    Parameters:
+    api_key (str): Anthropic API 키 ("정보" 시트 B4)
+
+    Returns:
+    anthropic.Anthropic: 프로세스 전체에서 공유되는 클라이언트
+    """
+    return get_registry().get(api_key)
+
+
+def lease_client(api_key):
+    """
+    요청 하나 동안 API 키의 공용 Anthropic 클라이언트를 빌려 주는 컨텍스트 매니저를 반환합니다.
+
+    Parameters:
+    api_key (str): Anthropic API 키 ("정보" 시트 B4)
+
+    빌려 간 동안에는 다른 키가 많이 쓰여 목록에서 빠지더라도 클라이언트를 닫지 않습니다. (ClientRegistry.lease)
+    """
+    return get_registry().lease(api_key)
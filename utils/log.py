@@ -0,0 +1,150 @@
+"""
+구조화 로그
+JSON 한 줄 형식으로 세션 ID와 이벤트 필드를 함께 남기고, 큐를 거쳐 별도 스레드에서 출력합니다.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+LOGGER_NAME = "idebate"
+REPEAT_INTERVAL = 30
+REPEAT_MAX_KEYS = 512
+
+_session_id = contextvars.ContextVar("idebate_session_id", default=None)
+_setup_lock = threading.Lock()
+_listener = None
+
+
+def new_session_id():
+    """
+    세션 구분용 짧은 ID를 만듭니다.
+    """
+    return uuid.uuid4().hex[:12]
+
+
+def bind_session(session_id):
+    """
+    현재 스레드(스크립트 실행)의 로그에 붙을 세션 ID를 지정합니다.
+    """
+    _session_id.set(session_id)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    로그 레코드를 JSON 한 줄로 바꿉니다.
+    """
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+            "session": getattr(record, "session_id", None),
+        }
+        data.update(getattr(record, "fields", None) or {})
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """
+    세션 ID가 지정되지 않은 레코드에 현재 스레드의 세션 ID를 붙입니다.
+    """
+
+    def filter(self, record):
+        if getattr(record, "session_id", None) is None:
+            record.session_id = _session_id.get()
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """
+    같은 경고/오류가 반복되면 interval초에 한 번만 내보내고, 그 사이 건수는 다음 로그의 suppressed 필드로 남깁니다.
+    키는 (이벤트, error_type)이므로 오류 메시지가 매번 달라도 같은 종류의 오류로 묶입니다.
+    """
+
+    def __init__(self, interval=REPEAT_INTERVAL, max_keys=REPEAT_MAX_KEYS):
+        super().__init__()
+        self.interval = interval
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        fields = getattr(record, "fields", None) or {}
+        key = (record.name, record.msg, fields.get("error_type"))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] += 1
+                return False
+
+            suppressed = entry[1] if entry is not None else 0
+            self._seen[key] = [now, 0]
+            self._seen.move_to_end(key)
+            while len(self._seen) > self.max_keys:
+                self._seen.popitem(last=False)
+
+        if suppressed:
+            record.fields = dict(fields, suppressed=suppressed)
+        return True
+
+
+def setup():
+    """
+    idebate 로거에 큐 핸들러를 한 번만 연결합니다.
+    로그 호출은 큐에 넣기만 하고, 실제 출력(stderr)은 QueueListener 스레드가 합니다.
+    """
+    global _listener
+
+    logger = logging.getLogger(LOGGER_NAME)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(ContextFilter())
+        queue_handler.addFilter(RepeatFilter())
+
+        stream_handler = logging.StreamHandler(sys.stderr)
+        stream_handler.setFormatter(JsonFormatter())
+
+        logger.addHandler(queue_handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return logger
+
+
+def event(name, level=logging.INFO, session_id=None, **fields):
+    """
+    구조화 로그 한 건을 남깁니다.
+
+    Parameters:
+    name (str): 고정된 이벤트 이름 (예: "API 오류 발생"). 바뀌는 값은 fields로 넘깁니다.
+    level (int): logging 레벨
+    session_id (str, optional): 세션 ID. 없으면 bind_session()으로 지정한 값을 사용합니다.
+    **fields: 함께 남길 필드 (예: turn, model, latency_ms, error_type, error)
+    """
+    extra = {"fields": fields}
+    if session_id is not None:
+        extra["session_id"] = session_id
+    setup().log(level, name, extra=extra)
@@ -0,0 +1,131 @@
+"""
+응답 지연 시간 측정
+한 턴을 단계별(대기열, 첫 토큰, 생성, 화면 출력)로 나누어 재고, 모델별 최근 p50/p95/p99를 모읍니다.
+"""
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import streamlit as st
+
+WINDOW_SIZE = 500
+PERCENTILES = (50, 95, 99)
+METRICS = ("queue_ms", "server_ms", "ttft_ms", "generation_ms", "render_ms", "total_ms", "tokens_per_second")
+
+# 여러 서버(또는 프로세스)에서 앱을 돌릴 때 어느 인스턴스의 수치인지 구분합니다.
+INSTANCE = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TurnTimer:
+    """
+    한 턴의 단계별 시각을 time.perf_counter()로 기록합니다.
+
+    기록하는 시점:
+    - started: 학생 입력을 받아 턴을 시작한 시각 (만들 때 자동 기록)
+    - admitted: 대기열에서 차례를 받은 시각
+    - dispatched: 첫 API 요청을 보낸 시각
+    - message_start: 첫 message_start 이벤트를 받은 시각
+    - first_token / last_token: 첫/마지막 텍스트 델타를 받은 시각
+    - done: 화면 출력까지 끝난 시각
+
+    같은 시점을 여러 번 기록하면 처음 값만 남습니다. (이어받기 재요청이 있어도 학생이 느낀 시간을 잽니다.)
+    """
+
+    def __init__(self):
+        self.marks = {"started": time.perf_counter()}
+        self.render_seconds = 0.0
+        self.flushes = 0
+
+    def mark(self, name):
+        self.marks.setdefault(name, time.perf_counter())
+
+    def token(self):
+        """
+        텍스트 델타를 받을 때마다 호출합니다.
+        """
+        now = time.perf_counter()
+        self.marks.setdefault("first_token", now)
+        self.marks["last_token"] = now
+
+    def summary(self, output_tokens=0):
+        """
+        단계별 소요 시간(ms)과 초당 출력 토큰 수를 반환합니다. 기록되지 않은 단계는 None입니다.
+        """
+        def between(start, end):
+            if start in self.marks and end in self.marks:
+                return round((self.marks[end] - self.marks[start]) * 1000, 1)
+            return None
+
+        generation_ms = between("first_token", "last_token")
+        return {
+            "queue_ms": between("started", "admitted"),
+            "server_ms": between("dispatched", "message_start"),
+            "ttft_ms": between("dispatched", "first_token"),
+            "generation_ms": generation_ms,
+            "render_ms": round(self.render_seconds * 1000, 1),
+            "flushes": self.flushes,
+            "total_ms": between("started", "done"),
+            "tokens_per_second": round(output_tokens * 1000 / generation_ms, 1) if output_tokens and generation_ms else None,
+        }
+
+
+class LatencyStats:
+    """
+    모델별로 최근 WINDOW_SIZE개 턴의 지연 시간을 보관하고 백분위수를 계산합니다.
+
+    Parameters:
+    window_size (int): 모델별로 보관할 최근 턴 수
+    """
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.window_size = window_size
+        self._lock = threading.Lock()
+        self._models = {}
+
+    def record(self, model, summary):
+        """
+        TurnTimer.summary() 결과 한 건을 더합니다.
+        """
+        with self._lock:
+            samples = self._models.get(model)
+            if samples is None:
+                samples = self._models[model] = {metric: deque(maxlen=self.window_size) for metric in METRICS}
+            for metric in METRICS:
+                if summary.get(metric) is not None:
+                    samples[metric].append(summary[metric])
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 모델별 p50/p95/p99를 반환합니다.
+        """
+        with self._lock:
+            snapshot = {model: {metric: sorted(values) for metric, values in samples.items()} for model, samples in self._models.items()}
+
+        models = {}
+        for model, samples in snapshot.items():
+            models[model] = {
+                metric: dict({f"p{p}": percentile(values, p) for p in PERCENTILES}, count=len(values))
+                for metric, values in samples.items()
+                if values
+            }
+        return {"instance": INSTANCE, "models": models}
+
+
+def percentile(sorted_values, p):
+    """
+    정렬된 리스트의 p 백분위수(nearest-rank)를 반환합니다.
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+@st.cache_resource
+def get_latency_stats():
+    """
+    프로세스 공용 LatencyStats를 반환합니다.
+    """
+    return LatencyStats()
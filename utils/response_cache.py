@@ -0,0 +1,176 @@
+"""
+같은 요청의 답변 재사용 (응답 캐시)
+수업 시작 때 여러 학생이 같은 시스템 프롬프트에 거의 같은 첫 질문을 보내면, 앞서 받은 답변을 API 요청 없이 다시 보여 줍니다.
+"정보" 시트 B18 response_cache가 on이고 temperature(B7)가 0일 때만 사용합니다.
+"""
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import streamlit as st
+
+DEFAULT_TTL = 30 * 60  # 한 차시 수업 동안
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+ENTRY_OVERHEAD = 200  # 키와 항목 하나의 대략적인 메모리 (바이트)
+REPLAY_PIECE = re.compile(r"\S+\s*|\s+")
+
+
+def normalize_text(text):
+    """
+    유니코드 정규화(NFC)하고, 앞뒤 공백을 지우고, 연속된 공백을 하나로 줄입니다.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def content_text(content):
+    """
+    메시지 content(문자열 또는 블록 리스트)에서 글자만 꺼냅니다. (캐시 중단점 같은 표시는 빼고)
+    """
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+
+def request_key(setupInfo, messages):
+    """
+    (모델, temperature, 시스템 프롬프트, 정규화한 대화 기록)의 sha256을 반환합니다.
+    """
+    payload = [
+        setupInfo["model"],
+        setupInfo["temperature"],
+        setupInfo["system"],
+        [[message["role"], normalize_text(content_text(message["content"]))] for message in messages],
+    ]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    요청 키 -> 답변 문자열을 보관하는 프로세스 공용 LRU 캐시입니다.
+
+    Parameters:
+    ttl (float): 답변을 재사용할 시간(초). 지나면 다음 조회 때 지웁니다.
+    max_bytes (int): 보관할 답변 크기 합의 상한. 넘으면 가장 오래 쓰지 않은 답변부터 지웁니다.
+
+    - get()/put()은 설정이 캐시를 허용하지 않으면(is_enabled) 아무것도 하지 않으므로, 호출하는 쪽에서 따로 검사하지 않아도 됩니다.
+    - 끝까지 받은 답변만 넣습니다. (중간에 끊긴 답변은 호출하는 쪽에서 넣지 않습니다)
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stats = dict.fromkeys(("hits", "misses", "stores", "evictions", "expired"), 0)
+
+    @staticmethod
+    def is_enabled(setupInfo):
+        """
+        B18 response_cache가 on이고 temperature가 0이면 True입니다. temperature가 0보다 크면 같은 질문에도 답이 달라야 하므로 쓰지 않습니다.
+        """
+        return setupInfo.get("response_cache") == "on" and setupInfo.get("temperature") == 0
+
+    def get(self, setupInfo, messages, count_miss=True):
+        """
+        같은 요청으로 받아 둔 답변을 반환합니다. 없거나, 유효 시간이 지났거나, 캐시를 쓰지 않는 설정이면 None입니다.
+        같은 요청을 나중에 한 번 더 확인할 것이면 count_miss=False로 불러 실패 횟수를 두 번 세지 않습니다.
+        """
+        if not self.is_enabled(setupInfo):
+            return None
+
+        key = request_key(setupInfo, messages)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry["stored_at"] > self.ttl:
+                self._remove(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += count_miss
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry["text"]
+
+    def put(self, setupInfo, messages, text):
+        """
+        끝까지 받은 답변을 넣습니다. 캐시를 쓰지 않는 설정이거나, 답변이 비었거나, 혼자서 용량을 넘으면 넣지 않습니다.
+        """
+        if not text or not self.is_enabled(setupInfo):
+            return
+
+        key = request_key(setupInfo, messages)
+        size = len(text.encode("utf-8")) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self._bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+            self._entries[key] = {"text": text, "stored_at": time.monotonic(), "size": size}
+            self._bytes += size
+            self._stats["stores"] += 1
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 적중/실패 횟수, 적중률, 보관 중인 답변 수와 크기를 반환합니다.
+        """
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_rate=round(self._stats["hits"] / lookups, 3) if lookups else None,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)["size"]
+
+
+class ReplayStream:
+    """
+    캐시된 답변을 스트리밍 응답처럼 이벤트로 돌려주는 반복자입니다.
+    message_processing()이 API 스트림과 똑같이 읽어 같은 화면 경로로 그리며, usage는 모두 0입니다.
+    """
+
+    cached = True
+
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        yield SimpleNamespace(type="message_start", message=SimpleNamespace(usage=None))
+        for piece in REPLAY_PIECE.findall(self.text):
+            yield SimpleNamespace(type="content_block_delta", delta=SimpleNamespace(type="text_delta", text=piece))
+        yield SimpleNamespace(
+            type="message_delta",
+            delta=SimpleNamespace(stop_reason="end_turn", stop_sequence=None),
+            usage=SimpleNamespace(output_tokens=0),
+        )
+        yield SimpleNamespace(type="message_stop")
+
+    def close(self):
+        pass
+
+
+@st.cache_resource
+def get_response_cache():
+    """
+    프로세스 공용 ResponseCache를 반환합니다.
+    Secrets의 response_cache_ttl(초), response_cache_max_bytes로 기본값을 바꿀 수 있습니다.
+    """
+    return ResponseCache(
+        ttl=float(st.secrets.get("response_cache_ttl", DEFAULT_TTL)),
+        max_bytes=int(st.secrets.get("response_cache_max_bytes", DEFAULT_MAX_BYTES)),
+    )
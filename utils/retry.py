@@ -0,0 +1,125 @@
+"""
+AI 요청 재시도 정책
+지수 백오프 + 지터, retry-after 헤더, 한 턴 전체 마감 시간을 적용합니다.
+"""
+import email.utils
+import random
+import time
+
+import httpx
+from anthropic import APIConnectionError, APIError, APIStatusError, APITimeoutError
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+# 스트리밍 도중 error 이벤트로 오는 오류는 HTTP 상태가 200이므로 오류 종류로 판단합니다.
+RETRYABLE_ERROR_TYPES = {"overloaded_error", "api_error", "rate_limit_error"}
+
+# 스트리밍 도중 발생할 수 있는 통신 오류 (SDK 오류 + 끊긴 HTTP 연결)
+STREAM_ERRORS = (APIError, httpx.TransportError)
+
+
+def is_retryable(error):
+    """
+    다시 시도해 볼 만한 오류인지 판단합니다.
+    타임아웃, 연결 오류, 429(사용량 제한), 5xx/529(과부하)와 스트리밍 중 끊긴 연결, 스트리밍 중 받은 과부하 오류 이벤트가 해당됩니다.
+    """
+    if isinstance(error, (APITimeoutError, APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, APIStatusError):
+        if error.status_code in RETRYABLE_STATUS or error.status_code >= 500:
+            return True
+        body = error.body if isinstance(error.body, dict) else {}
+        return (body.get("error") or {}).get("type") in RETRYABLE_ERROR_TYPES
+    return False
+
+
+def retry_after_seconds(error):
+    """
+    오류 응답의 retry-after-ms / retry-after 헤더를 초 단위로 반환합니다. 없으면 None입니다.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    # HTTP 날짜 형식. Python 3.10부터 잘못된 값이면 None 대신 ValueError를 냅니다. (3.9 이하는 TypeError 또는 None)
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed is None:
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """
+    재시도 정책 설정값입니다.
+
+    Parameters:
+    max_attempts (int): 첫 시도를 포함한 최대 시도 횟수
+    base_delay (float): 첫 재시도 대기 시간의 상한(초). 이후 두 배씩 늘어납니다.
+    max_delay (float): 한 번의 대기 시간 상한(초)
+    deadline (float): 한 턴(요청 + 스트리밍 + 이어받기) 전체의 마감 시간(초)
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=20.0, deadline=90.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def start(self):
+        """
+        한 턴 동안 공유할 RetryState를 새로 만듭니다.
+        """
+        return RetryState(self)
+
+
+class RetryState:
+    """
+    한 턴의 재시도 횟수와 마감 시간을 추적합니다.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.attempt = 0
+        self.deadline = time.monotonic() + policy.deadline
+
+    def next_delay(self, error):
+        """
+        error 이후 얼마나 기다렸다가 다시 시도할지 반환합니다.
+        더 시도하면 안 되는 경우(재시도 불가 오류, 횟수 초과, 마감 초과)에는 None을 반환합니다.
+        """
+        if not is_retryable(error):
+            return None
+
+        self.attempt += 1
+        if self.attempt >= self.policy.max_attempts:
+            return None
+
+        # full jitter: 0 ~ min(max_delay, base * 2^n) 사이에서 무작위로 고릅니다.
+        delay = random.uniform(0, min(self.policy.max_delay, self.policy.base_delay * 2 ** (self.attempt - 1)))
+        server_delay = retry_after_seconds(error)
+        if server_delay is not None:
+            delay = server_delay + random.uniform(0, self.policy.base_delay / 2)
+
+        if time.monotonic() + delay >= self.deadline:
+            return None
+        return delay
+
+
+DEFAULT_POLICY = RetryPolicy()
@@ -0,0 +1,230 @@
+"""
+LLM 호출 입장 제어(admission control)
+프로세스 전체에서 동시에 진행되는 요청 수와 분당 토큰 수를 제한하고,
+넘치는 요청은 사용자별로 공평하게(round-robin) 줄을 세웁니다.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import streamlit as st
+
+DEFAULT_MAX_INFLIGHT = 8
+DEFAULT_TOKENS_PER_MINUTE = 0  # 0이면 분당 토큰 제한 없음
+DEFAULT_MAX_WAIT = 180
+WINDOW_SECONDS = 60
+POLL_SECONDS = 0.5
+
+
+class QueueTimeoutError(TimeoutError):
+    """
+    대기열에서 max_wait 초 안에 차례가 오지 않았을 때 발생합니다.
+    """
+
+
+def estimate_tokens(text):
+    """
+    글자 수로 토큰 수를 대략 추정합니다.
+    한국어는 대략 1~2글자가 1토큰이므로 보수적으로 글자 수의 절반 이상으로 잡습니다.
+    """
+    return len(str(text)) // 2 + 1
+
+
+class Ticket:
+    """
+    대기열의 요청 한 건입니다.
+    """
+
+    def __init__(self, user_id, tokens):
+        self.user_id = user_id
+        self.tokens = tokens
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+        self._window_entry = None
+
+    @property
+    def granted(self):
+        return self.granted_at is not None
+
+
+class AdmissionController:
+    """
+    동시 요청 수(max_inflight)와 분당 토큰 수(tokens_per_minute)를 지키며
+    요청을 입장시키는 프로세스 공용 스케줄러입니다.
+
+    대기 중인 요청은 사용자별 큐에 들어가고, 입장 순서는 사용자 사이를 번갈아 돕니다.
+    따라서 한 학생이 여러 번 보내도 다른 학생의 첫 요청보다 앞서지 않습니다.
+    """
+
+    def __init__(self, max_inflight=DEFAULT_MAX_INFLIGHT, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE):
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()
+        self._window = deque()
+        self._inflight = 0
+        self.max_inflight = max_inflight
+        self.tokens_per_minute = tokens_per_minute
+        self.admitted_total = 0
+        self.timeouts_total = 0
+
+    def configure(self, max_inflight, tokens_per_minute):
+        """
+        설정 시트 값이 바뀌었을 때 제한 값을 갱신합니다.
+        """
+        with self._cond:
+            self.max_inflight = max(1, int(max_inflight))
+            self.tokens_per_minute = max(0, int(tokens_per_minute))
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, user_id, tokens, on_wait=None, max_wait=DEFAULT_MAX_WAIT):
+        """
+        차례가 올 때까지 기다렸다가 요청 한 건을 입장시킵니다.
+
+        Parameters:
+        user_id (str): 공평한 순서를 정할 사용자 구분값 (대화명)
+        tokens (int): 이 요청이 사용할 것으로 추정되는 토큰 수
+        on_wait (callable, optional): 대기 순번이 바뀔 때마다 on_wait(앞에 있는 요청 수)를 호출합니다.
+        max_wait (float): 최대 대기 시간(초). 넘으면 QueueTimeoutError가 발생합니다.
+
+        with 블록이 끝나면(예외, st.rerun 포함) 자리를 반납합니다.
+        """
+        ticket = Ticket(user_id, tokens)
+        with self._cond:
+            self._queues.setdefault(user_id, deque()).append(ticket)
+            self._dispatch()
+
+        try:
+            self._wait(ticket, on_wait, max_wait)
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def record_usage(self, ticket, tokens):
+        """
+        응답이 끝난 뒤 실제 사용 토큰 수로 분당 토큰 집계를 고칩니다.
+        """
+        with self._cond:
+            entry = ticket._window_entry
+            if entry is not None:
+                entry[1] = tokens
+            ticket.tokens = tokens
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 대기열 상태를 반환합니다.
+        """
+        with self._cond:
+            self._expire_window()
+            return {
+                "inflight": self._inflight,
+                "max_inflight": self.max_inflight,
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "queued_users": len(self._queues),
+                "tokens_last_minute": sum(entry[1] for entry in self._window),
+                "tokens_per_minute": self.tokens_per_minute,
+                "admitted_total": self.admitted_total,
+                "timeouts_total": self.timeouts_total,
+            }
+
+    def _wait(self, ticket, on_wait, max_wait):
+        last_position = None
+        deadline = ticket.enqueued_at + max_wait
+
+        while True:
+            with self._cond:
+                self._dispatch()
+                if ticket.granted:
+                    return
+                position = self._position(ticket)
+                if time.monotonic() >= deadline:
+                    self.timeouts_total += 1
+                    raise QueueTimeoutError(f"대기 시간 {max_wait}초 초과 (앞에 {position}건)")
+
+            # 화면 갱신은 잠금 밖에서 합니다.
+            if on_wait is not None and position != last_position:
+                on_wait(position)
+                last_position = position
+
+            with self._cond:
+                if not ticket.granted:
+                    self._cond.wait(POLL_SECONDS)
+
+    def _release(self, ticket):
+        with self._cond:
+            if ticket.granted:
+                self._inflight -= 1
+            else:
+                queue = self._queues.get(ticket.user_id)
+                if queue is not None and ticket in queue:
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[ticket.user_id]
+            self._dispatch()
+            self._cond.notify_all()
+
+    def _dispatch(self):
+        # 잠금을 잡은 상태에서만 호출합니다.
+        granted = False
+        self._expire_window()
+
+        while self._queues and self._inflight < self.max_inflight:
+            user_id, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            if not self._has_token_budget(ticket.tokens):
+                break
+
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+
+            ticket.granted_at = time.monotonic()
+            ticket._window_entry = [ticket.granted_at, ticket.tokens]
+            self._window.append(ticket._window_entry)
+            self._inflight += 1
+            self.admitted_total += 1
+            granted = True
+
+        if granted:
+            self._cond.notify_all()
+
+    def _has_token_budget(self, tokens):
+        if self.tokens_per_minute <= 0:
+            return True
+        used = sum(entry[1] for entry in self._window)
+        # 한 요청이 한도보다 커도 창이 비어 있으면 입장시켜 영원히 막히지 않게 합니다.
+        return used + tokens <= self.tokens_per_minute or not self._window
+
+    def _expire_window(self):
+        limit = time.monotonic() - WINDOW_SECONDS
+        while self._window and self._window[0][0] < limit:
+            self._window.popleft()
+
+    def _position(self, ticket):
+        # round-robin 순서대로 이 요청보다 먼저 입장할 요청 수를 셉니다.
+        queue = self._queues.get(ticket.user_id)
+        if queue is None or ticket not in queue:
+            return 0
+
+        depth = queue.index(ticket)
+        position = depth
+        before_me = True
+        for user_id, other in self._queues.items():
+            if user_id == ticket.user_id:
+                before_me = False
+                continue
+            # 앞선 사용자는 같은 라운드에서도 먼저 입장합니다.
+            position += min(len(other), depth + 1 if before_me else depth)
+        return position
+
+
+@st.cache_resource
+def get_scheduler():
+    """
+    프로세스 공용 AdmissionController를 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 대기열을 사용합니다.
+    """
+    return AdmissionController()
@@ -0,0 +1,252 @@
+"""
+대화 세션 로컬 저장 (SQLite, WAL)
+끝난 턴을 백그라운드 스레드에서 로컬 SQLite 파일에 덧붙여, 브라우저 연결이 끊기거나 앱이 다시 시작되어도
+대화명 + 이어하기 토큰으로 대화를 되살립니다. Google Sheet 저장(utils/sheet_writer.py)은 그대로 비동기 사본으로 남습니다.
+"""
+import atexit
+import logging
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import streamlit as st
+
+from utils import log
+
+STORE_PATH = Path(__file__).resolve().parent.parent / ".cache" / "sessions.sqlite3"
+RETENTION_SECONDS = 7 * 24 * 60 * 60
+FLUSH_ITEMS = 100
+FLUSH_SECONDS = 0.2
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        token TEXT PRIMARY KEY,
+        classroom TEXT NOT NULL,
+        nick_name TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS turns (
+        token TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TEXT,
+        elapsed_seconds REAL,
+        PRIMARY KEY (token, idx)
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)",
+)
+
+
+class SessionStore:
+    """
+    학생 세션의 대화 기록을 보관하는 프로세스 공용 SQLite 저장소입니다.
+
+    Parameters:
+    path (str or Path): SQLite 파일 경로
+    retention_seconds (float): 마지막 턴 뒤 이 시간이 지난 세션은 시작할 때 지웁니다.
+
+    - append()는 큐에 넣기만 하므로 채팅 턴을 막지 않습니다. 쓰기는 저장 스레드가 모아서 트랜잭션 하나로 합니다.
+    - 되살리기(restore)는 세션 행 하나와 (token, idx) 기본 키 범위를 읽는 쿼리 두 번으로 끝납니다.
+    - 토큰은 대화명과 함께 맞아야 하므로, 주소창의 토큰만으로 다른 학생의 대화를 열 수 없습니다.
+    - 파일을 열 수 없으면(읽기 전용 디스크 등) 로그를 남기고 저장하지 않은 채로 동작합니다.
+    """
+
+    def __init__(self, path=STORE_PATH, retention_seconds=RETENTION_SECONDS):
+        self.path = Path(path)
+        self.retention_seconds = retention_seconds
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._read_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(("sessions", "restored", "enqueued", "written", "batches", "failures"), 0)
+        self._reader = self._connect()
+        self._thread = None
+        if self._reader is not None:
+            self._thread = threading.Thread(target=self._run, name="session-store", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    @property
+    def enabled(self):
+        return self._reader is not None
+
+    def open_session(self, classroom, nick_name, token=None):
+        """
+        이어하기 토큰으로 저장된 세션을 찾고, 없으면 새 세션을 만듭니다.
+
+        Parameters:
+        classroom (str): 수업 지문 (llm.key_fingerprint(B1 url))
+        nick_name (str): 대화명
+        token (str, optional): 주소창(?resume=)에 남아 있던 이어하기 토큰
+
+        Returns:
+        tuple: (토큰, 저장된 턴 리스트). 새 세션이면 턴 리스트는 비어 있습니다.
+            턴은 (idx, role, content, timestamp, elapsed_seconds)이며 timestamp는 datetime 또는 None입니다.
+        """
+        if token and self.enabled:
+            turns = self._restore(classroom, nick_name, token)
+            if turns is not None:
+                self._count("restored", 1)
+                return token, turns
+
+        token = secrets.token_urlsafe(12)
+        now = time.time()
+        self._put(("session", (token, classroom, nick_name, now, now)))
+        self._count("sessions", 1)
+        return token, []
+
+    def append(self, token, turns):
+        """
+        끝난 턴을 저장 큐에 넣습니다.
+
+        Parameters:
+        token (str): open_session()이 돌려준 토큰
+        turns (list): (idx, role, content, timestamp(datetime 또는 None), elapsed_seconds) 리스트
+        """
+        rows = [
+            (token, idx, role, content, timestamp.isoformat() if timestamp else None, elapsed_seconds)
+            for idx, role, content, timestamp, elapsed_seconds in turns
+        ]
+        self._put(("turns", rows))
+        self._count("enqueued", len(rows))
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 저장소 상태를 반환합니다.
+        """
+        try:
+            db_bytes = sum(p.stat().st_size for p in self.path.parent.glob(self.path.name + "*"))
+        except OSError:
+            db_bytes = None
+        with self._stats_lock:
+            return dict(self._stats, enabled=self.enabled, pending=self._queue.qsize(), db_bytes=db_bytes)
+
+    def stop(self, timeout=5):
+        """
+        남은 턴을 저장하고 스레드를 멈춥니다. (프로세스 종료 시 자동 호출)
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _connect(self):
+        try:
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                connection.execute(statement)
+            return connection
+        except (OSError, sqlite3.Error) as e:
+            log.event("세션 저장소 열기 실패", logging.WARNING, path = str(self.path), error_type = type(e).__name__, error = str(e))
+            return None
+
+    def _restore(self, classroom, nick_name, token):
+        try:
+            with self._read_lock:
+                session = self._reader.execute(
+                    "SELECT 1 FROM sessions WHERE token = ? AND classroom = ? AND nick_name = ?",
+                    (token, classroom, nick_name),
+                ).fetchone()
+                if session is None:
+                    return None
+                rows = self._reader.execute(
+                    "SELECT idx, role, content, timestamp, elapsed_seconds FROM turns WHERE token = ? ORDER BY idx",
+                    (token,),
+                ).fetchall()
+        except sqlite3.Error as e:
+            log.event("세션 되살리기 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+            return None
+        return [
+            (idx, role, content, datetime.fromisoformat(timestamp) if timestamp else None, elapsed_seconds)
+            for idx, role, content, timestamp, elapsed_seconds in rows
+        ]
+
+    def _put(self, item):
+        if self.enabled:
+            self._queue.put(item)
+
+    def _run(self):
+        # 쓰기 전용 연결은 이 스레드에서만 씁니다.
+        writer = sqlite3.connect(self.path, isolation_level=None)
+        self._prune(writer)
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + FLUSH_SECONDS
+            while len(batch) < FLUSH_ITEMS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._flush(writer, batch)
+        writer.close()
+
+    def _flush(self, writer, batch):
+        sessions = [values for kind, values in batch if kind == "session"]
+        turns = [row for kind, rows in batch if kind == "turns" for row in rows]
+        now = time.time()
+        try:
+            writer.execute("BEGIN")
+            writer.executemany("INSERT OR IGNORE INTO sessions VALUES (?, ?, ?, ?, ?)", sessions)
+            writer.executemany("INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?, ?)", turns)
+            writer.executemany(
+                "UPDATE sessions SET updated_at = ? WHERE token = ?",
+                [(now, token) for token in {row[0] for row in turns}],
+            )
+            writer.execute("COMMIT")
+        except sqlite3.Error as e:
+            if writer.in_transaction:
+                writer.execute("ROLLBACK")
+            self._count("failures", 1)
+            log.event("세션 저장 실패", logging.ERROR, turns = len(turns), error_type = type(e).__name__, error = str(e))
+            return
+        self._count("written", len(turns))
+        self._count("batches", 1)
+
+    def _prune(self, writer):
+        cutoff = time.time() - self.retention_seconds
+        try:
+            writer.execute("BEGIN")
+            writer.execute("DELETE FROM turns WHERE token IN (SELECT token FROM sessions WHERE updated_at < ?)", (cutoff,))
+            removed = writer.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+            writer.execute("COMMIT")
+        except sqlite3.Error as e:
+            if writer.in_transaction:
+                writer.execute("ROLLBACK")
+            log.event("오래된 세션 정리 실패", logging.WARNING, error_type = type(e).__name__, error = str(e))
+            return
+        if removed:
+            log.event("오래된 세션 정리", sessions = removed)
+
+    def _count(self, name, value):
+        with self._stats_lock:
+            self._stats[name] += value
+
+
+@st.cache_resource
+def get_session_store():
+    """
+    프로세스 공용 SessionStore를 반환합니다.
+    Secrets의 session_store_path로 파일 위치를 바꿀 수 있습니다.
+    """
+    return SessionStore(st.secrets.get("session_store_path", STORE_PATH))
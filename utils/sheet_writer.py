@@ -0,0 +1,227 @@
+"""
+대화 기록 Google Sheets 저장 (write-behind)
+여러 세션의 대화 행을 큐에 모았다가 백그라운드 스레드에서 묶어서 저장합니다.
+"""
+import atexit
+import logging
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import gspread
+import streamlit as st
+
+from utils import log
+
+FLUSH_ROWS = 50
+FLUSH_SECONDS = 2.0
+MAX_RETRIES = 5
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+# 개인정보 보호 모드에서 가릴 항목: 이메일, 휴대전화/전화번호, 주민등록번호
+PERSONAL_INFO_PATTERNS = (
+    (re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+"), "[이메일]"),
+    (re.compile(r"\d{6}-?[1-4]\d{6}"), "[주민번호]"),
+    (re.compile(r"0\d{1,2}-?\d{3,4}-?\d{4}"), "[전화번호]"),
+)
+
+
+def mask_personal_info(text):
+    """
+    대화 내용에서 이메일, 전화번호, 주민등록번호를 가립니다.
+    """
+    for pattern, replacement in PERSONAL_INFO_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class SheetWriter:
+    """
+    Google Sheets 행 추가를 모아서 처리하는 프로세스 공용 write-behind 큐입니다.
+
+    Parameters:
+    flush_rows (int): 이만큼 행이 모이면 바로 저장합니다.
+    flush_seconds (float): 첫 행이 들어온 뒤 이 시간이 지나면 모인 만큼 저장합니다.
+    max_retries (int): 할당량(429)/서버 오류 시 다시 시도할 횟수
+
+    - enqueue()는 큐에 넣기만 하므로 채팅 턴을 막지 않습니다.
+    - 워크시트 gid 대신 아직 연결 중인 워크시트의 Future를 넣을 수 있습니다. 저장 스레드는 기다리지 않고,
+      연결이 끝나면 그 행을 넣은 순서대로 다시 큐에 넣습니다. 연결에 실패하면 그 행만 버립니다.
+    - 한 번의 저장에서 같은 스프레드시트의 모든 행(여러 학생 시트)을 batch_update 한 번으로 추가합니다.
+      다시 시도해도 안 되는 오류(400 등)가 나면 시트별로 나누어 다시 저장하므로, 문제가 있는 시트의 행만 버립니다.
+    - 값은 문자열(stringValue)로 저장하므로 "="로 시작하는 내용도 수식으로 실행되지 않습니다.
+    """
+
+    def __init__(self, flush_rows=FLUSH_ROWS, flush_seconds=FLUSH_SECONDS, max_retries=MAX_RETRIES):
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_retries = max_retries
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = dict.fromkeys(("enqueued", "written", "batches", "retries", "splits", "dropped"), 0)
+        self._waiting_lock = threading.Lock()
+        self._waiting = {}
+        self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def enqueue(self, doc, sheet, rows):
+        """
+        저장할 행을 큐에 넣습니다.
+
+        Parameters:
+        doc (gspread.Spreadsheet): 행을 추가할 스프레드시트. sheet가 Future이면 쓰지 않으며(None), 연결된 워크시트의 스프레드시트에 저장합니다.
+        sheet (int or concurrent.futures.Future): 행을 추가할 워크시트의 gid, 또는 결과가 gspread.Worksheet인 Future
+        rows (list): 행 리스트 (각 행은 값 리스트)
+        """
+        self._queue.put((doc, sheet, rows))
+        self._count("enqueued", len(rows))
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 저장 큐 상태를 반환합니다.
+        """
+        with self._waiting_lock:
+            waiting_rows = sum(len(item[2]) for items in self._waiting.values() for item in items)
+        with self._stats_lock:
+            return dict(self._stats, pending_batches=self._queue.qsize(), waiting_rows=waiting_rows)
+
+    def stop(self, timeout=5):
+        """
+        남은 행을 저장하고 스레드를 멈춥니다. (프로세스 종료 시 자동 호출)
+        """
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            row_count = len(first[2])
+            deadline = time.monotonic() + self.flush_seconds
+            while row_count < self.flush_rows and not self._stopped.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                row_count += len(item[2])
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        # 스프레드시트별로 묶고, 그 안에서는 워크시트별로 appendCells 요청을 하나씩 만듭니다.
+        docs = OrderedDict()
+        for doc, sheet, rows in batch:
+            sheet_id = sheet
+            if isinstance(sheet, Future):
+                worksheet = self._resolve(doc, sheet, rows)
+                if worksheet is None:
+                    continue
+                doc, sheet_id = worksheet.spreadsheet, worksheet.id
+            sheets = docs.setdefault(doc.id, (doc, OrderedDict()))[1]
+            sheets.setdefault(sheet_id, []).extend(rows)
+
+        for doc, sheets in docs.values():
+            self._write(doc, sheets)
+
+    def _resolve(self, doc, future, rows):
+        # 연결이 끝나지 않았거나, 같은 Future의 앞선 행이 아직 기다리는 중이면 순서를 지키도록 뒤에 붙입니다.
+        with self._waiting_lock:
+            waiting = self._waiting.get(future)
+            if waiting is not None:
+                waiting.append((doc, future, rows))
+                return None
+            pending = not future.done()
+            if pending:
+                self._waiting[future] = [(doc, future, rows)]
+        if pending:
+            # 이미 끝난 Future이면 콜백이 이 자리에서 바로 불리므로 잠금 밖에서 등록합니다.
+            future.add_done_callback(self._requeue)
+            return None
+
+        try:
+            return future.result()
+        except Exception as e:
+            log.event("시트 연결 실패", logging.ERROR, rows = len(rows), error_type = type(e).__name__, error = str(e))
+            self._count("dropped", len(rows))
+            return None
+
+    def _requeue(self, future):
+        with self._waiting_lock:
+            for item in self._waiting.pop(future, ()):
+                self._queue.put(item)
+
+    def _write(self, doc, sheets, split=True):
+        # sheets: 워크시트 gid -> 행 리스트. 모두 batch_update 한 번으로 저장합니다.
+        requests = [
+            {
+                "appendCells": {
+                    "sheetId": sheet_id,
+                    "rows": [
+                        {"values": [{"userEnteredValue": {"stringValue": str(value)}} for value in row]}
+                        for row in rows
+                    ],
+                    "fields": "userEnteredValue",
+                }
+            }
+            for sheet_id, rows in sheets.items()
+        ]
+        row_count = sum(len(rows) for rows in sheets.values())
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                doc.batch_update({"requests": requests})
+                self._count("written", row_count)
+                self._count("batches", 1)
+                return
+            except gspread.exceptions.APIError as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if status not in RETRYABLE_STATUS and split and len(sheets) > 1:
+                    # 시트 하나의 오류(지워진 탭의 400 등)로 모든 세션의 행을 버리지 않도록 시트별로 다시 저장합니다.
+                    log.event("대화 기록 나누어 저장", logging.WARNING, sheets = len(sheets), status_code = status, error = str(e))
+                    self._count("splits", 1)
+                    for sheet_id, rows in sheets.items():
+                        self._write(doc, {sheet_id: rows}, split=False)
+                    return
+                if status not in RETRYABLE_STATUS or attempt == self.max_retries:
+                    log.event(
+                        "대화 기록 저장 실패",
+                        logging.ERROR,
+                        rows = row_count,
+                        status_code = status,
+                        error_type = type(e).__name__,
+                        error = str(e),
+                    )
+                    break
+                self._count("retries", 1)
+                time.sleep(min(30, 2 ** attempt))
+            except Exception as e:
+                log.event("대화 기록 저장 실패", logging.ERROR, rows = row_count, error_type = type(e).__name__, error = str(e))
+                break
+
+        self._count("dropped", row_count)
+
+    def _count(self, name, value):
+        with self._stats_lock:
+            self._stats[name] += value
+
+
+@st.cache_resource
+def get_sheet_writer():
+    """
+    프로세스 공용 SheetWriter를 반환합니다.
+    @st.cache_resource로 캐싱되어 모든 세션이 같은 저장 큐를 사용합니다.
+    """
+    return SheetWriter()
@@ -0,0 +1,95 @@
+"""
+스트리밍 응답 렌더링 버퍼
+토큰마다 화면을 다시 그리지 않고 시간/글자 수 예산에 맞춰 모아서 출력합니다.
+"""
+import time
+
+CURSOR = "▌"
+DEFAULT_FLUSH_MS = 50
+DEFAULT_FLUSH_CHARS = 200
+
+
+class StreamBuffer:
+    """
+    스트리밍 델타를 리스트에 모아 두었다가 일정 간격으로 placeholder에 출력하는 버퍼입니다.
+
+    Parameters:
+    output (streamlit.delta_generator.DeltaGenerator, optional): 출력할 Streamlit placeholder. None이면 화면 출력 없이 텍스트만 모읍니다.
+    flush_ms (int): 마지막 출력 이후 이 시간(ms)이 지나면 출력합니다.
+    flush_chars (int): 출력하지 않은 글자 수가 이 값을 넘으면 시간과 상관없이 출력합니다.
+
+    델타는 리스트에 append만 하고, 출력 시점에만 문자열로 합칩니다.
+    따라서 응답 길이가 n일 때 문자열 연결과 화면 갱신 횟수가 토큰 수가 아니라 flush 횟수에 비례합니다.
+    화면 출력에 쓴 시간은 render_seconds에 더합니다.
+    """
+
+    def __init__(self, output=None, flush_ms=DEFAULT_FLUSH_MS, flush_chars=DEFAULT_FLUSH_CHARS):
+        self.output = output
+        self.flush_interval = max(0, flush_ms) / 1000
+        self.flush_chars = max(1, flush_chars)
+        self.flush_count = 0
+        self.render_seconds = 0.0
+        self._text = ""
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = time.perf_counter()
+
+    def append(self, text):
+        """
+        델타 하나를 버퍼에 추가하고, 예산을 넘었으면 출력합니다.
+        """
+        if not text:
+            return
+
+        self._pending.append(text)
+        self._pending_chars += len(text)
+
+        if (
+            self._pending_chars >= self.flush_chars
+            or time.perf_counter() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self, final=False):
+        """
+        모아 둔 델타를 합쳐 placeholder에 출력합니다.
+        final이 True이면 커서 없이 완성된 응답을 출력합니다.
+        """
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending.clear()
+            self._pending_chars = 0
+
+        self._last_flush = time.perf_counter()
+        if self.output is not None:
+            started = time.perf_counter()
+            self.output.write(self._text if final else self._text + CURSOR)
+            self.render_seconds += time.perf_counter() - started
+            self.flush_count += 1
+
+    def rstrip(self):
+        """
+        끝 공백을 잘라냅니다. 끊긴 스트림을 이어받을 때, 잘라낸 텍스트 뒤에
+        이어지는 응답이 공백을 다시 보내므로 중복되지 않게 합니다.
+        """
+        if self._pending:
+            self._text += "".join(self._pending)
+            self._pending.clear()
+            self._pending_chars = 0
+        self._text = self._text.rstrip()
+
+    def close(self):
+        """
+        남은 델타를 모두 출력하고 전체 응답 문자열을 반환합니다.
+        """
+        self.flush(final=True)
+        return self._text
+
+    @property
+    def text(self):
+        """
+        지금까지 받은 전체 응답 문자열 (아직 출력하지 않은 델타 포함)
+        """
+        if self._pending:
+            return self._text + "".join(self._pending)
+        return self._text
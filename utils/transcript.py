@@ -0,0 +1,205 @@
+"""
+대화 기록 내보내기 (TXT / JSON / CSV)
+새로 추가된 메시지만 정리해 캐시에 덧붙이고, 실제 파일은 다운로드할 때만 만듭니다.
+"""
+import codecs
+import csv
+import functools
+import io
+import json
+import re
+
+SEPARATOR = "=" * 60
+ROLE_LABELS = {
+    "user": "[학생]",
+    "assistant": "[챗봇]",
+}
+EXPORT_FORMATS = {
+    "TXT": ("txt", "text/plain"),
+    "JSON": ("json", "application/json"),
+    "CSV": ("csv", "text/csv"),
+}
+
+
+def format_elapsed(seconds):
+    if seconds is None:
+        return "-"
+
+    seconds = max(0, int(round(seconds)))
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+# 여러 코드 포인트로 이루어진 키캡 숫자 ("1️⃣" = "1" + U+FE0F + U+20E3)
+KEYCAP_PATTERN = re.compile("([1-3])\ufe0f\u20e3")
+
+# 코드 포인트 하나짜리 치환/삭제 표. 이모지 영역은 지우고, 찬반 표시 사각형은 글자로 바꿉니다.
+DROP_RANGES = (
+    (0x1F000, 0x1FAFF),
+    (0x2600, 0x27BF),
+    (0xFE00, 0xFE0F),
+)
+CLEAN_TABLE = {
+    code_point: None
+    for start, end in DROP_RANGES
+    for code_point in range(start, end + 1)
+}
+CLEAN_TABLE.update({
+    0x200D: None,
+    0x20E3: None,
+    ord("🟦"): "[찬성]",
+    ord("🟥"): "[반대]",
+})
+
+
+def clean_text_for_txt(text):
+    """
+    내보내기용으로 이모지를 지우고 찬반/번호 표시를 글자로 바꿉니다.
+    같은 메시지 내용은 캐시된 결과를 돌려줍니다.
+    """
+    return _clean_text(str(text))
+
+
+@functools.lru_cache(maxsize=2048)
+def _clean_text(text):
+    # 키캡 숫자를 먼저 바꿔야 U+FE0F, U+20E3이 표에서 지워지기 전에 "1."이 됩니다.
+    return KEYCAP_PATTERN.sub(r"\1.", text).translate(CLEAN_TABLE)
+
+
+class TranscriptStore:
+    """
+    대화 기록을 내보내기용 레코드와 인코딩된 TXT 조각으로 쌓아 두는 저장소입니다.
+
+    sync()는 자리마다 정리해 둔 Turn이 지금의 Turn과 같은 객체인지 비교해 바뀐 뒤쪽 메시지만 다시 정리합니다.
+    Turn은 만든 뒤 바뀌지 않으므로 내용을 비교할 필요가 없어, 긴 메시지도 비교 비용이 거의 없습니다.
+    대화는 뒤에 추가되거나 마지막 학생 메시지가 지워지는 식으로만 바뀌므로,
+    보통은 새로 추가된 턴만 처리합니다.
+    """
+
+    def __init__(self):
+        self._turns = []
+        self._records = []
+        self._txt_chunks = []
+
+    def sync(self, turns):
+        """
+        대화 기록의 현재 상태를 반영합니다.
+
+        Parameters:
+        turns (utils.turn_log.TurnLog): 시스템 메시지를 포함한 전체 대화 기록
+        """
+        # 공통 구간의 끝에서부터 거꾸로 비교해, 바뀐 메시지가 있으면 그 뒤를 모두 버립니다.
+        start = min(len(turns), len(self._turns))
+        while start > 0 and turns[start - 1] is not self._turns[start - 1]:
+            start -= 1
+        del self._turns[start:]
+        del self._records[start:]
+        del self._txt_chunks[start:]
+
+        for turn in turns[start:]:
+            record = self._record(turn)
+            self._turns.append(turn)
+            self._records.append(record)
+            self._txt_chunks.append(self._txt_chunk(record))
+
+    def export_txt(self, user_name, created_at):
+        """
+        TXT 파일 내용을 utf-8-sig로 인코딩해 반환합니다.
+        """
+        header = "\n".join([
+            SEPARATOR,
+            f"대화명: {clean_text_for_txt(user_name or 'unknown')}",
+            f"생성 시각: {created_at}",
+        ]).encode("utf-8")
+        body = b"".join([header, *self._txt_chunks]).rstrip() + b"\n"
+        return codecs.BOM_UTF8 + body
+
+    def export_json(self, user_name, created_at):
+        """
+        JSON 파일 내용을 utf-8로 인코딩해 반환합니다.
+        """
+        data = {
+            "user_name": user_name or "unknown",
+            "created_at": created_at,
+            "messages": [record for record in self._records if record is not None],
+        }
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+    def export_csv(self, user_name, created_at):
+        """
+        CSV 파일 내용을 utf-8-sig로 인코딩해 반환합니다. (엑셀에서 한글이 깨지지 않도록 BOM 포함)
+        """
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(["user_name", "created_at", "role", "timestamp", "elapsed", "content"])
+        for record in self._records:
+            if record is None:
+                continue
+            writer.writerow([
+                user_name or "unknown",
+                created_at,
+                record["role"],
+                record["timestamp"],
+                record["elapsed"],
+                record["content"],
+            ])
+        return output.getvalue().encode("utf-8-sig")
+
+    def export(self, export_format, user_name, created_at):
+        """
+        EXPORT_FORMATS의 키("TXT", "JSON", "CSV")에 맞는 파일 내용을 반환합니다.
+        """
+        exporters = {
+            "TXT": self.export_txt,
+            "JSON": self.export_json,
+            "CSV": self.export_csv,
+        }
+        return exporters[export_format](user_name, created_at)
+
+    @staticmethod
+    def _record(turn):
+        if turn.role not in ROLE_LABELS:
+            return None
+
+        timestamp = turn.timestamp
+        return {
+            "role": turn.role,
+            "timestamp": timestamp.strftime("%H:%M:%S") if timestamp else "--:--:--",
+            "elapsed": format_elapsed(turn.elapsed_seconds),
+            "content": clean_text_for_txt(turn.content).strip(),
+        }
+
+    @staticmethod
+    def _txt_chunk(record):
+        if record is None:
+            return b""
+
+        if record["role"] == "user":
+            time_lines = [f"입력 시각: {record['timestamp']}", f"생각 소요: {record['elapsed']}"]
+        else:
+            time_lines = [f"응답 시각: {record['timestamp']}", f"생성 소요: {record['elapsed']}"]
+        lines = [
+            "",
+            SEPARATOR,
+            ROLE_LABELS[record["role"]],
+            *time_lines,
+            "------------",
+            "",
+            "내용:",
+            record["content"],
+            "",
+        ]
+        return "\n".join(lines).encode("utf-8")
+
+
+def build_conversation_txt(turns, user_name=None, created_at=None):
+    """
+    대화 기록(TurnLog) 전체를 TXT 문자열로 한 번에 만듭니다.
+    (세션에서는 TranscriptStore를 사용해 새 메시지만 덧붙입니다.)
+    """
+    store = TranscriptStore()
+    store.sync(turns)
+    return store.export_txt(user_name, created_at).decode("utf-8-sig")
@@ -0,0 +1,168 @@
+"""
+세션 대화 기록 (TurnLog)
+메시지와 메타데이터(시각, 소요 시간)를 __slots__ 객체 하나에 함께 담아, 세션마다 드는 메모리를 줄입니다.
+"""
+import sys
+import threading
+import time
+from collections.abc import Sequence
+from datetime import datetime, timedelta, timezone
+
+import streamlit as st
+
+from utils.metrics import percentile
+
+KST = timezone(timedelta(hours=9))
+SESSION_IDLE_SECONDS = 2 * 60 * 60
+
+
+class Turn:
+    """
+    대화 메시지 하나입니다.
+
+    - message는 API에 그대로 보내는 {"role", "content"} dict입니다. API용 목록(TurnLog.api_view)은 이 dict를 복사하지 않고 돌려줍니다.
+    - 시각은 datetime 대신 epoch 초(float)로 보관하고, 읽을 때 KST datetime으로 바꿉니다.
+    """
+
+    __slots__ = ("message", "_epoch", "elapsed_seconds")
+
+    def __init__(self, role, content, timestamp=None, elapsed_seconds=None):
+        self.message = {"role": role, "content": content}
+        self._epoch = timestamp.timestamp() if timestamp is not None else None
+        self.elapsed_seconds = elapsed_seconds
+
+    @property
+    def role(self):
+        return self.message["role"]
+
+    @property
+    def content(self):
+        return self.message["content"]
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self._epoch, KST) if self._epoch is not None else None
+
+
+class TurnView(Sequence):
+    """
+    TurnLog의 start번째부터의 메시지 dict를 보여 주는 읽기 전용 목록입니다. 리스트를 새로 만들지 않습니다.
+    잘라 내기(view[a:b])와 더하기(view + [...])는 새 리스트를 반환합니다.
+    """
+
+    __slots__ = ("_turns", "_start")
+
+    def __init__(self, turns, start):
+        self._turns = turns
+        self._start = start
+
+    def __len__(self):
+        return max(0, len(self._turns) - self._start)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._turns[self._start + i].message for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self._turns[self._start + idx].message
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+
+class TurnLog(list):
+    """
+    시스템 메시지(0번)와 학생/챗봇 Turn을 순서대로 담는 세션 대화 기록입니다.
+
+    Parameters:
+    system (str): 시스템 프롬프트
+
+    - 리스트처럼 len(), 인덱스, 반복을 그대로 쓸 수 있고, 원소는 Turn입니다.
+    - 메타데이터가 메시지와 같은 객체에 있으므로 메시지를 지울 때 따로 맞출 것이 없습니다.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, system):
+        super().__init__([Turn("system", system)])
+
+    def add(self, role, content, timestamp=None, elapsed_seconds=None):
+        """
+        Turn 하나를 덧붙이고 그 인덱스를 반환합니다.
+        """
+        self.append(Turn(role, content, timestamp, elapsed_seconds))
+        return len(self) - 1
+
+    def api_view(self, start=1):
+        """
+        API에 보낼 메시지 dict 목록(TurnView)을 반환합니다. 기본값은 시스템 메시지를 뺀 전체 대화입니다.
+        """
+        return TurnView(self, start)
+
+    def pop_unanswered(self):
+        """
+        답을 받지 못한 마지막 학생 메시지를 지웁니다. (요청이 실패한 턴)
+        """
+        while len(self) > 1 and self[-1].role == "user":
+            self.pop()
+
+    def memory_bytes(self):
+        """
+        이 대화 기록이 차지하는 메모리(바이트)를 대략 계산합니다. (리스트 + Turn + 메시지 dict + 내용 문자열)
+        """
+        per_turn = sys.getsizeof(Turn.__new__(Turn)) + sys.getsizeof(0.0) * 2
+        return sys.getsizeof(self) + sum(
+            per_turn + sys.getsizeof(turn.message) + sys.getsizeof(turn.content) for turn in self
+        )
+
+
+class SessionMemoryStats:
+    """
+    세션별 대화 기록 메모리를 모아 운영자 화면에 보여 주는 프로세스 공용 집계입니다.
+
+    Parameters:
+    idle_seconds (float): 이 시간 동안 기록이 없는 세션은 닫힌 것으로 보고 집계에서 뺍니다.
+    """
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def record(self, session_id, turns):
+        """
+        세션의 현재 대화 기록 크기를 기록하고, 그 크기(바이트)를 반환합니다.
+        """
+        size = turns.memory_bytes()
+        with self._lock:
+            self._sessions[session_id] = (size, len(turns) - 1, time.monotonic())
+        return size
+
+    def stats(self):
+        """
+        열린 세션 수, 세션당 메모리 p50/p95/최대, 합계를 반환합니다.
+        """
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            for session_id in [key for key, (_, _, seen) in self._sessions.items() if seen < cutoff]:
+                del self._sessions[session_id]
+            sizes = sorted(size for size, _, _ in self._sessions.values())
+            messages = sum(count for _, count, _ in self._sessions.values())
+        return {
+            "sessions": len(sizes),
+            "messages": messages,
+            "total_bytes": sum(sizes),
+            "p50_bytes": percentile(sizes, 50),
+            "p95_bytes": percentile(sizes, 95),
+            "max_bytes": sizes[-1] if sizes else None,
+        }
+
+
+@st.cache_resource
+def get_session_memory_stats():
+    """
+    프로세스 공용 SessionMemoryStats를 반환합니다.
+    """
+    return SessionMemoryStats()
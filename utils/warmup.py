@@ -0,0 +1,146 @@
+"""
+프롬프트 캐시 미리 데우기
+학생이 접속하거나 선생님이 서비스를 켜면, 긴 시스템 프롬프트를 첫 질문 전에 미리 프롬프트 캐시에 올려 둡니다.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils import llm, log
+from utils.config_refresher import get_config_refresher
+from utils.metrics import percentile
+
+# Anthropic 프롬프트 캐시는 마지막으로 쓴 뒤 5분 동안 유지되므로, 그보다 조금 짧은 간격으로만 다시 데웁니다.
+WARM_INTERVAL = 240
+WARMUP_MESSAGES = [{"role": "user", "content": "."}]
+FIRST_TURN_WINDOW = 200
+
+
+def prompt_key(setupInfo):
+    """
+    (시스템 프롬프트 sha256 앞 12자리, 모델)을 반환합니다.
+    """
+    return hashlib.sha256(setupInfo["system"].encode("utf-8")).hexdigest()[:12], setupInfo["model"]
+
+
+class CacheWarmer:
+    """
+    (시스템 프롬프트, 모델)별로 프롬프트 캐시를 한 번씩 데우는 프로세스 공용 객체입니다.
+
+    Parameters:
+    interval (float): 같은 (시스템 프롬프트, 모델)을 다시 데우기 전까지 기다릴 시간(초)
+
+    - warm()은 작업 스레드에 맡기고 바로 돌아오므로 초기화를 막지 않습니다.
+    - 학생 30명이 동시에 접속해도, 이미 데웠거나 데우는 중이면 요청을 보내지 않습니다.
+    - 데우기 요청은 max_tokens=1이므로 비용은 캐시 쓰기 비용과 거의 같습니다.
+    - 첫 턴의 TTFT를 캐시를 읽은 턴(warm)과 못 읽은 턴(cold)으로 나누어 모아, 얼마나 빨라졌는지 보여 줍니다.
+      모든 첫 턴이 캐시를 읽어 cold 기록이 없으면, 캐시 없이 프롬프트를 처리한 데우기 요청의 시간(warmup_ms)과 비교합니다.
+    """
+
+    def __init__(self, interval=WARM_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stats = dict.fromkeys(("warmups", "skipped", "failures"), 0)
+        self._first_turns = {name: deque(maxlen=FIRST_TURN_WINDOW) for name in ("warm", "cold", "warmup")}
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-warmup")
+
+    def warm(self, api_key, setupInfo):
+        """
+        현재 설정의 시스템 프롬프트를 데웁니다. 데울 필요가 없으면 None, 아니면 Future를 반환합니다.
+        """
+        if setupInfo.get("serviceOnOff") != "on" or not api_key:
+            return None
+
+        key = prompt_key(setupInfo)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.setdefault(key, {"warmed_at": None, "inflight": False, "cached_tokens": None})
+            if entry["inflight"] or (entry["warmed_at"] and now - entry["warmed_at"] < self.interval):
+                self._stats["skipped"] += 1
+                return None
+            entry["inflight"] = True
+
+        return self._executor.submit(self._warm, key, api_key, dict(setupInfo))
+
+    def on_config_change(self, old, new):
+        """
+        ConfigRefresher 알림: 서비스가 켜지거나, 켜진 상태에서 시스템 프롬프트/모델이 바뀌면 데웁니다.
+        """
+        values = new.values
+        if old is None or old.values.get("serviceOnOff") != "on" or prompt_key(old.values) != prompt_key(values):
+            self.warm(values.get("key"), values)
+
+    def record_first_turn(self, ttft_ms, cache_read_tokens):
+        """
+        학생의 첫 턴 TTFT를 캐시 적중 여부별로 기록합니다.
+        """
+        if ttft_ms is None:
+            return
+        with self._lock:
+            self._first_turns["warm" if cache_read_tokens else "cold"].append(ttft_ms)
+
+    def stats(self):
+        """
+        운영자 화면에 보여줄 데우기 횟수, 프롬프트별 상태, 첫 턴 TTFT 비교를 반환합니다.
+        """
+        now = time.time()
+        with self._lock:
+            result = dict(self._stats)
+            result["prompts"] = [
+                {
+                    "prompt": key[0],
+                    "model": key[1],
+                    "age_seconds": round(now - entry["warmed_at"]) if entry["warmed_at"] else None,
+                    "cached_tokens": entry["cached_tokens"],
+                }
+                for key, entry in self._entries.items()
+            ]
+            first_turns = {name: sorted(values) for name, values in self._first_turns.items()}
+
+        ttft = {name: {"p50": percentile(values, 50), "count": len(values)} for name, values in first_turns.items()}
+        baseline = ttft["cold"] if ttft["cold"]["count"] else ttft["warmup"]
+        if ttft["warm"]["count"] and baseline["count"]:
+            ttft["improvement_ms"] = round(baseline["p50"] - ttft["warm"]["p50"], 1)
+        result["first_turn_ttft_ms"] = ttft
+        return result
+
+    def _warm(self, key, api_key, setupInfo):
+        started = time.perf_counter()
+        try:
+            # 학생 대화에서 다시 쓰는 것은 시스템 프롬프트뿐이므로, 데우기 메시지에는 캐시 중단점을 두지 않습니다.
+            with llm.lease_client(api_key) as client:
+                _, usage, _ = llm.complete(client, setupInfo, WARMUP_MESSAGES, max_tokens=1, cache_messages=False)
+        except Exception as e:
+            with self._lock:
+                self._stats["failures"] += 1
+                self._entries[key]["inflight"] = False
+            log.event("프롬프트 캐시 준비 실패", logging.WARNING, model = key[1], error_type = type(e).__name__, error = str(e))
+            return
+
+        # 시스템 프롬프트가 모델의 최소 캐시 길이보다 짧으면 캐시되지 않습니다(cached_tokens 0).
+        cached_tokens = usage["cache_creation_input_tokens"] + usage["cache_read_input_tokens"]
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        with self._lock:
+            self._stats["warmups"] += 1
+            if usage["cache_creation_input_tokens"]:
+                self._first_turns["warmup"].append(elapsed_ms)
+            self._entries[key].update(warmed_at=time.time(), inflight=False, cached_tokens=cached_tokens)
+        log.event("프롬프트 캐시 준비", model = key[1], prompt = key[0], elapsed_ms = elapsed_ms, **usage)
+
+
+@st.cache_resource
+def get_cache_warmer():
+    """
+    프로세스 공용 CacheWarmer를 반환합니다.
+    설정이 바뀔 때(서비스 켜기, 시스템 프롬프트/모델 변경) 자동으로 데우도록 ConfigRefresher에 등록합니다.
+    서비스가 꺼진 채로 시작한 프로세스도 B2를 켜면 데우도록, main()이 실행마다 서비스 상태를 보기 전에 부릅니다.
+    """
+    warmer = CacheWarmer()
+    get_config_refresher().subscribe(warmer.on_config_change)
+    return warmer